@@ -1,34 +1,972 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from transformers import AutoConfig, AutoTokenizer, AutoModelForCausalLM, DynamicCache
 import torch
+import torch.nn.functional as F
 import os
+import hashlib
+import itertools
+import json
+import math
+import re
+import sys
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# service_common.py sits next to this file in the image and in ../common in a checkout
+# (PRIORITY_CLASSES is also read by the orchestrators' --in-process mode)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from service_common import PRIORITY_CLASSES, Admission, Readiness, install_admission  # noqa: E402
 
 app = Flask(__name__)
 CORS(app)  # Allow CORS from all domains
 
-# Set your local model directory
-model_dir = "./model/Qwen3-0.6B"
-print(f"🔄 Loading Qwen3-0.6B from local directory: {model_dir}")
+# Set your local model directory (CHAT_MODEL_DIR may also name a hub model id)
+model_dir = os.environ.get("CHAT_MODEL_DIR", "./model/Qwen3-0.6B")
+
+# === Stub mode ===
+# STUB_MODELS=1 keeps the tokenizer and the Qwen3 architecture but swaps the
+# weights for a tiny randomly initialized model, so the service starts in
+# seconds on a CPU-only box (see benchmark.py). Replies are noise.
+STUB_MODELS = os.environ.get("STUB_MODELS", "0") == "1"
+STUB_DIMS = dict(
+    hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+    num_attention_heads=4, num_key_value_heads=2, head_dim=16,
+)
+
+# === Loading config ===
+# The tokenizer and the model load side by side on a background thread while
+# the app already answers /health (liveness). /ready reports the progress and
+# answers 200 once the model is loaded and warmed up; until then the other
+# endpoints answer 503. LOAD_IN_BACKGROUND=0 loads during import instead.
+LOAD_IN_BACKGROUND = os.environ.get("LOAD_IN_BACKGROUND", "1") == "1"
 
-tokenizer = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
-model = AutoModelForCausalLM.from_pretrained(model_dir, trust_remote_code=True)
 device = "cuda" if torch.cuda.is_available() else "cpu"
-model.to(device)
-model.eval()
+tokenizer = None  # set by load()
+model = None
+
+
+def load_tokenizer():
+    return AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
+
+
+def load_model():
+    if STUB_MODELS:
+        print(f"🔄 Building a stub Qwen3 model from the config in: {model_dir}")
+        config = AutoConfig.from_pretrained(model_dir, trust_remote_code=True)
+        config.update(STUB_DIMS)
+        loaded = AutoModelForCausalLM.from_config(config, trust_remote_code=True)
+    else:
+        print(f"🔄 Loading Qwen3-0.6B from local directory: {model_dir}")
+        loaded = AutoModelForCausalLM.from_pretrained(model_dir, trust_remote_code=True)
+    loaded.to(device)
+    loaded.eval()
+    return loaded
+
 
 @app.route("/health")
 def healthCheck():
     return "Coversational Service is Up!!"
 
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    data = request.get_json(force=True)
-    user_input = data.get('input', '')
-    history = data.get('history', [])  # List of dicts: [{"role": "user", "content": ...}, ...]
+# === Batching config ===
+# An idle scheduler waits CHAT_BATCH_WINDOW_MS after the first request so that
+# requests arriving together share one padded prefill. While a batch is running,
+# new requests join it between decode steps, up to CHAT_MAX_BATCH_SIZE rows.
+BATCH_WINDOW_MS = float(os.environ.get("CHAT_BATCH_WINDOW_MS", "20"))
+MAX_BATCH_SIZE = int(os.environ.get("CHAT_MAX_BATCH_SIZE", "8"))
+
+# === Session config ===
+# Turn logs are kept for up to CHAT_MAX_SESSIONS sessions; their KV caches share
+# a CHAT_SESSION_CACHE_MB budget and are evicted least-recently-used.
+MAX_SESSIONS = int(os.environ.get("CHAT_MAX_SESSIONS", "1000"))
+SESSION_CACHE_MB = float(os.environ.get("CHAT_SESSION_CACHE_MB", "256"))
+
+# === Prompt budget config ===
+# History is windowed so that the prompt stays under CHAT_MAX_PROMPT_TOKENS
+# (0 disables the limit). When the window has to move it is shrunk to
+# WINDOW_LOW_WATERMARK of the budget, so a session's window start (and with it
+# the cached KV prefix) stays put for several turns instead of every turn.
+MAX_PROMPT_TOKENS = int(os.environ.get("CHAT_MAX_PROMPT_TOKENS", "3072"))
+MEMORY_TOKENS = int(os.environ.get("CHAT_MEMORY_TOKENS", "160"))
+WINDOW_LOW_WATERMARK = 0.75
+MESSAGE_OVERHEAD_TOKENS = 5  # <|im_start|>role\n ... <|im_end|>\n
+
+# === Speculative decoding config ===
+# With CHAT_DRAFT_TOKENS > 0 (per request: draft_tokens) every decode step
+# drafts up to that many tokens by prompt lookup: the tokens that followed the
+# latest earlier occurrence of the sequence's last n tokens (n up to
+# CHAT_PROMPT_LOOKUP_NGRAM) in the prompt or reply. One forward pass checks all
+# drafts, so replies that repeat their input (translations, quotes) decode
+# several tokens per pass. Greedy output is unchanged and sampled output keeps
+# its distribution.
+DRAFT_TOKENS = int(os.environ.get("CHAT_DRAFT_TOKENS", "0"))
+PROMPT_LOOKUP_NGRAM = int(os.environ.get("CHAT_PROMPT_LOOKUP_NGRAM", "3"))
+
+# === Response cache config ===
+# With CHAT_RESPONSE_CACHE_SIZE > 0 finished replies are kept for
+# CHAT_RESPONSE_CACHE_TTL seconds, keyed by the normalized input and a
+# fingerprint of the last CHAT_RESPONSE_CACHE_HISTORY history messages and the
+# sampling options. Hits skip the model; a request can opt out with
+# "cache": false.
+# With CHAT_RESPONSE_CACHE_SEMANTIC=1 an input that misses the exact key is
+# also embedded (mean of the model's last hidden states) and served the reply
+# of the most similar cached input with the same fingerprint, if the cosine
+# similarity reaches CHAT_RESPONSE_CACHE_SIMILARITY. This is off by default:
+# mean-pooled hidden states of a causal LM all point roughly the same way, so
+# unrelated inputs can score above 0.9. Tune the threshold on real traffic.
+RESPONSE_CACHE_SIZE = int(os.environ.get("CHAT_RESPONSE_CACHE_SIZE", "0"))
+RESPONSE_CACHE_TTL = float(os.environ.get("CHAT_RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SEMANTIC = os.environ.get("CHAT_RESPONSE_CACHE_SEMANTIC", "0") == "1"
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get("CHAT_RESPONSE_CACHE_SIMILARITY", "0.98"))
+RESPONSE_CACHE_HISTORY = int(os.environ.get("CHAT_RESPONSE_CACHE_HISTORY", "2"))
+
+# === Tracing config ===
+# Requests carry an X-Request-ID (generated when the caller sends none) that is
+# echoed back and tagged on the stage spans. With TRACE_LOG=1 every finished
+# request prints its spans.
+REQUEST_ID_HEADER = "X-Request-ID"
+TRACE_LOG = os.environ.get("TRACE_LOG", "0") == "1"
+
+# === Admission config ===
+# /chat and /chat/stream run at most CHAT_MAX_IN_FLIGHT requests at once and
+# queue up to CHAT_MAX_QUEUED more; past that they answer 429 straight away
+# with Retry-After: CHAT_RETRY_AFTER seconds (so does the 503 while loading).
+# Requests sent with "X-Priority: batch" wait, here and for a batch slot, behind
+# interactive ones. A request sent with "X-Request-Timeout: <seconds>" is
+# dropped unrun (504) if that runs out before it gets a slot or joins the
+# batch. In-flight plus queued stays below the gunicorn threads, so a refusal
+# never waits for a thread.
+MAX_IN_FLIGHT = int(os.environ.get("CHAT_MAX_IN_FLIGHT", "16"))
+MAX_QUEUED = int(os.environ.get("CHAT_MAX_QUEUED", "8"))
+RETRY_AFTER_SECONDS = int(os.environ.get("CHAT_RETRY_AFTER", "1"))
+
+# === Metrics ===
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STAGE_SECONDS = Histogram(
+    "chat_stage_seconds", "Time a chat request spends in each stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+TOKENS_PER_SECOND = Histogram(
+    "chat_decode_tokens_per_second", "Decode speed of each chat request",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+GENERATED_TOKENS = Counter("chat_generated_tokens", "Tokens generated")
+PROMPT_TOKENS = Counter("chat_prompt_tokens", "Prompt tokens submitted")
+CACHED_TOKENS = Counter("chat_cached_prompt_tokens", "Prompt tokens served from a session KV cache")
+QUEUE_DEPTH = Gauge("chat_queue_depth", "Requests waiting to join the batch")
+ACTIVE_ROWS = Gauge("chat_active_rows", "Rows in the running batch")
+DECODE_BATCH_SIZE = Histogram("chat_decode_batch_size", "Rows per decode step", buckets=(1, 2, 4, 8, 16, 32, 64))
+PREFILL_BATCH_SIZE = Histogram("chat_prefill_batch_size", "Requests per prefill", buckets=(1, 2, 4, 8, 16, 32, 64))
+DRAFTED_TOKENS = Counter("chat_drafted_tokens", "Tokens proposed by prompt-lookup drafting")
+ACCEPTED_DRAFT_TOKENS = Counter("chat_accepted_draft_tokens", "Drafted tokens the model accepted")
+RESPONSE_CACHE_LOOKUPS = Counter("chat_response_cache_lookups", "Response cache lookups", ["result"])
+REFUSED = Counter("chat_refused_requests", "Requests refused by admission control", ["status"])
+
+# Default sampling settings, each one can be overridden in the request body
+# within OPTION_LIMITS (anything else is answered with 400). max_new_tokens is
+# capped at CHAT_MAX_NEW_TOKENS_LIMIT.
+GENERATION_DEFAULTS = dict(
+    max_new_tokens=512,
+    do_sample=True,
+    temperature=0.7,
+    top_p=0.9,
+    repetition_penalty=1.1,
+    draft_tokens=DRAFT_TOKENS,
+)
+MAX_NEW_TOKENS_LIMIT = int(os.environ.get("CHAT_MAX_NEW_TOKENS_LIMIT", "2048"))
+OPTION_LIMITS = dict(
+    max_new_tokens=(1, MAX_NEW_TOKENS_LIMIT),
+    temperature=(0.01, 5.0),
+    top_p=(0.01, 1.0),
+    repetition_penalty=(0.1, 10.0),
+    draft_tokens=(0, 64),
+)
+
+
+def checked(data, key, default, low=None, high=None):
+    """
+    data[key], or default when it is missing, checked to be of the default's
+    type (a JSON true/false for bools, a finite number for floats) and to lie
+    in [low, high]. Raises ValueError naming the field otherwise.
+    """
+    value = data.get(key, default)
+    if isinstance(default, bool):
+        valid = isinstance(value, bool)
+    elif isinstance(default, int):
+        valid = isinstance(value, int) and not isinstance(value, bool)
+    else:
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+    if not valid:
+        raise ValueError(f"{key} must be a {type(default).__name__}, got {value!r}.")
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise ValueError(f"{key} must be between {low} and {high}, got {value!r}.")
+    return type(default)(value)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+# Set by load() from the tokenizer and the model's generation config
+EOS_TOKEN_IDS = set()
+PAD_TOKEN_ID = None
+
+
+class ChatRequest:
+    """One generation job. Iterating over it yields token ids as they are decoded."""
+
+    def __init__(self, input_ids, max_new_tokens, do_sample, temperature, top_p, repetition_penalty,
+                 draft_tokens=0, session_id=None, prefix=None, priority=0, deadline=None):
+        self.input_ids = input_ids
+        self.session_id = session_id
+        self.prefix = prefix  # (KV layers, length) of a cached prompt prefix, if any
+        self.cached_tokens = prefix[1] if prefix else 0
+        self.budget = {}
+        self.max_new_tokens = max(1, max_new_tokens)
+        self.do_sample = do_sample and temperature > 0
+        self.temperature = temperature
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+        self.draft_tokens = draft_tokens
+        self.drafted_tokens = 0
+        self.accepted_tokens = 0  # drafted tokens that passed verification
+        self.cache_key = None     # response cache key, when the request may be cached
+        self.cache_vector = None  # embedding of the input, for the semantic tier
+        self.cache_match = None   # "exact" or "semantic" when the reply came from the cache
+        self.cache_similarity = None
+        self.generated = []
+        self.cancelled = False
+        self.done = False
+        self.error = None
+        self.priority = priority  # lower runs first
+        self.deadline = deadline  # time.monotonic() after which the caller no longer waits
+        self.expired = False
+        self._closed = False
+        self._tokens = queue.Queue()
+        self.request_id = None
+        self.tokenize_seconds = 0.0
+        self.submitted_at = time.perf_counter()
+        self.admitted_at = None     # prefill started
+        self.first_token_at = None  # prefill done, first token sampled
+        self.finished_at = None
+
+    def emit(self, token_id):
+        self.generated.append(token_id)
+        self._tokens.put(token_id)
+
+    def finish(self, error=None):
+        """Mark the request finished, record its spans and release its reader."""
+        if self._closed:
+            return
+        self._closed = True
+        self.done = True
+        self.error = error
+        self.finished_at = time.perf_counter()
+        if error is None and self.first_token_at is not None:
+            self._observe()
+        self._tokens.put(None)
+
+    def spans(self):
+        """Seconds spent in each stage; stages the request never reached are left out."""
+        spans = {"tokenize": self.tokenize_seconds}
+        if self.admitted_at is not None:
+            spans["queue"] = self.admitted_at - self.submitted_at
+        if self.first_token_at is not None:
+            spans["prefill"] = self.first_token_at - self.admitted_at
+        if self.finished_at is not None and self.first_token_at is not None:
+            spans["decode"] = self.finished_at - self.first_token_at
+        return spans
+
+    def timing(self):
+        spans = self.spans()
+        report = {f"{stage}_ms": round(seconds * 1000, 1) for stage, seconds in spans.items()}
+        report["generated_tokens"] = len(self.generated)
+        if spans.get("decode"):
+            report["tokens_per_second"] = round(len(self.generated) / spans["decode"], 1)
+        if self.drafted_tokens:
+            report["drafted_tokens"] = self.drafted_tokens
+            report["accepted_draft_tokens"] = self.accepted_tokens
+            report["draft_acceptance"] = round(self.accepted_tokens / self.drafted_tokens, 3)
+        return report
+
+    def _observe(self):
+        spans = self.spans()
+        for stage, seconds in spans.items():
+            STAGE_SECONDS.labels(stage).observe(seconds)
+        GENERATED_TOKENS.inc(len(self.generated))
+        PROMPT_TOKENS.inc(len(self.input_ids))
+        CACHED_TOKENS.inc(self.cached_tokens)
+        DRAFTED_TOKENS.inc(self.drafted_tokens)
+        ACCEPTED_DRAFT_TOKENS.inc(self.accepted_tokens)
+        if spans.get("decode"):
+            TOKENS_PER_SECOND.observe(len(self.generated) / spans["decode"])
+        if TRACE_LOG:
+            print(f"[TRACE] {self.request_id} chat " + " ".join(f"{k}={v}" for k, v in self.timing().items()))
+
+    def __iter__(self):
+        while True:
+            token_id = self._tokens.get()
+            if token_id is None:
+                break
+            yield token_id
+        if self.error is not None:
+            raise RuntimeError(f"Generation failed: {self.error}")
+
+
+def penalize(logits, reqs, seen):
+    """Apply every row's repetition penalty to the tokens it has seen."""
+    logits = logits.float()
+    penalty = torch.tensor([r.repetition_penalty for r in reqs], device=logits.device)[:, None]
+    return torch.where(seen, torch.where(logits < 0, logits * penalty, logits / penalty), logits)
+
+
+def nucleus(logits, reqs):
+    """Every row's temperature and top-p; returns the kept probabilities in descending order and their token ids."""
+    temperature = torch.tensor([r.temperature if r.do_sample else 1.0 for r in reqs], device=logits.device)[:, None]
+    top_p = torch.tensor([r.top_p for r in reqs], device=logits.device)[:, None]
+    probs = torch.softmax(logits / temperature, dim=-1)
+    sorted_probs, sorted_ids = probs.sort(dim=-1, descending=True)
+    # Drop tokens outside the nucleus, always keeping the most likely one
+    sorted_probs = sorted_probs.masked_fill(sorted_probs.cumsum(dim=-1) - sorted_probs > top_p, 0.0)
+    return sorted_probs, sorted_ids
+
+
+def sample_next_tokens(logits, reqs, seen):
+    """Pick the next token of every row using that row's own sampling parameters."""
+    logits = penalize(logits, reqs, seen)
+    greedy = logits.argmax(dim=-1)
+    sampling = [r.do_sample for r in reqs]
+    if not any(sampling):
+        return greedy
+
+    sorted_probs, sorted_ids = nucleus(logits, reqs)
+    sampled = sorted_ids.gather(-1, torch.multinomial(sorted_probs, 1)).squeeze(-1)
+    return torch.where(torch.tensor(sampling, device=logits.device), sampled, greedy)
+
+
+def propose_drafts(req, max_ngram=PROMPT_LOOKUP_NGRAM):
+    """
+    Prompt-lookup drafting: find the latest earlier occurrence of the last n
+    tokens of the prompt and reply, longest n first, and propose the tokens
+    that followed it. Leaves room for the token the verification adds.
+    """
+    limit = min(req.draft_tokens, req.max_new_tokens - len(req.generated) - 1)
+    if limit <= 0:
+        return []
+    ids = req.input_ids + req.generated
+    for n in range(min(max_ngram, len(ids) - 1), 0, -1):
+        tail = ids[-n:]
+        for i in range(len(ids) - n - 1, -1, -1):
+            if ids[i + n - 1] == tail[-1] and ids[i:i + n] == tail:
+                return ids[i + n:i + n + limit]
+    return []
+
+
+def verify_drafts(logits, reqs, seen, drafts):
+    """
+    Check drafted tokens against one forward pass. logits[:, j] predicts the
+    token after the row's first j drafts. A greedy row keeps drafts while they
+    match its argmax; a sampling row keeps draft d with probability p(d) and
+    otherwise samples from p without d, which is exactly p overall. Returns,
+    per row, the accepted drafts followed by the token chosen at the first
+    rejected position (or after the last draft).
+    """
+    rows, steps, vocab = logits.shape
+    draft_ids = torch.zeros((rows, steps - 1), dtype=torch.long, device=logits.device)
+    for i, draft in enumerate(drafts):
+        draft_ids[i, :len(draft)] = torch.tensor(draft, dtype=torch.long)
+    # The repetition penalty at position j also covers the drafts before it
+    seen = seen[:, None, :].repeat(1, steps, 1)
+    for j in range(steps - 1):
+        index = torch.tensor([i for i, draft in enumerate(drafts) if len(draft) > j], device=logits.device)
+        seen[index, j + 1:, draft_ids[index, j]] = True
+
+    flat = [r for r in reqs for _ in range(steps)]
+    logits = penalize(logits.reshape(rows * steps, vocab), flat, seen.reshape(rows * steps, vocab))
+    greedy = logits.argmax(dim=-1).view(rows, steps).tolist()
+    probs = None
+    if any(r.do_sample for r in reqs):
+        sorted_probs, sorted_ids = nucleus(logits, flat)
+        probs = torch.zeros_like(sorted_probs).scatter_(-1, sorted_ids, sorted_probs)
+        probs = (probs / probs.sum(dim=-1, keepdim=True)).view(rows, steps, vocab)
+
+    emitted = []
+    for i, (req, draft) in enumerate(zip(reqs, drafts)):
+        tokens = []
+        for j, token_id in enumerate(draft + [None]):
+            if not req.do_sample:
+                tokens.append(greedy[i][j])
+                if token_id != greedy[i][j]:
+                    break
+            elif token_id is not None and float(torch.rand(())) < float(probs[i, j, token_id]):
+                tokens.append(token_id)
+            else:
+                residual = probs[i, j].clone()
+                if token_id is not None:
+                    residual[token_id] = 0.0
+                tokens.append(int(torch.multinomial(residual, 1)))
+                break
+        emitted.append(tokens)
+    return emitted
+
+
+def merge_batches(cache_a, mask_a, cache_b, mask_b):
+    """Stack two cached batches along the batch axis, left-padding the shorter one."""
+    length = max(mask_a.shape[1], mask_b.shape[1])
+    layers = []
+    for (key_a, value_a), (key_b, value_b) in zip(cache_a.to_legacy_cache(), cache_b.to_legacy_cache()):
+        pad_a, pad_b = length - key_a.shape[2], length - key_b.shape[2]
+        layers.append((
+            torch.cat([F.pad(key_a, (0, 0, pad_a, 0)), F.pad(key_b, (0, 0, pad_b, 0))]),
+            torch.cat([F.pad(value_a, (0, 0, pad_a, 0)), F.pad(value_b, (0, 0, pad_b, 0))]),
+        ))
+    mask = torch.cat([
+        F.pad(mask_a, (length - mask_a.shape[1], 0)),
+        F.pad(mask_b, (length - mask_b.shape[1], 0)),
+    ])
+    return DynamicCache.from_legacy_cache(tuple(layers)), mask
+
+
+def select_rows(cache, mask, index):
+    """Keep the given batch rows and drop leading columns that are padding in all of them."""
+    mask = mask[index]
+    start = int(mask.any(dim=0).int().argmax())
+    layers = tuple(
+        (key[index, :, start:], value[index, :, start:])
+        for key, value in cache.to_legacy_cache()
+    )
+    return DynamicCache.from_legacy_cache(layers), mask[:, start:]
+
+
+class SessionStore:
+    """
+    Server-side conversations. Every session has an append-only turn log and,
+    memory permitting, the KV cache of the tokens it last ran through the model.
+    A new turn reuses the cache up to the longest prefix it shares with the new
+    prompt, so only the remaining tokens are prefilled. Caches that no longer
+    fit in the memory budget are evicted least-recently-used, and an evicted
+    session simply prefills its whole prompt again.
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS, cache_mb=SESSION_CACHE_MB):
+        self.max_sessions = max_sessions
+        self.cache_budget = int(cache_mb * 2 ** 20)
+        self.cache_bytes = 0
+        self._turns = OrderedDict()   # session id -> list of chat messages
+        self._window = {}             # session id -> index of the first turn in the prompt window
+        self._caches = OrderedDict()  # session id -> (token ids, KV layers, size in bytes)
+        self._lock = threading.Lock()
+
+    def create(self, history=None):
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._turns[session_id] = list(history or [])
+            while len(self._turns) > self.max_sessions:
+                oldest, _ = self._turns.popitem(last=False)
+                self._window.pop(oldest, None)
+                self._drop_cache(oldest)
+        return session_id
+
+    def turns(self, session_id):
+        with self._lock:
+            if session_id not in self._turns:
+                return None
+            self._turns.move_to_end(session_id)
+            return list(self._turns[session_id])
+
+    def append(self, session_id, user_input, reply):
+        with self._lock:
+            if session_id in self._turns:
+                self._turns[session_id].append({"role": "user", "content": user_input})
+                self._turns[session_id].append({"role": "assistant", "content": reply})
+
+    def window_start(self, session_id):
+        return self._window.get(session_id, 0)
+
+    def set_window_start(self, session_id, start):
+        with self._lock:
+            if session_id in self._turns:
+                self._window[session_id] = start
+
+    def delete(self, session_id):
+        with self._lock:
+            self._window.pop(session_id, None)
+            self._drop_cache(session_id)
+            return self._turns.pop(session_id, None) is not None
+
+    def checkout(self, session_id, input_ids):
+        """
+        Take the session's cache for a new prompt. Returns (KV layers, length)
+        for the longest shared prefix, or None when nothing can be reused.
+        """
+        with self._lock:
+            entry = self._drop_cache(session_id)
+        if entry is None:
+            return None
+        cached_ids, layers, _ = entry
+        length = 0
+        for a, b in zip(cached_ids, input_ids):
+            if a != b:
+                break
+            length += 1
+        length = min(length, len(input_ids) - 1)  # at least one token must be prefilled
+        if length <= 0:
+            return None
+        return tuple((key[:, :, :length], value[:, :, :length]) for key, value in layers), length
+
+    def store(self, session_id, token_ids, layers):
+        size = sum(key.numel() * key.element_size() + value.numel() * value.element_size() for key, value in layers)
+        with self._lock:
+            if session_id not in self._turns or size > self.cache_budget:
+                return
+            self._drop_cache(session_id)
+            self._caches[session_id] = (token_ids, layers, size)
+            self.cache_bytes += size
+            while self.cache_bytes > self.cache_budget:
+                self._drop_cache(next(iter(self._caches)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._turns),
+                "cached_sessions": len(self._caches),
+                "cache_mb": round(self.cache_bytes / 2 ** 20, 2),
+            }
+
+    def _drop_cache(self, session_id):
+        entry = self._caches.pop(session_id, None)
+        if entry is not None:
+            self.cache_bytes -= entry[2]
+        return entry
+
+
+class ResponseCache:
+    """
+    Replies to earlier prompts, in two tiers. The exact tier looks up the
+    (history fingerprint, normalized input) key; the semantic tier, when
+    match_similar is set, compares the input's unit embedding against those
+    of all cached inputs with one matrix product and takes the most similar
+    one with the same fingerprint.
+    Entries expire after ttl seconds and are evicted least-recently-used
+    beyond max_size.
+    """
+
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL,
+                 threshold=RESPONSE_CACHE_SIMILARITY, match_similar=RESPONSE_CACHE_SEMANTIC):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.match_similar = match_similar
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (token ids, created at, index row)
+        self._keys = [None] * max_size  # index row -> key
+        self._free = list(range(max_size))
+        self._vectors = None  # [max_size, hidden] embeddings, allocated by the first put
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @property
+    def semantic(self):
+        return self.enabled and self.match_similar and self.threshold < 1
+
+    @property
+    def searchable(self):
+        """Whether the semantic tier holds anything to compare an embedding against."""
+        return self._vectors is not None and len(self._entries) > 0
+
+    def get(self, key):
+        """Token ids of the reply cached under key, or None."""
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                return None
+            self.hits["exact"] += 1
+            return entry[0]
+
+    def search(self, fingerprint, vector):
+        """(token ids, similarity) of the closest cached input with the same fingerprint, or None."""
+        with self._lock:
+            if self._vectors is not None:
+                scores = self._vectors @ vector
+                rows = (scores >= self.threshold).nonzero().squeeze(-1).tolist()
+                for row in sorted(rows, key=lambda r: -float(scores[r])):
+                    key = self._keys[row]
+                    if key is None or key[0] != fingerprint:
+                        continue
+                    entry = self._live(key)
+                    if entry is not None:
+                        self.hits["semantic"] += 1
+                        return entry[0], round(float(scores[row]), 4)
+            self.misses += 1
+            return None
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key, vector, token_ids):
+        with self._lock:
+            self._drop(key)
+            if not self._free:
+                self._drop(next(iter(self._entries)))
+            row = self._free.pop()
+            if vector is not None:
+                if self._vectors is None:
+                    self._vectors = vector.new_zeros((self.max_size, vector.shape[0]))
+                self._vectors[row] = vector
+            self._keys[row] = key
+            self._entries[key] = (list(token_ids), time.monotonic(), row)
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self.hits.values()) + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_s": self.ttl,
+                "similarity_threshold": self.threshold,
+                "exact_hits": self.hits["exact"],
+                "semantic_hits": self.hits["semantic"],
+                "misses": self.misses,
+                "hit_rate": round(sum(self.hits.values()) / lookups, 4) if lookups else 0.0,
+            }
+
+    def _live(self, key):
+        """The entry under key, dropping it when expired; marks it recently used."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > self.ttl:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            row = entry[2]
+            self._keys[row] = None
+            if self._vectors is not None:
+                self._vectors[row] = 0
+            self._free.append(row)
+
+
+class BatchScheduler:
+    """
+    Continuous batching over a single model. Each iteration admits waiting
+    requests (one left-padded prefill merged into the running batch), runs
+    one decode step for every active row and retires the rows that finished,
+    so their slots can be taken by new requests on the next iteration. Other
+    uses of the model go through call(), so they never run alongside a step.
+    """
+
+    def __init__(self, model, sessions, window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE):
+        self.model = model
+        self.sessions = sessions
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.pending = queue.PriorityQueue()  # (priority, arrival, ChatRequest or None to wake the loop)
+        self._arrivals = itertools.count()
+        self._calls = queue.Queue()  # (function, Future) to run between steps
+        self.rows = []              # active ChatRequests, in batch order
+        self.cache = None           # DynamicCache shared by the active rows
+        self.attention_mask = None  # [rows, cache length], 0 marks left padding
+        self.next_tokens = None     # [rows] tokens fed to the next decode step
+        self.seen = None            # [rows, vocab] tokens subject to the repetition penalty
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, req):
+        self.pending.put((req.priority, next(self._arrivals), req))
+        return req
+
+    def call(self, fn):
+        """Run fn() on the scheduler thread between decode steps and return its result."""
+        if threading.current_thread() is self._thread:
+            return fn()
+        future = Future()
+        self._calls.put((fn, future))
+        self.pending.put((-1, next(self._arrivals), None))
+        return future.result()
+
+    def _run_calls(self):
+        while True:
+            try:
+                fn, future = self._calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                with torch.no_grad():
+                    future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+
+    def _collect(self):
+        """Take waiting requests: block while idle, then wait out the batching window."""
+        free = self.max_batch_size - len(self.rows)
+        batch = []
+        if not self.rows:
+            first = self.pending.get()[-1]
+            if first is None:  # woken up for call()
+                return []
+            batch.append(first)
+            deadline = time.monotonic() + self.window
+            while len(batch) < free:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=timeout)[-1])
+                except queue.Empty:
+                    break
+        else:
+            while len(batch) < free:
+                try:
+                    batch.append(self.pending.get_nowait()[-1])
+                except queue.Empty:
+                    break
+        batch = [req for req in batch if req is not None]
+        now = time.monotonic()
+        for req in batch:
+            if req.cancelled:
+                req.finish()
+            elif req.deadline is not None and req.deadline <= now:
+                req.expired = True
+                req.finish(error="its deadline passed before it joined the batch")
+        return [req for req in batch if not req.done]
+
+    def _loop(self):
+        while True:
+            admitted = self._collect()
+            self._run_calls()
+            try:
+                with torch.no_grad():
+                    if admitted:
+                        self._admit(admitted)
+                    if self.rows:
+                        self._step()
+            except Exception as e:
+                print(f"[ERROR] Batched generation failed: {e}")
+                for req in self.rows + admitted:
+                    req.finish(error=str(e))
+                self.rows, self.cache, self.attention_mask = [], None, None
+                self.next_tokens, self.seen = None, None
 
-    # Format prompt for Qwen3
+    def _admit(self, reqs):
+        """
+        Prefill new requests and merge them into the running batch. Fresh
+        prompts share one left-padded prefill; requests resuming a session
+        cache are prefilled one by one on top of their cached prefix.
+        """
+        fresh = [r for r in reqs if r.prefix is None]
+        groups = ([fresh] if fresh else []) + [[r] for r in reqs if r.prefix is not None]
+        for group in groups:
+            admitted_at = time.perf_counter()
+            for r in group:
+                r.admitted_at = admitted_at
+            PREFILL_BATCH_SIZE.observe(len(group))
+            cache, attention_mask, logits = self._prefill(group)
+            seen = torch.zeros((len(group), logits.shape[-1]), dtype=torch.bool, device=device)
+            for i, r in enumerate(group):
+                seen[i, r.input_ids] = True
+                r.prefix = None
+            tokens = sample_next_tokens(logits, group, seen)
+            self._record(group, [[token_id] for token_id in tokens.tolist()], seen)
+
+            if self.rows:
+                self.cache, self.attention_mask = merge_batches(self.cache, self.attention_mask, cache, attention_mask)
+                self.seen = torch.cat([self.seen, seen])
+                self.next_tokens = torch.cat([self.next_tokens, tokens])
+            else:
+                self.cache, self.attention_mask = cache, attention_mask
+                self.seen, self.next_tokens = seen, tokens
+            self.rows = self.rows + group
+        self._retire()
+
+    def _prefill(self, group):
+        """Run the prompt forward pass; returns (cache, attention mask, last-position logits)."""
+        if group[0].prefix is not None:
+            req = group[0]
+            layers, start = req.prefix
+            input_ids = torch.tensor([req.input_ids[start:]], device=device)
+            attention_mask = torch.ones((1, len(req.input_ids)), dtype=torch.long, device=device)
+            position_ids = torch.arange(start, len(req.input_ids), device=device)[None]
+            cache = DynamicCache.from_legacy_cache(layers)
+        else:
+            length = max(len(r.input_ids) for r in group)
+            input_ids = torch.full((len(group), length), PAD_TOKEN_ID, dtype=torch.long)
+            attention_mask = torch.zeros((len(group), length), dtype=torch.long)
+            for i, r in enumerate(group):
+                input_ids[i, length - len(r.input_ids):] = torch.tensor(r.input_ids)
+                attention_mask[i, length - len(r.input_ids):] = 1
+            input_ids, attention_mask = input_ids.to(device), attention_mask.to(device)
+            position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+            cache = DynamicCache()
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=cache,
+            use_cache=True,
+        )
+        return outputs.past_key_values, attention_mask, outputs.logits[:, -1, :]
+
+    def _step(self):
+        """Run one decode step for every active row."""
+        drafts = [propose_drafts(req) for req in self.rows]
+        if any(drafts):
+            return self._speculative_step(drafts)
+        DECODE_BATCH_SIZE.observe(len(self.rows))
+        self.attention_mask = torch.cat(
+            [self.attention_mask, self.attention_mask.new_ones((len(self.rows), 1))], dim=-1
+        )
+        outputs = self.model(
+            input_ids=self.next_tokens[:, None],
+            attention_mask=self.attention_mask,
+            position_ids=self.attention_mask.sum(-1, keepdim=True) - 1,
+            past_key_values=self.cache,
+            use_cache=True,
+        )
+        self.cache = outputs.past_key_values
+        self.next_tokens = sample_next_tokens(outputs.logits[:, -1, :], self.rows, self.seen)
+        self._record(self.rows, [[token_id] for token_id in self.next_tokens.tolist()], self.seen)
+        self._retire()
+
+    def _speculative_step(self, drafts):
+        """
+        Run one decode step that also feeds every row's drafted tokens. Rows
+        draft different amounts and accept different amounts, so the columns
+        of rejected (or padding) drafts stay in the cache but are masked out;
+        columns no row uses are cropped.
+        """
+        DECODE_BATCH_SIZE.observe(len(self.rows))
+        steps = 1 + max(len(draft) for draft in drafts)
+        input_ids = torch.full((len(self.rows), steps), PAD_TOKEN_ID, dtype=torch.long)
+        new_mask = torch.zeros((len(self.rows), steps), dtype=torch.long)
+        for i, draft in enumerate(drafts):
+            input_ids[i, 1:1 + len(draft)] = torch.tensor(draft, dtype=torch.long)
+            new_mask[i, :1 + len(draft)] = 1
+        input_ids[:, 0] = self.next_tokens.cpu()
+        self.attention_mask = torch.cat([self.attention_mask, new_mask.to(device)], dim=-1)
+        outputs = self.model(
+            input_ids=input_ids.to(device),
+            attention_mask=self.attention_mask,
+            position_ids=(self.attention_mask.cumsum(-1) - 1)[:, -steps:].clamp(min=0),
+            past_key_values=self.cache,
+            use_cache=True,
+        )
+        emitted = verify_drafts(outputs.logits, self.rows, self.seen, drafts)
+
+        width = self.attention_mask.shape[1]
+        for i, (req, draft, tokens) in enumerate(zip(self.rows, drafts, emitted)):
+            accepted = len(tokens) - 1
+            req.drafted_tokens += len(draft)
+            req.accepted_tokens += accepted
+            self.attention_mask[i, width - steps + 1 + accepted:] = 0
+        used = int(self.attention_mask.any(dim=0).nonzero().max()) + 1
+        self.attention_mask = self.attention_mask[:, :used]
+        self.cache = DynamicCache.from_legacy_cache(tuple(
+            (key[:, :, :used], value[:, :, :used]) for key, value in outputs.past_key_values.to_legacy_cache()
+        ))
+        self.next_tokens = torch.tensor([tokens[-1] for tokens in emitted], device=device)
+        self._record(self.rows, emitted, self.seen)
+        self._retire()
+
+    def _record(self, reqs, tokens, seen):
+        """
+        Hand each row its new tokens (one, or several after a speculative
+        step) and mark rows that hit EOS, their limit or were cancelled as
+        done. They are released in _retire, once any session cache has been
+        saved.
+        """
+        now = time.perf_counter()
+        for i, (req, token_ids) in enumerate(zip(reqs, tokens)):
+            seen[i, token_ids] = True
+            if req.first_token_at is None:
+                req.first_token_at = now
+            for token_id in token_ids:
+                if req.cancelled or token_id in EOS_TOKEN_IDS:
+                    req.done = True
+                    break
+                req.emit(token_id)
+                if len(req.generated) >= req.max_new_tokens:
+                    req.done = True
+                    break
+
+    def _retire(self):
+        """Drop finished rows from the batch, handing session rows' caches back to the store."""
+        keep = [i for i, req in enumerate(self.rows) if not req.done]
+        if len(keep) == len(self.rows):
+            return
+        for i, req in enumerate(self.rows):
+            if not req.done:
+                continue
+            if req.session_id is not None:
+                self._save_session(i, req)
+            req.finish()
+        if not keep:
+            self.rows, self.cache, self.attention_mask = [], None, None
+            self.next_tokens, self.seen = None, None
+            return
+        index = torch.tensor(keep, device=device)
+        self.cache, self.attention_mask = select_rows(self.cache, self.attention_mask, index)
+        self.seen, self.next_tokens = self.seen[index], self.next_tokens[index]
+        self.rows = [self.rows[i] for i in keep]
+
+    def _save_session(self, row, req):
+        # Only the unmasked columns: left padding and, after speculative steps, rejected drafts
+        token_ids = req.input_ids + req.generated
+        columns = self.attention_mask[row].nonzero().squeeze(-1)[:len(token_ids)]
+        layers = tuple(
+            (key[row:row + 1, :, columns], value[row:row + 1, :, columns])
+            for key, value in self.cache.to_legacy_cache()
+        )
+        self.sessions.store(req.session_id, token_ids[:len(columns)], layers)
+
+
+sessions = SessionStore()
+response_cache = ResponseCache()
+scheduler = None  # started by load()
+readiness = Readiness(["tokenizer", "model", "warm-up"])
+admission = Admission(MAX_IN_FLIGHT, MAX_QUEUED)
+
+
+def load():
+    """Load the tokenizer and model in parallel, start the scheduler and warm it up."""
+    global tokenizer, model, EOS_TOKEN_IDS, PAD_TOKEN_ID, scheduler
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        tokenizer_future = pool.submit(readiness.track, "tokenizer", load_tokenizer)
+        model_future = pool.submit(readiness.track, "model", load_model)
+        tokenizer, model = tokenizer_future.result(), model_future.result()
+    EOS_TOKEN_IDS = set(_as_list(model.generation_config.eos_token_id) + _as_list(tokenizer.eos_token_id))
+    PAD_TOKEN_ID = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    scheduler = BatchScheduler(model, sessions)
+    QUEUE_DEPTH.set_function(scheduler.pending.qsize)
+    ACTIVE_ROWS.set_function(lambda: len(scheduler.rows))
+    # A short reply runs prefill, decoding and sampling once, so the first real
+    # request does not pay for kernel selection and allocator warm-up
+    with readiness.step("warm-up"):
+        req = ChatRequest(encode_prompt("Hello!", []), **dict(GENERATION_DEFAULTS, max_new_tokens=4))
+        req.request_id = "warm-up"
+        list(scheduler.submit(req))
+
+
+def encode_prompt(user_input, history):
+    """Format the conversation with the Qwen3 chat template and tokenize it."""
     messages = history + [{"role": "user", "content": user_input}]
     prompt = tokenizer.apply_chat_template(
         messages,
@@ -36,27 +974,349 @@ def chat():
         add_generation_prompt=True,
         enable_thinking=False
     )
-    inputs = tokenizer(prompt, return_tensors="pt").to(device)
-
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=512,
-            do_sample=True,
-            temperature=0.7,
-            top_p=0.9,
-            repetition_penalty=1.1,
-            pad_token_id=tokenizer.eos_token_id
-        )
-    output_text = tokenizer.decode(outputs[0][inputs['input_ids'].shape[-1]:], skip_special_tokens=True)
+    return tokenizer(prompt)["input_ids"]
+
+
+def count_tokens(message):
+    """Tokens a message takes up in the Qwen3 chat template."""
+    return len(tokenizer(message["content"], add_special_tokens=False)["input_ids"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def summarize_turns(messages, max_tokens):
+    """
+    Compress turns that fell out of the window into one memory message made
+    of the first sentence of each, keeping the most recent ones that fit.
+    """
+    header = "Summary of the earlier conversation:"
+    lines, used = [], count_tokens({"content": header})
+    for message in reversed(messages):
+        first = re.split(r'(?<=[.!?])\s', message["content"].strip(), maxsplit=1)[0][:200]
+        line = f"- {'User' if message['role'] == 'user' else 'Assistant'}: {first}"
+        cost = len(tokenizer(line, add_special_tokens=False)["input_ids"]) + 1
+        if used + cost > max_tokens:
+            break
+        lines.insert(0, line)
+        used += cost
+    if not lines:
+        return None
+    return {"role": "system", "content": "\n".join([header] + lines)}
+
+
+def fit_history(history, user_input, max_prompt_tokens, summarize, start=0):
+    """
+    Window the history to the prompt budget. Leading system messages are always
+    kept, followed by the most recent turns that fit; the window starts on a
+    user message and never moves back before start. Dropped turns are either
+    discarded or, with summarize, folded into a memory message.
+    Returns (messages, window start, report).
+    """
+    system = []
+    for message in history:
+        if message.get("role") != "system":
+            break
+        system.append(message)
+    turns = history[len(system):]
+    counts = [count_tokens(m) for m in turns]
+    start = min(start, len(turns))
+
+    if max_prompt_tokens > 0:
+        budget = max_prompt_tokens - sum(count_tokens(m) for m in system)
+        budget -= count_tokens({"content": user_input}) + (MEMORY_TOKENS if summarize else 0)
+        total = sum(counts[start:])
+        if total > budget:
+            target = budget * WINDOW_LOW_WATERMARK
+            while start < len(turns) and (total > target or turns[start].get("role") != "user"):
+                total -= counts[start]
+                start += 1
+
+    removed = sum(counts[:start])
+    memory = summarize_turns(turns[:start], MEMORY_TOKENS) if summarize and start else None
+    report = {
+        "dropped_turns": start,
+        "dropped_tokens": 0 if memory else removed,
+        "compressed_tokens": removed if memory else 0,
+        "memory_tokens": count_tokens(memory) if memory else 0,
+    }
+    return system + ([memory] if memory else []) + turns[start:], start, report
+
+
+def normalize_input(text):
+    """Response cache form of an input: lower-cased, whitespace collapsed, outer punctuation dropped."""
+    return " ".join(text.lower().split()).strip(" .,!?;:'\"")
+
+
+def response_cache_key(user_input, history, options):
+    """(fingerprint of the recent history and sampling options, normalized input)."""
+    recent = history[-RESPONSE_CACHE_HISTORY:] if RESPONSE_CACHE_HISTORY > 0 else []
+    fingerprint = json.dumps({
+        "history": [[m.get("role"), normalize_input(m.get("content", ""))] for m in recent],
+        "options": {k: v for k, v in options.items() if k != "draft_tokens"},
+    }, sort_keys=True)
+    return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:16], normalize_input(user_input)
+
+
+def embed_text(text):
+    """
+    Unit embedding of a text: the mean of the model's last hidden states. The
+    forward pass runs on the scheduler thread, between decode steps.
+    """
+    input_ids = torch.tensor([tokenizer(text)["input_ids"] or [PAD_TOKEN_ID]], device=device)
+    hidden = scheduler.call(lambda: model.model(input_ids=input_ids).last_hidden_state[0])
+    return F.normalize(hidden.float().mean(dim=0), dim=0).cpu()
+
+
+def cached_reply(data, user_input, history, options):
+    """
+    Look the request up in the response cache. Returns a finished
+    ChatRequest carrying the cached reply on a hit, and otherwise the cache
+    fields for the request that will run (all None when it is not cached).
+    """
+    if not response_cache.enabled or not data.get('cache', True):
+        return None, {}
+    key = response_cache_key(user_input, history, options)
+    token_ids, match, similarity, vector = response_cache.get(key), "exact", None, None
+    if token_ids is None and response_cache.semantic and response_cache.searchable:
+        vector = embed_text(key[1])
+        found = response_cache.search(key[0], vector)
+        if found is not None:
+            (token_ids, similarity), match = found, "semantic"
+    elif token_ids is None:
+        response_cache.miss()
+    RESPONSE_CACHE_LOOKUPS.labels(match if token_ids is not None else "miss").inc()
+    if token_ids is None:
+        return None, dict(cache_key=key, cache_vector=vector)
+    req = ChatRequest([], **options, session_id=data.get('session_id'))
+    req.cache_match, req.cache_similarity = match, similarity
+    for token_id in token_ids:
+        req.emit(token_id)
+    return req, {}
+
+
+def remember_reply(req):
+    """Store a finished reply in the response cache, unless it came from there."""
+    if req.cache_key is not None and req.cache_match is None and req.error is None:
+        vector = req.cache_vector
+        if vector is None and response_cache.semantic:  # the lookup skipped it on an empty index
+            vector = embed_text(req.cache_key[1])
+        response_cache.put(req.cache_key, vector, req.generated)
+
+
+def finish_turn(req, user_input, output_text):
+    """Book a fully decoded reply: cache it and add the turn to its session."""
+    remember_reply(req)
+    if req.session_id:
+        sessions.append(req.session_id, user_input, output_text)
+
+
+def submit_chat(data, request_id, priority=0, deadline=None):
+    """
+    Queue a /chat request body on the scheduler, applying any per-request
+    sampling overrides. With a session_id the session's turn log replaces the
+    history field. A response cache hit is returned already finished, without
+    queueing. priority and deadline order and expire the request in the
+    scheduler queue. Raises KeyError for an unknown session and ValueError for
+    an invalid option. Also called in-process by the orchestrators'
+    --in-process mode, outside any Flask request.
+    """
+    start = time.perf_counter()
+    user_input = data.get('input', '')
+    session_id = data.get('session_id')
+    if session_id:
+        history = sessions.turns(session_id)
+        if history is None:
+            raise KeyError(session_id)
+    else:
+        history = data.get('history', [])  # List of dicts: [{"role": "user", "content": ...}, ...]
+    options = {
+        key: checked(data, key, default, *OPTION_LIMITS.get(key, ())) for key, default in GENERATION_DEFAULTS.items()
+    }
+
+    hit, cache_fields = cached_reply(data, user_input, history, options)
+    if hit is not None:
+        hit.request_id = request_id
+        hit.tokenize_seconds = time.perf_counter() - start
+        hit.finish()
+        return hit
+
+    # Keep the prompt inside the token budget (options: max_prompt_tokens, summarize_history)
+    history, window_start, budget = fit_history(
+        history,
+        user_input,
+        checked(data, 'max_prompt_tokens', MAX_PROMPT_TOKENS, 0),
+        checked(data, 'summarize_history', False),
+        start=sessions.window_start(session_id) if session_id else 0,
+    )
+    if session_id:
+        sessions.set_window_start(session_id, window_start)
+
+    input_ids = encode_prompt(user_input, history)
+    prefix = sessions.checkout(session_id, input_ids) if session_id else None
+    req = ChatRequest(input_ids, **options, session_id=session_id, prefix=prefix, priority=priority, deadline=deadline)
+    req.budget = dict(prompt_tokens=len(input_ids), **budget)
+    req.request_id = request_id
+    req.tokenize_seconds = time.perf_counter() - start
+    for field, value in cache_fields.items():
+        setattr(req, field, value)
+    return scheduler.submit(req)
+
+
+def usage_info(req):
+    """
+    Prompt budget report, stage timings and whether the reply came from the
+    response cache, plus the session id and reused KV prefix for session
+    requests.
+    """
+    info = {"budget": req.budget, "timing": req.timing(), "from_cache": req.cache_match is not None}
+    if req.cache_match is not None:
+        info.update(cache_match=req.cache_match, cache_similarity=req.cache_similarity)
+    if req.session_id is not None:
+        info.update(session_id=req.session_id, cached_tokens=req.cached_tokens)
+    return info
+
+
+def iter_text(req):
+    """Decode a request's tokens incrementally, yielding each new text fragment."""
+    ids, text = [], ""
+    for token_id in req:
+        ids.append(token_id)
+        decoded = tokenizer.decode(ids, skip_special_tokens=True)
+        if decoded.endswith("\ufffd"):  # incomplete multi-byte character
+            continue
+        if len(decoded) > len(text):
+            yield decoded[len(text):]
+        text = decoded
+
+
+@app.before_request
+def assign_request_id():
+    g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+
+
+@app.after_request
+def echo_request_id(response):
+    response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
+
+
+@app.before_request
+def require_ready():
+    """Answer 503 while the model is loading; liveness, readiness and metrics stay available."""
+    if not readiness.ready and request.endpoint not in ("healthCheck", "ready", "metrics"):
+        body = {"error": "Model is still loading.", **readiness.report()}
+        return jsonify(body), 503, {"Retry-After": str(RETRY_AFTER_SECONDS)}
+
+
+install_admission(app, admission, ("chat", "chat_stream"), REFUSED, RETRY_AFTER_SECONDS)
+
+
+@app.route('/ready')
+def ready():
+    return jsonify(readiness.report()), 200 if readiness.ready else 503
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+
+@app.route('/session', methods=['POST'])
+def create_session():
+    """Start a server-side conversation, optionally seeded with an existing history."""
+    data = request.get_json(silent=True) or {}
+    history = data.get('history', [])
+    if not isinstance(history, list) or not all(isinstance(m, dict) for m in history):
+        return jsonify({"error": f"history must be a list of messages, got {history!r}."}), 400
+    return jsonify({"session_id": sessions.create(history)}), 201
+
+
+@app.route('/session/<session_id>', methods=['GET'])
+def get_session(session_id):
+    turns = sessions.turns(session_id)
+    if turns is None:
+        return jsonify({"error": f"Unknown session: {session_id}"}), 404
+    return jsonify({"session_id": session_id, "turns": turns})
+
+
+@app.route('/session/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not sessions.delete(session_id):
+        return jsonify({"error": f"Unknown session: {session_id}"}), 404
+    return jsonify({"deleted": session_id})
+
+
+@app.route('/session/stats', methods=['GET'])
+def session_stats():
+    return jsonify(sessions.stats())
+
+
+@app.route('/cache/stats', methods=['GET'])
+def response_cache_stats():
+    return jsonify(response_cache.stats())
+
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    data = request.get_json(force=True)
+    user_input = data.get('input', '')
+    history = data.get('history', [])
+
+    try:
+        req = submit_chat(data, g.request_id, g.priority, g.deadline)
+    except KeyError as e:
+        return jsonify({"error": f"Unknown session: {e.args[0]}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        output_ids = list(req)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 504 if req.expired else 500
+    output_text = tokenizer.decode(output_ids, skip_special_tokens=True).strip()
 
     # Update history
-    history.append({"role": "user", "content": user_input})
-    history.append({"role": "assistant", "content": output_text.strip()})
+    finish_turn(req, user_input, output_text)
+    if not req.session_id:
+        history.append({"role": "user", "content": user_input})
+        history.append({"role": "assistant", "content": output_text})
 
     return jsonify({
-        "response": output_text.strip(),        # "history": history
+        "response": output_text,        # "history": history
+        **usage_info(req),
     })
 
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Same request body as /chat, but the reply is streamed as NDJSON:
+    one {"token": ...} line per decoded fragment, then a final
+    {"done": true, "response": ...} line with the full reply.
+    """
+    data = request.get_json(force=True)
+    try:
+        req = submit_chat(data, g.request_id, g.priority, g.deadline)
+    except KeyError as e:
+        return jsonify({"error": f"Unknown session: {e.args[0]}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def events():
+        parts = []
+        try:
+            for text in iter_text(req):
+                parts.append(text)
+                yield json.dumps({"token": text}) + "\n"
+        except RuntimeError as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+            return
+        finally:
+            req.cancelled = True  # stops decoding if the client went away
+        output_text = "".join(parts).strip()
+        finish_turn(req, data.get('input', ''), output_text)
+        yield json.dumps({"done": True, "response": output_text, **usage_info(req)}) + "\n"
+
+    return Response(stream_with_context(events()), mimetype="application/x-ndjson")
+
+readiness.run(load, LOAD_IN_BACKGROUND)
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "5000")))
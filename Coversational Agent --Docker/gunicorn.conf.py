@@ -0,0 +1,14 @@
+# Gunicorn settings for the chat service: gunicorn -c gunicorn.conf.py coverse:app
+#
+# A single worker process. The BatchScheduler thread already runs every
+# request in the same decode steps, so more processes would only split the
+# batch and hold one more copy of the weights each. Concurrency comes from the
+# HTTP threads, which queue requests for the scheduler and stream tokens back;
+# keep them above CHAT_MAX_IN_FLIGHT + CHAT_MAX_QUEUED so refusals never wait.
+import os
+
+bind = "0.0.0.0:" + os.environ.get("PORT", "5000")
+workers = 1
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", "32"))
+timeout = 300  # a streamed reply holds its thread until the last token
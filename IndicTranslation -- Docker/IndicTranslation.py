@@ -1,46 +1,447 @@
+import contextlib
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
 import torch
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from transformers import AutoConfig, AutoModelForSeq2SeqLM, AutoTokenizer
 from IndicTransToolkit.processor import IndicProcessor
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+)
+
+# service_common.py sits next to this file in the image and in ../common in a checkout
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from service_common import Admission, Readiness, install_admission  # noqa: E402
 
 '''
     TRANSLATION USING INDICTRANS MODELS.
     MODELS ARE BEING CASHED
 '''
 
+# === Cache config ===
+# Translations are kept in an in-process LRU of TRANSLATION_CACHE_SIZE entries
+# (0 disables caching). When TRANSLATION_CACHE_DB names a SQLite file, every
+# translation is also written there and the LRU is warmed from it at startup,
+# so the cache survives restarts. The file is opened in WAL mode, so readers and
+# the writer do not block each other, and a write waits up to
+# TRANSLATION_CACHE_DB_TIMEOUT seconds for another worker's lock. A failing
+# store is logged and treated as a cache miss, never as a failed translation.
+CACHE_SIZE = int(os.environ.get("TRANSLATION_CACHE_SIZE", "10000"))
+CACHE_DB = os.environ.get("TRANSLATION_CACHE_DB", "")
+CACHE_DB_TIMEOUT = float(os.environ.get("TRANSLATION_CACHE_DB_TIMEOUT", "5"))
+
+# === Batching config ===
+# Inputs are split into sentences; sentences longer than MAX_SOURCE_TOKENS are
+# split again at clause or word boundaries so nothing is truncated. Sentences
+# are sorted by length and cut into buckets of at most MAX_BATCH_SIZE rows and
+# MAX_BATCH_TOKENS padded tokens, which run on a pool of TRANSLATION_WORKERS.
+MAX_SOURCE_TOKENS = int(os.environ.get("TRANSLATION_MAX_SOURCE_TOKENS", "200"))
+MAX_BATCH_SIZE = int(os.environ.get("TRANSLATION_MAX_BATCH_SIZE", "32"))
+MAX_BATCH_TOKENS = int(os.environ.get("TRANSLATION_MAX_BATCH_TOKENS", "4096"))
+WORKERS = int(os.environ.get("TRANSLATION_WORKERS", "4"))
+
+# === Precision config ===
+# TRANSLATION_PRECISION is one of auto, fp16, fp32 or int8. auto picks fp16 on
+# CUDA and int8 (dynamic quantization of the linear layers) on CPU. fp16 on CPU
+# falls back to fp32, which is what CPUs compute in anyway, and int8 on CUDA
+# falls back to fp16. TRANSLATION_THREADS sets torch's intra-op thread count
+# (0 keeps torch's default).
+PRECISION = os.environ.get("TRANSLATION_PRECISION", "auto")
+PRECISIONS = ("fp16", "fp32", "int8")
+THREADS = int(os.environ.get("TRANSLATION_THREADS", "0"))
+
+# === Stub mode ===
+# STUB_MODELS=1 keeps the tokenizers and the IndicTrans2 architecture but swaps
+# the weights for tiny randomly initialized models, so the service starts in
+# seconds on a CPU-only box (see benchmark.py). Translations are noise.
+STUB_MODELS = os.environ.get("STUB_MODELS", "0") == "1"
+STUB_DIMS = dict(
+    d_model=64, encoder_embed_dim=64, decoder_embed_dim=64, decoder_output_dim=64,
+    encoder_layers=2, decoder_layers=2, encoder_attention_heads=4, decoder_attention_heads=4,
+    encoder_ffn_dim=128, decoder_ffn_dim=128,
+)
+
+# === Loading config ===
+# The tokenizers and models of both directions load in parallel on a
+# background thread while the app already answers /health (liveness). /ready
+# reports the progress and answers 200 once everything is loaded and warmed
+# up; until then /translate answers 503. Directions listed in
+# TRANSLATION_LAZY_DIRECTIONS (e.g. "kn-en") load their model on first use.
+# LOAD_IN_BACKGROUND=0 loads during import instead (gunicorn preload does).
+LOAD_IN_BACKGROUND = os.environ.get("LOAD_IN_BACKGROUND", "1") == "1"
+LAZY_DIRECTIONS = {d.strip() for d in os.environ.get("TRANSLATION_LAZY_DIRECTIONS", "").split(",") if d.strip()}
+MODEL_NAMES = {
+    "en-kn": "ai4bharat/indictrans2-en-indic-dist-200M",
+    "kn-en": "ai4bharat/indictrans2-indic-en-dist-200M",
+}
+WARMUP_SENTENCES = {"en-kn": ["Hello, how are you?"], "kn-en": ["ನಮಸ್ಕಾರ, ನೀವು ಹೇಗಿದ್ದೀರಿ?"]}
+
+# === Decoding config ===
+# /translate takes a "profile" and/or explicit num_beams / max_length. The
+# profile used when a request names none is TRANSLATION_PROFILE.
+DECODING_PROFILES = {
+    "fast": dict(num_beams=1, max_length=256),
+    "balanced": dict(num_beams=2, max_length=256),
+    "best": dict(num_beams=5, max_length=256),
+}
+DEFAULT_PROFILE = os.environ.get("TRANSLATION_PROFILE", "best")
+
+# === Tracing config ===
+# Requests carry an X-Request-ID (generated when the caller sends none) that is
+# echoed back; with TRACE_LOG=1 every request prints its stage timings under it.
+REQUEST_ID_HEADER = "X-Request-ID"
+TRACE_LOG = os.environ.get("TRACE_LOG", "0") == "1"
+
+# === Admission config ===
+# /translate runs at most TRANSLATION_MAX_IN_FLIGHT requests at once per
+# worker and queues up to TRANSLATION_MAX_QUEUED more; past that it answers
+# 429 straight away with Retry-After: TRANSLATION_RETRY_AFTER seconds (so does
+# the 503 while loading). "X-Priority: batch" requests wait behind interactive
+# ones, and a request whose "X-Request-Timeout: <seconds>" runs out while it
+# waits is dropped unrun (504). Keep in-flight plus queued below WEB_THREADS.
+MAX_IN_FLIGHT = int(os.environ.get("TRANSLATION_MAX_IN_FLIGHT", "4"))
+MAX_QUEUED = int(os.environ.get("TRANSLATION_MAX_QUEUED", "8"))
+RETRY_AFTER_SECONDS = int(os.environ.get("TRANSLATION_RETRY_AFTER", "1"))
+
+# === Metrics ===
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+REQUEST_SECONDS = Histogram(
+    "translation_request_seconds", "End-to-end /translate latency", buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "translation_stage_seconds", "Time each batch spends in each stage", ["stage", "direction"],
+    buckets=LATENCY_BUCKETS,
+)
+TOKENS_PER_SECOND = Histogram(
+    "translation_generate_tokens_per_second", "Generated tokens per second of each batch", ["direction"],
+    buckets=(10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+GENERATED_TOKENS = Counter("translation_generated_tokens", "Tokens generated", ["direction"])
+BATCH_SIZE = Histogram(
+    "translation_batch_size", "Sentences per model batch", ["direction"], buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+CACHE_LOOKUPS = Counter("translation_cache_lookups", "Sentence cache lookups", ["result"])
+QUEUE_DEPTH = Gauge("translation_queue_depth", "Batches waiting for a worker", multiprocess_mode="livesum")
+REFUSED = Counter("translation_refused_requests", "Requests refused by admission control", ["status"])
+
+# A sentence ends at a terminator followed by whitespace, or at a line break.
+# A full stop does not end one after a known abbreviation or initials ("Dr.",
+# "U.S.", "e.g.") or when the next word starts in lower case.
+SENTENCE_BREAK = re.compile(r"(?<=[.!?\u0964])\s+|\s*\n\s*")
+CLAUSE_BREAK = re.compile(r"(?<=[,;:])\s+")
+# Abbreviations that are usually followed by more of the sentence
+ABBREVIATIONS = frozenset("mr mrs ms dr prof st mt rev hon gen col capt lt sgt gov sen rep vs fig approx dept".split())
+# ...and those that only are one when a number follows: "No. 5", but "He said no. Then..."
+NUMBER_ABBREVIATIONS = frozenset(["no"])
+INITIALS = re.compile(r"(?:[A-Za-z]\.)+")
+
+
+def normalize(text):
+    """Cache key form of a sentence: trimmed, with runs of whitespace collapsed."""
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def decoding_options(data):
+    """
+    Resolve the decoding settings of a /translate request body: a named profile,
+    with num_beams / max_length overriding it. Raises ValueError on bad input.
+    """
+    profile = data.get("profile", DEFAULT_PROFILE)
+    if profile not in DECODING_PROFILES:
+        raise ValueError(f"Unknown profile: {profile} (choose from {', '.join(DECODING_PROFILES)})")
+    options = dict(DECODING_PROFILES[profile])
+    for key in ("num_beams", "max_length"):
+        if key in data:
+            value = data[key]
+            if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+                raise ValueError(f"'{key}' must be a positive integer.")
+            options[key] = value
+    if options != DECODING_PROFILES[profile]:
+        profile = "custom"
+    return profile, options
+
+
+def resolve_precision(precision, device):
+    """Pick the precision the models are actually loaded in on this device."""
+    if precision == "auto":
+        return "fp16" if device == "cuda" else "int8"
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision} (choose from auto, {', '.join(PRECISIONS)})")
+    if device == "cpu" and precision == "fp16":
+        print("[WARN] fp16 is not supported on CPU, loading the models in fp32")
+        return "fp32"
+    if device == "cuda" and precision == "int8":
+        print("[WARN] int8 dynamic quantization only runs on CPU, loading the models in fp16")
+        return "fp16"
+    return precision
+
+
+def model_size_mb(model):
+    """
+    Size of the weights: parameters and buffers, plus the packed int8 weights
+    of dynamically quantized layers, which parameters() does not see.
+    """
+    tensors = list(model.parameters()) + list(model.buffers())
+    for module in model.modules():
+        packed = getattr(module, "_packed_params", None)
+        if hasattr(packed, "_weight_bias"):
+            tensors.extend(t for t in packed._weight_bias() if t is not None)
+    return round(sum(t.numel() * t.element_size() for t in tensors) / 2 ** 20, 1)
+
+
+def is_sentence_end(before, after):
+    """Whether the break between before and after (text on either side of it) ends a sentence."""
+    if not before.endswith("."):
+        return True
+    word = before.rsplit(None, 1)[-1].lstrip("(\"'")
+    if word[:-1].lower() in ABBREVIATIONS or INITIALS.fullmatch(word):
+        return False
+    if word[:-1].lower() in NUMBER_ABBREVIATIONS and after[:1].isdigit():
+        return False
+    return not after[:1].islower()
+
+
+def split_sentences(text):
+    """
+    Split text into normalized sentences and the separators between them:
+    the line breaks of a paragraph boundary, otherwise a single space.
+    """
+    text = text.strip()
+    sentences, separators, start = [], [], 0
+    for match in SENTENCE_BREAK.finditer(text):
+        gap = match.group()
+        if "\n" not in gap and not is_sentence_end(text[start:match.start()], text[match.end():]):
+            continue
+        sentences.append(normalize(text[start:match.start()]))
+        separators.append("\n" * gap.count("\n") or " ")
+        start = match.end()
+    sentences.append(normalize(text[start:]))
+    return sentences, separators
+
+
+class TranslationCache:
+    """
+    LRU cache of translations keyed by (direction, normalized sentence), with an
+    optional SQLite store behind it. Lookups that miss the LRU fall through to
+    the store, and hits found there are promoted back into the LRU.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, db_path=CACHE_DB):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._entries = OrderedDict()  # (direction, sentence) -> translation
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_path = db_path
+        if db_path and max_size > 0:
+            try:
+                self._db = self._connect()
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS translations ("
+                    "direction TEXT, source TEXT, translation TEXT, PRIMARY KEY (direction, source))"
+                )
+                self._db.commit()
+                rows = self._db.execute(
+                    "SELECT direction, source, translation FROM translations ORDER BY rowid DESC LIMIT ?",
+                    (max_size,),
+                ).fetchall()
+            except sqlite3.Error as e:
+                print(f"[WARN] Translation cache store {db_path} is unusable ({e}), caching in memory only")
+                self._db = None
+                rows = []
+            for direction, source, translation in reversed(rows):
+                self._entries[(direction, source)] = translation
+
+    def _connect(self):
+        db = sqlite3.connect(self._db_path, timeout=CACHE_DB_TIMEOUT, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def reopen(self):
+        """Open a fresh SQLite connection, e.g. in a forked worker; a connection must not cross fork()."""
+        if self._db is not None:
+            self._db = self._connect()
+
+    def get_many(self, direction, sentences):
+        """Return {sentence: translation} for the normalized sentences that are cached."""
+        if self.max_size <= 0:
+            with self._lock:
+                self.misses += len(sentences)
+            return {}
+        found, store_ok = {}, True
+        with self._lock:
+            for sentence in sentences:
+                key = (direction, sentence)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[sentence] = self._entries[key]
+                elif self._db is not None and store_ok:
+                    try:
+                        row = self._db.execute(
+                            "SELECT translation FROM translations WHERE direction = ? AND source = ?", key
+                        ).fetchone()
+                    except sqlite3.Error as e:
+                        print(f"[WARN] Translation cache lookup failed ({e}), treating it as a miss")
+                        store_ok = False  # don't retry, and log, for every sentence of the request
+                        continue
+                    if row is not None:
+                        self.disk_hits += 1
+                        found[sentence] = row[0]
+                        self._insert(key, row[0])
+            self.hits += len(found)
+            self.misses += len(sentences) - len(found)
+        return found
+
+    def put_many(self, direction, pairs):
+        """Store (normalized sentence, translation) pairs."""
+        if self.max_size <= 0 or not pairs:
+            return
+        with self._lock:
+            for sentence, translation in pairs:
+                self._insert((direction, sentence), translation)
+            if self._db is not None:
+                try:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO translations (direction, source, translation) VALUES (?, ?, ?)",
+                        [(direction, sentence, translation) for sentence, translation in pairs],
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"[WARN] Translation cache write failed ({e}), kept in memory only")
+                    with contextlib.suppress(sqlite3.Error):
+                        self._db.rollback()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "persistent": self._db is not None,
+            }
+
+    def _insert(self, key, translation):
+        self._entries[key] = translation
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
 class KannadaTranslator:
-    def __init__(self): 
+    def __init__(self, precision=PRECISION, cache=None, progress=None, lazy=LAZY_DIRECTIONS):
+        """
+        Load the tokenizers and models of both directions in parallel; the
+        models of directions in lazy wait for their first request. progress,
+        when given, is called as progress(step, fn) around each loading step
+        and must return fn().
+        """
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        
-        # Initialize English to Kannada model
-        self.en_kn_model_name = "ai4bharat/indictrans2-en-indic-dist-200M"
-        self.en_kn_tokenizer = AutoTokenizer.from_pretrained(
-            self.en_kn_model_name, 
-            trust_remote_code=True
-        )
-        self.en_kn_model = AutoModelForSeq2SeqLM.from_pretrained(
-            self.en_kn_model_name,
-            trust_remote_code=True,
-            torch_dtype=torch.float16,
-            attn_implementation="flash_attention_2" if torch.cuda.is_available() else None
-        ).to(self.device)
-        
-        # Initialize Kannada to English model
-        self.kn_en_model_name = "ai4bharat/indictrans2-indic-en-dist-200M"
-        self.kn_en_tokenizer = AutoTokenizer.from_pretrained(
-            self.kn_en_model_name, 
-            trust_remote_code=True
-        )
-        self.kn_en_model = AutoModelForSeq2SeqLM.from_pretrained(
-            self.kn_en_model_name,
-            trust_remote_code=True,
-            torch_dtype=torch.float16,
-            attn_implementation="flash_attention_2" if torch.cuda.is_available() else None
-        ).to(self.device)
-        
+        self.precision = resolve_precision(precision, self.device)
+        if THREADS > 0:
+            torch.set_num_threads(THREADS)
+        stub = " (stub weights)" if STUB_MODELS else ""
+        print(f"[INFO] Loading translation models on {self.device} in {self.precision}{stub}...")
+        progress = progress or (lambda step, fn: fn())
+
+        self.models = {}
+        self.model_mb = {}
+        self._load_locks = {direction: threading.Lock() for direction in MODEL_NAMES}
+        with ThreadPoolExecutor(max_workers=2 * len(MODEL_NAMES)) as loader:
+            tokenizers = {
+                direction: loader.submit(
+                    progress, f"{direction} tokenizer",
+                    lambda name=name: AutoTokenizer.from_pretrained(name, trust_remote_code=True),
+                )
+                for direction, name in MODEL_NAMES.items()
+            }
+            models = [
+                loader.submit(progress, f"{direction} model", lambda direction=direction: self._model(direction))
+                for direction in MODEL_NAMES if direction not in lazy
+            ]
+            for future in models:
+                future.result()
+        self.en_kn_tokenizer = tokenizers["en-kn"].result()
+        self.kn_en_tokenizer = tokenizers["kn-en"].result()
+
         self.ip = IndicProcessor(inference=True)
+        self.cache = cache if cache is not None else TranslationCache()
+        # Buckets of both directions share the pool, so kn->en and en->kn run side by side
+        self.pool = ThreadPoolExecutor(max_workers=WORKERS)
+        self.directions = {
+            "en": ("en-kn", self._translate_en_to_kn),
+            "kn": ("kn-en", self._translate_kn_to_en),
+        }
+        self.tokenizers = {"en": self.en_kn_tokenizer, "kn": self.kn_en_tokenizer}
+        self.decode_stats = {}  # profile -> totals of the requests decoded with it
+        self._stats_lock = threading.Lock()
     
+    def _model(self, direction):
+        """The model of a direction, loading it on first use."""
+        if direction not in self.models:
+            with self._load_locks[direction]:
+                if direction not in self.models:
+                    model = self._load_model(MODEL_NAMES[direction])
+                    self.model_mb[direction] = model_size_mb(model)
+                    self.models[direction] = model
+        return self.models[direction]
+
+    def warm_up(self):
+        """
+        Translate a sentence with every loaded model, bypassing the cache, so
+        kernel selection and allocator warm-up happen before the first request.
+        """
+        for lang, (direction, run) in self.directions.items():
+            if direction in self.models:
+                run(WARMUP_SENTENCES[direction], **DECODING_PROFILES[DEFAULT_PROFILE])
+
+    def _load_model(self, model_name):
+        """Load a model in the configured precision, falling back to fp32 if int8 quantization fails."""
+        dtype = torch.float16 if self.precision == "fp16" else torch.float32
+        if STUB_MODELS:
+            config = AutoConfig.from_pretrained(model_name, trust_remote_code=True)
+            config.update({key: value for key, value in STUB_DIMS.items() if hasattr(config, key)})
+            model = AutoModelForSeq2SeqLM.from_config(config, trust_remote_code=True, torch_dtype=dtype)
+        else:
+            model = AutoModelForSeq2SeqLM.from_pretrained(
+                model_name,
+                trust_remote_code=True,
+                torch_dtype=dtype,
+                attn_implementation="flash_attention_2" if self.device == "cuda" and self.precision == "fp16" else None
+            )
+        model = model.to(self.device)
+        model.eval()
+        if self.precision == "int8":
+            try:
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            except (RuntimeError, AssertionError) as e:
+                print(f"[WARN] int8 quantization of {model_name} failed ({e}), running it in fp32")
+                self.precision = "fp32"
+        return model
+
+    def model_info(self):
+        return {
+            "device": self.device,
+            "precision": self.precision,
+            "threads": torch.get_num_threads(),
+            "model_mb": self.model_mb,
+            "loaded": sorted(self.models),
+        }
+
     def detect_language(self, text):
         """Simple language detection based on script"""
         if any('\u0C80' <= char <= '\u0CFF' for char in text):  # Kannada Unicode range
@@ -48,19 +449,166 @@ class KannadaTranslator:
         else:
             return "en"
     
-    def translate(self, input_sentences):
+    def translate(self, input_sentences, profile=DEFAULT_PROFILE, decoding=None, report=None):
+        """
+        Translate each text into the other language. Texts are split into
+        sentences, and every sentence is routed by its own script, so a batch
+        may mix Kannada and English. Sentences of both directions are
+        translated in length buckets and stitched back into their texts, in
+        input order. decoding holds the generate settings (num_beams,
+        max_length), defaulting to the profile's; when report is a dict it is
+        filled with sentence counts, decode (generate) time and, under
+        stages_ms, the time of each stage of the batches.
+        """
+        decoding = decoding or DECODING_PROFILES[profile]
         if not input_sentences:
             return []
-        
-        # Detect language from first sentence
-        lang = self.detect_language(input_sentences[0])
-        
-        if lang == "en":
-            return self._translate_en_to_kn(input_sentences)
-        else:
-            return self._translate_kn_to_en(input_sentences)
-    
-    def _translate_en_to_kn(self, sentences):
+
+        start = time.perf_counter()
+        segments = [self._segment(text) for text in input_sentences]
+        segment_seconds = time.perf_counter() - start
+        groups = {}  # language -> distinct sentences, in order
+        for pieces, _ in segments:
+            for key in pieces:
+                if key:
+                    groups.setdefault(self.detect_language(key), {})[key] = None
+
+        # Only sentences missing from the cache go to the model, each one once.
+        # Output depends on the decoding settings, so they are part of the key.
+        tag = "/beams={num_beams}/len={max_length}".format(**decoding)
+        found, jobs = {}, []
+        for lang, group in groups.items():
+            hits = self.cache.get_many(self.directions[lang][0] + tag, list(group))
+            found[lang] = hits
+            misses = [k for k in group if k not in hits]
+            CACHE_LOOKUPS.labels("hit").inc(len(hits))
+            CACHE_LOOKUPS.labels("miss").inc(len(misses))
+            if misses:
+                jobs.extend((lang, batch, future) for batch, future in self._submit_buckets(lang, misses, decoding))
+        stages = dict.fromkeys(("preprocess", "generate", "postprocess"), 0.0)
+        tokens = 0
+        for lang, batch, future in jobs:
+            outputs, spans = future.result()
+            for stage in stages:
+                stages[stage] += spans[stage]
+            tokens += spans["tokens"]
+            translated = list(zip(batch, outputs))
+            self.cache.put_many(self.directions[lang][0] + tag, translated)
+            found[lang].update(translated)
+
+        results = []
+        for pieces, separators in segments:
+            outputs = [found[self.detect_language(k)][k] if k else "" for k in pieces]
+            results.append("".join(o + sep for o, sep in zip(outputs, separators + [""])))
+
+        translated = sum(len(batch) for _, batch, _ in jobs)
+        decode_seconds = stages["generate"]
+        self._record(profile, translated, decode_seconds)
+        if report is not None:
+            report.update(
+                sentences=sum(len(group) for group in groups.values()),
+                translated=translated,
+                batches=len(jobs),
+                generated_tokens=tokens,
+                segment_ms=round(segment_seconds * 1000, 1),
+                decode_ms=round(decode_seconds * 1000, 1),
+                stages_ms={stage: round(seconds * 1000, 1) for stage, seconds in stages.items()},
+            )
+        return results
+
+    def _record(self, profile, sentences, seconds):
+        with self._stats_lock:
+            totals = self.decode_stats.setdefault(profile, {"requests": 0, "sentences": 0, "decode_ms": 0.0})
+            totals["requests"] += 1
+            totals["sentences"] += sentences
+            totals["decode_ms"] += seconds * 1000
+
+    def stats(self):
+        """Cache counters and, per decoding profile, request totals and mean decode time."""
+        with self._stats_lock:
+            decoding = {
+                profile: dict(
+                    totals,
+                    decode_ms=round(totals["decode_ms"], 1),
+                    mean_decode_ms=round(totals["decode_ms"] / totals["requests"], 1),
+                    mean_sentence_ms=round(totals["decode_ms"] / totals["sentences"], 1) if totals["sentences"] else 0.0,
+                )
+                for profile, totals in self.decode_stats.items()
+            }
+        return {"cache": self.cache.stats(), "decoding": decoding, "model": self.model_info()}
+
+    def _segment(self, text):
+        """Split text into sentences that fit the model, plus the separators between them."""
+        pieces, separators = [], []
+        sentences, breaks = split_sentences(text)
+        for sentence, sep in zip(sentences, breaks + [""]):
+            parts = self._fit(sentence) if sentence else [sentence]
+            pieces.extend(parts)
+            separators.extend([" "] * (len(parts) - 1) + [sep])
+        return pieces, separators[:-1]
+
+    def _count_tokens(self, lang, texts):
+        tokenizer = self.tokenizers[lang]
+        return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+    def _fit(self, sentence):
+        """
+        Split a sentence longer than MAX_SOURCE_TOKENS at clause boundaries,
+        packing clauses back together while they fit; clauses that are still
+        too long are cut into even runs of words.
+        """
+        lang = self.detect_language(sentence)
+        if self._count_tokens(lang, [sentence])[0] <= MAX_SOURCE_TOKENS:
+            return [sentence]
+        pieces = []
+        for clause in CLAUSE_BREAK.split(sentence):
+            size = self._count_tokens(lang, [clause])[0]
+            if size > MAX_SOURCE_TOKENS:
+                words = clause.split()
+                step = math.ceil(len(words) / math.ceil(size / MAX_SOURCE_TOKENS))
+                pieces.extend(" ".join(words[i:i + step]) for i in range(0, len(words), step))
+            elif pieces and self._count_tokens(lang, [pieces[-1] + " " + clause])[0] <= MAX_SOURCE_TOKENS:
+                pieces[-1] += " " + clause
+            else:
+                pieces.append(clause)
+        return pieces
+
+    def _submit_buckets(self, lang, sentences, decoding):
+        """
+        Sort sentences by length and submit them in buckets of similar length,
+        so each batch is padded only to its own longest sentence.
+        Returns [(bucket sentences, future of (translations, stage spans))].
+        """
+        lengths = self._count_tokens(lang, sentences)
+        buckets, bucket = [], []
+        for i in sorted(range(len(sentences)), key=lengths.__getitem__):
+            if bucket and (len(bucket) >= MAX_BATCH_SIZE or (len(bucket) + 1) * lengths[i] > MAX_BATCH_TOKENS):
+                buckets.append(bucket)
+                bucket = []
+            bucket.append(sentences[i])
+        if bucket:
+            buckets.append(bucket)
+        direction, run = self.directions[lang]
+
+        def timed(bucket):
+            QUEUE_DEPTH.dec()
+            spans = {}
+            outputs = run(bucket, spans=spans, **decoding)
+            for stage in ("preprocess", "generate", "postprocess"):
+                STAGE_SECONDS.labels(stage, direction).observe(spans[stage])
+            BATCH_SIZE.labels(direction).observe(len(bucket))
+            GENERATED_TOKENS.labels(direction).inc(spans["tokens"])
+            if spans["generate"]:
+                TOKENS_PER_SECOND.labels(direction).observe(spans["tokens"] / spans["generate"])
+            return outputs, spans
+
+        QUEUE_DEPTH.inc(len(buckets))
+        return [(bucket, self.pool.submit(timed, bucket)) for bucket in buckets]
+
+    def _translate_en_to_kn(self, sentences, num_beams=5, max_length=256, spans=None):
+        """When spans is a dict it receives the seconds of each stage and the generated token count."""
+        spans = {} if spans is None else spans
+        start = time.perf_counter()
         batch = self.ip.preprocess_batch(
             sentences,
             src_lang="eng_Latn",
@@ -74,17 +622,22 @@ class KannadaTranslator:
             return_tensors="pt",
             return_attention_mask=True,
         ).to(self.device)
+        spans["preprocess"] = time.perf_counter() - start
         
+        start = time.perf_counter()
         with torch.no_grad():
-            generated_tokens = self.en_kn_model.generate(
+            generated_tokens = self._model("en-kn").generate(
                 **inputs,
                 use_cache=True,
                 min_length=0,
-                max_length=256,
-                num_beams=5,
+                max_length=max_length,
+                num_beams=num_beams,
                 num_return_sequences=1,
             )
+        spans["generate"] = time.perf_counter() - start
+        spans["tokens"] = int((generated_tokens != self.en_kn_tokenizer.pad_token_id).sum())
         
+        start = time.perf_counter()
         generated_tokens = self.en_kn_tokenizer.batch_decode(
             generated_tokens,
             skip_special_tokens=True,
@@ -92,9 +645,13 @@ class KannadaTranslator:
         )
         
         translations = self.ip.postprocess_batch(generated_tokens, lang="kan_Knda")
+        spans["postprocess"] = time.perf_counter() - start
         return translations
     
-    def _translate_kn_to_en(self, sentences):
+    def _translate_kn_to_en(self, sentences, num_beams=5, max_length=256, spans=None):
+        """When spans is a dict it receives the seconds of each stage and the generated token count."""
+        spans = {} if spans is None else spans
+        start = time.perf_counter()
         batch = self.ip.preprocess_batch(
             sentences,
             src_lang="kan_Knda",
@@ -108,17 +665,22 @@ class KannadaTranslator:
             return_tensors="pt",
             return_attention_mask=True,
         ).to(self.device)
+        spans["preprocess"] = time.perf_counter() - start
         
+        start = time.perf_counter()
         with torch.no_grad():
-            generated_tokens = self.kn_en_model.generate(
+            generated_tokens = self._model("kn-en").generate(
                 **inputs,
                 use_cache=True,
                 min_length=0,
-                max_length=256,
-                num_beams=5,
+                max_length=max_length,
+                num_beams=num_beams,
                 num_return_sequences=1,
             )
+        spans["generate"] = time.perf_counter() - start
+        spans["tokens"] = int((generated_tokens != self.kn_en_tokenizer.pad_token_id).sum())
         
+        start = time.perf_counter()
         generated_tokens = self.kn_en_tokenizer.batch_decode(
             generated_tokens,
             skip_special_tokens=True,
@@ -126,13 +688,105 @@ class KannadaTranslator:
         )
         
         translations = self.ip.postprocess_batch(generated_tokens, lang="eng_Latn")
+        spans["postprocess"] = time.perf_counter() - start
         return translations
 
 
+COMPARISON_SENTENCES = [
+    "Hello, how are you today?",
+    "The weather is pleasant and the market is busy this morning.",
+    "Please remember to drink enough water and take some rest.",
+    "ನಮಸ್ಕಾರ, ನೀವು ಹೇಗಿದ್ದೀರಿ?",
+    "ಇಂದು ಬೆಂಗಳೂರಿನಲ್ಲಿ ಮಳೆ ಬರುವ ಸಾಧ್ಯತೆ ಇದೆ.",
+]
+
+
+def compare_precisions(runs=5):
+    """
+    Load the models in every precision this device supports and print load
+    time, weight size and mean translation latency of each, relative to fp32.
+    The cache is disabled so every run goes through the models.
+    Run with: python IndicTranslation.py --compare-precision
+    """
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    modes = ["fp16", "fp32"] if device == "cuda" else ["fp32", "int8"]
+    results = {}
+    for mode in modes:
+        start = time.perf_counter()
+        candidate = KannadaTranslator(precision=mode, cache=TranslationCache(max_size=0), lazy=())
+        load_s = time.perf_counter() - start
+        candidate.translate(COMPARISON_SENTENCES)  # warm-up
+        start = time.perf_counter()
+        for _ in range(runs):
+            candidate.translate(COMPARISON_SENTENCES)
+        info = candidate.model_info()
+        results[candidate.precision] = {
+            "load_s": round(load_s, 1),
+            "model_mb": round(sum(info["model_mb"].values()), 1),
+            "latency_ms": round((time.perf_counter() - start) / runs * 1000, 1),
+        }
+        del candidate
+        if device == "cuda":
+            torch.cuda.empty_cache()
+
+    base = results.get("fp32")
+    print(f"{'precision':<10}{'load s':>8}{'model MB':>10}{'latency ms':>12}{'vs fp32':>10}")
+    for mode, r in results.items():
+        speedup = f"{base['latency_ms'] / r['latency_ms']:.2f}x" if base else "-"
+        print(f"{mode:<10}{r['load_s']:>8}{r['model_mb']:>10}{r['latency_ms']:>12}{speedup:>10}")
+    return results
+
+
+if __name__ == "__main__" and "--compare-precision" in sys.argv:
+    compare_precisions()
+    sys.exit(0)
+
+
 # === Flask Server ===
 app = Flask(__name__)
 CORS(app)  # Allow CORS from all domains
-translator = KannadaTranslator()
+translator = None  # set by load()
+readiness = Readiness(
+    [f"{direction} tokenizer" for direction in MODEL_NAMES]
+    + [f"{direction} model" for direction in MODEL_NAMES if direction not in LAZY_DIRECTIONS]
+    + ["warm-up"]
+)
+admission = Admission(MAX_IN_FLIGHT, MAX_QUEUED)
+
+
+def load():
+    global translator
+    loaded = KannadaTranslator(progress=readiness.track)
+    with readiness.step("warm-up"):
+        loaded.warm_up()
+    translator = loaded
+
+
+@app.before_request
+def assign_request_id():
+    g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+
+
+@app.after_request
+def echo_request_id(response):
+    response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
+
+
+@app.before_request
+def require_ready():
+    """Answer 503 while the models are loading; liveness, readiness and metrics stay available."""
+    if not readiness.ready and request.endpoint not in ("healthCheck", "health", "ready", "metrics"):
+        body = {"error": "Models are still loading.", **readiness.report()}
+        return jsonify(body), 503, {"Retry-After": str(RETRY_AFTER_SECONDS)}
+
+
+install_admission(app, admission, ("translate_api",), REFUSED, RETRY_AFTER_SECONDS)
+
+
+@app.route("/ready")
+def ready():
+    return jsonify(readiness.report()), 200 if readiness.ready else 503
 
 
 @app.route("/health")
@@ -145,16 +799,45 @@ def translate_api():
     sentences = data.get("sentences")
     if not sentences or not isinstance(sentences, list):
         return jsonify({"error": "Missing or invalid 'sentences' (must be a list of strings)."}), 400
-    translations = translator.translate(sentences)
-    lang = translator.detect_language(sentences[0]) if sentences else None
+    try:
+        profile, decoding = decoding_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start = time.perf_counter()
+    report = {}
+    translations = translator.translate(sentences, profile=profile, decoding=decoding, report=report)
+    languages = [translator.detect_language(s) for s in sentences]
+    elapsed = time.perf_counter() - start
+    REQUEST_SECONDS.observe(elapsed)
+    timing = dict(report, total_ms=round(elapsed * 1000, 1))
+    if TRACE_LOG:
+        print(f"[TRACE] {g.request_id} translate " + " ".join(f"{k}={v}" for k, v in timing.items()))
     return jsonify({
-        "input_language": lang,
-        "translations": translations
+        "input_language": languages[0] if len(set(languages)) == 1 else "mixed",
+        "input_languages": languages,
+        "translations": translations,
+        "decoding": dict(profile=profile, **decoding),
+        "timing": timing,
     })
 
+@app.route("/translate/stats", methods=["GET"])
+def translate_stats():
+    return jsonify(translator.stats())
+
+@app.route("/metrics")
+def metrics():
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:  # gunicorn workers: add up the samples of every worker
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({"status": "ok"})
 
+readiness.run(load, LOAD_IN_BACKGROUND)
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "5000")))
\ No newline at end of file
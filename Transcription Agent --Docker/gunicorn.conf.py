@@ -0,0 +1,49 @@
+# Gunicorn settings for the transcription service: gunicorn -c gunicorn.conf.py transcribe:app
+#
+# On CPU the app, and with it Whisper, is loaded once in the master before the
+# workers are forked, so the workers share the weight pages copy-on-write
+# instead of each holding a copy. The cores are split evenly between the
+# transcriptions that can run at once, TRANSCRIBE_MAX_IN_FLIGHT in each worker,
+# so their torch thread pools do not oversubscribe the node. On a GPU one
+# worker loads the model itself, since CUDA cannot be used across fork().
+#
+# WEB_WORKERS    worker processes (default: one per 4 cores, 1 on a GPU)
+# WEB_THREADS    HTTP threads per worker (more than TRANSCRIBE_MAX_IN_FLIGHT + _MAX_QUEUED)
+# TORCH_THREADS  torch threads per transcription (default: cores / (workers * TRANSCRIBE_MAX_IN_FLIGHT))
+import os
+import tempfile
+
+# Read before the app imports torch and prometheus_client. The master stays
+# single-threaded (an OpenMP pool started before fork() hangs the workers);
+# each worker sets its own thread count in post_fork. Metrics of all workers
+# are added up through the multiprocess directory.
+os.environ["OMP_NUM_THREADS"] = "1"
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="prometheus-"))
+
+import torch  # noqa: E402
+
+gpu = torch.cuda.is_available()
+cores = len(os.sched_getaffinity(0))
+workers = int(os.environ.get("WEB_WORKERS", 1 if gpu else max(1, cores // 4)))
+in_flight = workers * int(os.environ.get("TRANSCRIBE_MAX_IN_FLIGHT", "2"))
+torch_threads = int(os.environ.get("TORCH_THREADS", "0")) or max(1, cores // in_flight)
+
+bind = "0.0.0.0:" + os.environ.get("PORT", "5000")
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", "16"))
+preload_app = not gpu
+timeout = 300
+
+# A preloaded app loads its models during import; a loading thread would not survive fork()
+if preload_app:
+    os.environ["LOAD_IN_BACKGROUND"] = "0"
+
+
+def post_fork(server, worker):
+    torch.set_num_threads(torch_threads)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,10 +1,29 @@
 # Flask server for audio transcription
 import torch
-from transformers import AutoProcessor, AutoModelForSpeechSeq2Seq
+from transformers import AutoConfig, AutoProcessor, AutoModelForSpeechSeq2Seq, GenerationConfig
 import torchaudio
+import numpy as np
+import soundfile as sf
+import io
+import json
+import math
 import os
-from flask import Flask, request, jsonify
+import struct
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+)
+
+# service_common.py sits next to this file in the image and in ../common in a checkout
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from service_common import Admission, Readiness, install_admission  # noqa: E402
 
 app = Flask(__name__)
 CORS(app)  # Allow CORS from all domains
@@ -14,79 +33,811 @@ MODEL_ID = "steja/whisper-small-kannada"
 TARGET_SAMPLE_RATE = 16000
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
-# === Load the model (from local cache after first download) ===
-print(f"[INFO] Loading model: {MODEL_ID} on {DEVICE}...")
-processor = AutoProcessor.from_pretrained(MODEL_ID)
-model = AutoModelForSpeechSeq2Seq.from_pretrained(MODEL_ID).to(DEVICE)
-print("[INFO] Model loaded successfully!")
-
-# === Audio transcription helper ===
-def transcribe_audio(audio_path: str) -> str:
-    if not os.path.isfile(audio_path):
-        return "[ERROR] File not found: {}".format(audio_path)
-
-    # Load audio (works for wav, mp3, flac if ffmpeg backend is available)
-    waveform, sr = torchaudio.load(audio_path)
-
-    # Downmix to mono if stereo
-    if waveform.shape[0] > 1:
-        waveform = waveform.mean(dim=0, keepdim=True)
-
-    # Resample if needed
-    if sr != TARGET_SAMPLE_RATE:
-        waveform = torchaudio.functional.resample(
-            waveform, orig_freq=sr, new_freq=TARGET_SAMPLE_RATE
-        )
-        sr = TARGET_SAMPLE_RATE
-
-    # Convert to 1D numpy array
-    waveform = waveform.squeeze().numpy()
-
-    # Prepare input features
-    inputs = processor(
-        waveform,
-        sampling_rate=sr,
-        return_tensors="pt"
-    ).to(DEVICE)
-
-    # Generate transcription
+# === Chunking config ===
+# Audio is decoded block by block and cut into Whisper's 30 s windows, each
+# overlapping the previous one by TRANSCRIBE_OVERLAP_SECONDS so words on a
+# window boundary are heard whole at least once. Windows are transcribed
+# TRANSCRIBE_BATCH_SIZE at a time; /transcribe/batch callers may ask for up to
+# TRANSCRIBE_MAX_BATCH_SIZE.
+WINDOW_SECONDS = 30.0
+OVERLAP_SECONDS = float(os.environ.get("TRANSCRIBE_OVERLAP_SECONDS", "5"))
+STRIDE_SECONDS = WINDOW_SECONDS - OVERLAP_SECONDS
+BATCH_SIZE = int(os.environ.get("TRANSCRIBE_BATCH_SIZE", "4"))
+MAX_BATCH_SIZE = int(os.environ.get("TRANSCRIBE_MAX_BATCH_SIZE", "16"))
+# /transcribe/batch decodes and resamples its files on TRANSCRIBE_DECODE_WORKERS threads
+DECODE_WORKERS = int(os.environ.get("TRANSCRIBE_DECODE_WORKERS", "4"))
+
+# === VAD config ===
+# With TRANSCRIBE_VAD=1 (or "vad" in a request) audio is split into speech
+# segments before windowing: 30 ms frames are speech when their energy is above
+# TRANSCRIBE_VAD_THRESHOLD_DB dBFS, or within 10 dB of it with a high
+# zero-crossing rate (fricatives). Silence before the first and after the last
+# word is dropped, pauses longer than TRANSCRIBE_VAD_MIN_PAUSE_SECONDS are cut
+# out, and short segments are packed together into 30 s windows.
+VAD = os.environ.get("TRANSCRIBE_VAD", "0") == "1"
+VAD_THRESHOLD_DB = float(os.environ.get("TRANSCRIBE_VAD_THRESHOLD_DB", "-45"))
+VAD_MIN_PAUSE_SECONDS = float(os.environ.get("TRANSCRIBE_VAD_MIN_PAUSE_SECONDS", "0.8"))
+VAD_FRAME_SECONDS = 0.03
+VAD_ZCR = 0.25
+VAD_PAD_SECONDS = 0.2  # kept around each segment so word edges are not clipped
+VAD_GAP_SECONDS = 0.3  # silence between segments packed into one window
+
+# === Tracing config ===
+# Requests carry an X-Request-ID (generated when the caller sends none) that is
+# echoed back; with TRACE_LOG=1 every request prints its stage timings under it.
+REQUEST_ID_HEADER = "X-Request-ID"
+TRACE_LOG = os.environ.get("TRACE_LOG", "0") == "1"
+
+# === Admission config ===
+# The /transcribe endpoints run at most TRANSCRIBE_MAX_IN_FLIGHT requests at
+# once per worker and queue up to TRANSCRIBE_MAX_QUEUED more; past that they
+# answer 429 straight away with Retry-After: TRANSCRIBE_RETRY_AFTER seconds
+# (so does the 503 while loading). "X-Priority: batch" requests wait behind
+# interactive ones, and one whose "X-Request-Timeout: <seconds>" runs out in
+# the queue is dropped unrun (504). Keep in-flight plus queued below WEB_THREADS.
+MAX_IN_FLIGHT = int(os.environ.get("TRANSCRIBE_MAX_IN_FLIGHT", "2"))
+MAX_QUEUED = int(os.environ.get("TRANSCRIBE_MAX_QUEUED", "8"))
+RETRY_AFTER_SECONDS = int(os.environ.get("TRANSCRIBE_RETRY_AFTER", "2"))
+
+# === Stub mode ===
+# STUB_MODELS=1 keeps the processor and the Whisper architecture but swaps the
+# weights for a tiny randomly initialized model, so the service starts in
+# seconds on a CPU-only box (see benchmark.py). Transcripts are noise.
+STUB_MODELS = os.environ.get("STUB_MODELS", "0") == "1"
+STUB_DIMS = dict(
+    d_model=64, encoder_layers=2, decoder_layers=2, encoder_attention_heads=4,
+    decoder_attention_heads=4, encoder_ffn_dim=128, decoder_ffn_dim=128,
+)
+
+AUDIO_EXTENSIONS = [".wav", ".mp3", ".flac"]
+WAV_MIMETYPES = ["audio/wav", "audio/x-wav", "audio/wave"]
+# numpy dtype and full scale of the WAV sample formats read without decoding
+PCM_FORMATS = {(1, 16): ("<i2", 2 ** 15), (1, 32): ("<i4", 2 ** 31), (3, 32): ("<f4", 1.0)}
+# Accepted "rate" and "channels" of raw audio/pcm uploads
+PCM_RATES = (1000, 384000)
+PCM_MAX_CHANNELS = 32
+
+# === Loading config ===
+# The processor and the model load side by side on a background thread while
+# the app already answers /health (liveness). /ready reports the progress and
+# answers 200 once the model is loaded and warmed up; until then the
+# transcription endpoints answer 503. LOAD_IN_BACKGROUND=0 loads during
+# import instead (gunicorn preload does).
+LOAD_IN_BACKGROUND = os.environ.get("LOAD_IN_BACKGROUND", "1") == "1"
+
+# Set by load() (from local cache after first download)
+processor = None
+model = None
+frontend = None
+# Fine-tuned checkpoints may have lost Whisper's timestamp tokens; without them
+# overlapping windows are stitched by matching words instead of times.
+TIMESTAMPS = False
+
+
+def load_processor():
+    return AutoProcessor.from_pretrained(MODEL_ID)
+
+
+def load_model():
+    print(f"[INFO] Loading model: {MODEL_ID} on {DEVICE}{' (stub weights)' if STUB_MODELS else ''}...")
+    if STUB_MODELS:
+        config = AutoConfig.from_pretrained(MODEL_ID)
+        config.update(STUB_DIMS)
+        loaded = AutoModelForSpeechSeq2Seq.from_config(config)
+        try:
+            loaded.generation_config = GenerationConfig.from_pretrained(MODEL_ID)
+        except OSError:
+            pass  # no generation_config.json: keep the one derived from the config
+    else:
+        loaded = AutoModelForSpeechSeq2Seq.from_pretrained(MODEL_ID)
+    print("[INFO] Model loaded successfully!")
+    return loaded.to(DEVICE)
+
+
+class LogMelFrontend:
+    """
+    Whisper's log-mel features computed with torch on DEVICE for a whole batch
+    of windows at once, using the checkpoint's own mel filters. Matches the
+    processor's feature extractor: windows are zero-padded to 30 s.
+    """
+
+    def __init__(self, feature_extractor, device):
+        self.n_fft = feature_extractor.n_fft
+        self.hop_length = feature_extractor.hop_length
+        self.n_samples = feature_extractor.n_samples
+        self.device = device
+        self.window = torch.hann_window(self.n_fft, device=device)
+        self.mel_filters = torch.tensor(feature_extractor.mel_filters, dtype=torch.float32, device=device)
+
+    def __call__(self, windows):
+        padded = np.zeros((len(windows), self.n_samples), dtype=np.float32)
+        for i, samples in enumerate(windows):
+            samples = samples[:self.n_samples]
+            padded[i, :len(samples)] = samples
+        waveform = torch.from_numpy(padded).to(self.device)
+        stft = torch.stft(waveform, self.n_fft, self.hop_length, window=self.window, return_complex=True)
+        magnitudes = stft[..., :-1].abs() ** 2
+        log_spec = torch.clamp(self.mel_filters.T @ magnitudes, min=1e-10).log10()
+        log_spec = torch.maximum(log_spec, log_spec.amax(dim=(1, 2), keepdim=True) - 8.0)
+        return (log_spec + 4.0) / 4.0
+
+
+# Resampling kernels are built once per source rate and reused
+resamplers = {}
+resamplers_lock = threading.Lock()
+
+# === Stage timing ===
+STAGES = ("decode", "vad", "resample", "features", "generate")
+stage_totals = dict.fromkeys(STAGES, 0.0)
+stage_lock = threading.Lock()
+
+# === Metrics ===
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+REQUEST_SECONDS = Histogram(
+    "transcription_request_seconds", "End-to-end latency per endpoint", ["endpoint"], buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "transcription_stage_seconds", "Time a request spends in each stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+TOKENS_PER_SECOND = Histogram(
+    "transcription_generate_tokens_per_second", "Generated tokens per second of each Whisper batch",
+    buckets=(10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+GENERATED_TOKENS = Counter("transcription_generated_tokens", "Tokens generated")
+WINDOW_BATCH = Histogram("transcription_batch_size", "Windows per Whisper batch", buckets=(1, 2, 4, 8, 16, 32))
+IN_PROGRESS = Gauge(
+    "transcription_requests_in_progress", "Requests being decoded or transcribed", multiprocess_mode="livesum"
+)
+REFUSED = Counter("transcription_refused_requests", "Requests refused by admission control", ["status"])
+
+
+class StageTimer:
+    """Wall time one request spends in each pipeline stage, also added to the service totals."""
+
+    def __init__(self, request_id=None):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.request_id = request_id
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.seconds[name] += elapsed
+            with stage_lock:
+                stage_totals[name] += elapsed
+
+    def report(self):
+        return {f"{name}_ms": round(seconds * 1000, 1) for name, seconds in self.seconds.items()}
+
+    def finish(self, endpoint):
+        """Record the request's stage times and latency in the metrics; returns the report with total_ms."""
+        elapsed = time.perf_counter() - self._start
+        REQUEST_SECONDS.labels(endpoint).observe(elapsed)
+        for name, seconds in self.seconds.items():
+            STAGE_SECONDS.labels(name).observe(seconds)
+        report = dict(self.report(), total_ms=round(elapsed * 1000, 1))
+        if TRACE_LOG:
+            print(f"[TRACE] {self.request_id} {endpoint} " + " ".join(f"{k}={v}" for k, v in report.items()))
+        return report
+
+
+# === Audio transcription helpers ===
+def parse_wav(data):
+    """
+    View the samples of an uncompressed PCM WAV file in place. Returns
+    ([frames, channels] array backed by data, sample rate), or None for
+    anything that needs a real decoder. Raises ValueError when the header's
+    sample rate or channel count is outside PCM_RATES / PCM_MAX_CHANNELS.
+    """
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+    pos, fmt = 12, None
+    while pos + 8 <= len(data):
+        chunk, size = data[pos:pos + 4], struct.unpack_from("<I", data, pos + 4)[0]
+        body = pos + 8
+        if chunk == b"fmt " and size >= 16:
+            tag, channels, rate = struct.unpack_from("<HHI", data, body)
+            bits = struct.unpack_from("<H", data, body + 14)[0]
+            if tag == 0xFFFE and size >= 26:  # WAVE_FORMAT_EXTENSIBLE, real tag opens the subformat GUID
+                tag = struct.unpack_from("<H", data, body + 24)[0]
+            fmt = (tag, bits, channels, rate)
+        elif chunk == b"data" and fmt is not None:
+            tag, bits, channels, rate = fmt
+            if (tag, bits) not in PCM_FORMATS:
+                return None
+            if not PCM_RATES[0] <= rate <= PCM_RATES[1]:
+                raise ValueError(f"WAV sample rate must be between {PCM_RATES[0]} and {PCM_RATES[1]}, got {rate}.")
+            if not 1 <= channels <= PCM_MAX_CHANNELS:
+                raise ValueError(f"WAV channels must be between 1 and {PCM_MAX_CHANNELS}, got {channels}.")
+            dtype, _ = PCM_FORMATS[(tag, bits)]
+            frames = min(size, len(data) - body) // (channels * bits // 8)
+            return np.frombuffer(data, dtype, count=frames * channels, offset=body).reshape(-1, channels), rate
+        pos = body + size + (size & 1)
+    return None
+
+
+def pcm_blocks(samples, sr):
+    """Yield mono float32 blocks of a [frames, channels] PCM array, converting one block at a time."""
+    scale = {np.dtype(dtype): full for dtype, full in PCM_FORMATS.values()}[samples.dtype]
+    step = int(STRIDE_SECONDS * sr)
+    for start in range(0, len(samples), step):
+        block = samples[start:start + step].mean(axis=1, dtype=np.float32)
+        yield block / scale if scale != 1.0 else block
+
+
+def open_audio(audio):
+    """
+    Open audio for streaming decode. audio is a file path, the bytes of an
+    uploaded file, or (samples, sample rate) of raw PCM. Returns (sample
+    rate, iterator of mono float32 blocks). PCM WAV data is read in place;
+    other formats go through libsndfile, or torchaudio for the ones
+    libsndfile cannot read.
+    """
+    if isinstance(audio, tuple):
+        return audio[1], pcm_blocks(*audio)
+    if isinstance(audio, bytes):
+        pcm = parse_wav(audio)
+        if pcm is not None:
+            return pcm[1], pcm_blocks(*pcm)
+        audio = io.BytesIO(audio)
+    try:
+        f = sf.SoundFile(audio)
+    except RuntimeError:
+        if hasattr(audio, "seek"):
+            audio.seek(0)
+        waveform, sr = torchaudio.load(audio)
+        return sr, iter([waveform.mean(dim=0).numpy()])
+
+    def blocks():
+        with f:
+            for block in f.blocks(blocksize=int(STRIDE_SECONDS * f.samplerate), dtype="float32", always_2d=True):
+                yield block.mean(axis=1)
+
+    return f.samplerate, blocks()
+
+
+def get_resampler(sr):
+    with resamplers_lock:
+        if sr not in resamplers:
+            resamplers[sr] = torchaudio.transforms.Resample(orig_freq=sr, new_freq=TARGET_SAMPLE_RATE)
+        return resamplers[sr]
+
+
+def to_target_rate(samples, sr):
+    if sr == TARGET_SAMPLE_RATE:
+        return samples
+    waveform = torch.from_numpy(np.ascontiguousarray(samples, dtype=np.float32))
+    with torch.no_grad():
+        return get_resampler(sr)(waveform).numpy()
+
+
+def timed_blocks(blocks, timer):
+    while True:
+        with timer.stage("decode"):
+            block = next(blocks, None)
+        if block is None:
+            return
+        yield block
+
+
+def slide_windows(blocks, sr, start, timer):
+    """
+    Cut a stream of mono blocks into overlapping 30 s windows. Yields
+    (start seconds, 16 kHz window, overlaps previous, overlaps next, None),
+    the None standing for the segment spans of a packed VAD window.
+    Only about one window of audio is held in memory at a time.
+    """
+    window, stride = int(WINDOW_SECONDS * sr), int(STRIDE_SECONDS * sr)
+    buffer, offset, pending = np.zeros(0, dtype=np.float32), 0, None
+    for block in blocks:
+        buffer = np.concatenate([buffer, block])
+        while len(buffer) >= window:
+            if pending is not None:
+                yield pending + (True, None)
+            with timer.stage("resample"):
+                pending = (start + offset / sr, to_target_rate(buffer[:window], sr), offset > 0)
+            buffer, offset = buffer[stride:], offset + stride
+    # The tail is only new audio if it reaches past the previous window's overlap
+    if len(buffer) and (pending is None or len(buffer) > window - stride):
+        if pending is not None:
+            yield pending + (True, None)
+        with timer.stage("resample"):
+            pending = (start + offset / sr, to_target_rate(buffer, sr), offset > 0)
+    if pending is not None:
+        yield pending + (False, None)
+
+
+def speech_frames(samples, frame):
+    """Classify consecutive frames of samples as speech (True) or silence."""
+    frames = samples[:len(samples) // frame * frame].reshape(-1, frame)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    zcr = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+    return (energy_db > VAD_THRESHOLD_DB) | ((energy_db > VAD_THRESHOLD_DB - 10) & (zcr > VAD_ZCR))
+
+
+def iter_speech(blocks, sr, timer):
+    """
+    Voice activity detection over a stream of blocks. Yields (start seconds,
+    samples, continues previous) for every stretch of speech, padded by
+    VAD_PAD_SECONDS; leading and trailing silence and pauses longer than
+    VAD_MIN_PAUSE_SECONDS are left out. A stretch longer than a window is cut
+    into window-long pieces overlapping by OVERLAP_SECONDS, each one after
+    the first marked as continuing the one before. Blocks are kept as they
+    come from the start of the current piece and joined once per piece.
+    """
+    frame = max(1, int(VAD_FRAME_SECONDS * sr))
+    pad = math.ceil(VAD_PAD_SECONDS / VAD_FRAME_SECONDS)
+    pause = math.ceil(VAD_MIN_PAUSE_SECONDS / VAD_FRAME_SECONDS)
+    window, stride = int(WINDOW_SECONDS * sr) // frame, int(STRIDE_SECONDS * sr) // frame  # in frames
+    chunks, audio_start = [], 0  # (first frame, samples) of the buffered audio, and the frame it starts at
+    tail = np.zeros(0, dtype=np.float32)  # samples of an incomplete last frame
+    classified, seg_start, last_speech = 0, None, None
+    piece_start, continued = None, False  # first frame of the current piece, and whether it continues one
+
+    def take(begin, end):
+        return np.concatenate([
+            samples[max(0, begin - first) * frame:(end - first) * frame]
+            for first, samples in chunks if first < end and first + len(samples) // frame > begin
+        ])
+
+    def pieces(end, final):
+        """Cut the current segment, up to frame end, into window-long pieces; the rest goes out when final."""
+        nonlocal piece_start, continued
+        while end - piece_start > window:
+            yield piece_start * frame / sr, take(piece_start, piece_start + window), continued
+            piece_start, continued = piece_start + stride, True
+        # A last piece that adds nothing past the previous one's overlap is left out
+        if final and not (continued and end - piece_start <= window - stride):
+            yield piece_start * frame / sr, take(piece_start, end), continued
+
+    for block in blocks:
+        tail = np.concatenate([tail, block])
+        complete = len(tail) // frame * frame
+        samples, tail = tail[:complete], tail[complete:]
+        if not complete:
+            continue
+        chunks.append((classified, samples))
+        with timer.stage("vad"):
+            flags = speech_frames(samples, frame)
+        speech = np.flatnonzero(flags) + classified
+        available = classified + complete // frame
+        if len(speech):
+            previous = np.concatenate([[last_speech if last_speech is not None else -pause - 1], speech[:-1]])
+            # A speech frame more than a pause after the one before it opens a new segment
+            for i in np.flatnonzero(speech - previous > pause):
+                if seg_start is not None:
+                    yield from pieces(int(previous[i]) + 1 + pad, final=True)
+                seg_start = int(speech[i])
+                piece_start, continued = max(seg_start - pad, audio_start), False
+            last_speech = int(speech[-1])
+        classified = available
+        if seg_start is not None and classified - last_speech > pause:
+            yield from pieces(last_speech + 1 + pad, final=True)
+            seg_start = None
+        elif seg_start is not None:
+            yield from pieces(classified, final=False)
+        keep = piece_start if seg_start is not None else classified - pad
+        if keep > audio_start:
+            chunks = [
+                (max(first, keep), samples[max(0, keep - first) * frame:])
+                for first, samples in chunks if first + len(samples) // frame > keep
+            ]
+            audio_start = keep
+    if seg_start is not None:
+        chunks.append((classified, tail))  # the audio ends on a partial frame
+        yield from pieces(last_speech + 1 + pad, final=True)
+
+
+def pack_segments(segments, sr, timer):
+    """
+    Turn speech segments into windows. Consecutive segments that fit are
+    packed into one window, VAD_GAP_SECONDS apart, whose last field lists
+    every segment as (offset seconds in the window, start seconds, seconds),
+    so times in the window can be mapped back to the audio. The pieces of a
+    segment iter_speech had to cut get a window each, overlapping like
+    slide_windows.
+    """
+    window = int(WINDOW_SECONDS * sr)
+    gap = np.zeros(int(VAD_GAP_SECONDS * sr), dtype=np.float32)
+    packed, spans, piece = [], [], None
+
+    def flush():
+        with timer.stage("resample"):
+            return spans[0][1], to_target_rate(np.concatenate(packed), sr), False, False, spans
+
+    for start, samples, continues in segments:
+        if piece is not None:
+            # Held back until it is known whether this segment continues it
+            yield piece + (continues, None)
+            piece = None
+        own_window = continues or len(samples) >= window
+        if packed and (own_window or sum(len(p) for p in packed) + len(gap) + len(samples) > window):
+            yield flush()
+            packed, spans = [], []
+        if own_window:
+            with timer.stage("resample"):
+                piece = (start, to_target_rate(samples, sr), continues)
+            continue
+        if packed:
+            packed.append(gap)
+        spans.append((sum(len(p) for p in packed) / sr, start, len(samples) / sr))
+        packed.append(samples)
+    if piece is not None:
+        yield piece + (False, None)
+    if packed:
+        yield flush()
+
+
+def iter_windows(audio, timer=None, vad=VAD):
+    """
+    Decode audio (see open_audio) and yield the windows to transcribe as
+    (start seconds, 16 kHz window, overlaps previous, overlaps next, segment
+    spans of a packed window or None). With vad, only the detected speech is
+    windowed.
+    """
+    timer = timer or StageTimer()
+    with timer.stage("decode"):
+        sr, blocks = open_audio(audio)
+    blocks = timed_blocks(blocks, timer)
+    if vad:
+        yield from pack_segments(iter_speech(blocks, sr, timer), sr, timer)
+    else:
+        yield from slide_windows(blocks, sr, 0.0, timer)
+
+
+def generate_windows(windows, timer=None):
+    """Run Whisper on a batch of windows; returns one decoded {"text", "offsets"} per window."""
+    timer = timer or StageTimer()
     with torch.no_grad():
-        generated_ids = model.generate(inputs["input_features"])
-        transcription = processor.batch_decode(
-            generated_ids, skip_special_tokens=True
-        )[0]
+        with timer.stage("features"):
+            input_features = frontend([window[1] for window in windows])
+        start = time.perf_counter()
+        with timer.stage("generate"):
+            if TIMESTAMPS:
+                generated_ids = model.generate(input_features, return_timestamps=True)
+            else:
+                generated_ids = model.generate(input_features)
+        elapsed = time.perf_counter() - start
+    pad_id = model.generation_config.pad_token_id
+    tokens = generated_ids.numel() if pad_id is None else int((generated_ids != pad_id).sum())
+    WINDOW_BATCH.observe(len(windows))
+    GENERATED_TOKENS.inc(tokens)
+    if elapsed:
+        TOKENS_PER_SECOND.observe(tokens / elapsed)
+    if not TIMESTAMPS:
+        return [{"text": text, "offsets": []} for text in processor.batch_decode(generated_ids, skip_special_tokens=True)]
+    return [
+        processor.tokenizer.decode(ids, skip_special_tokens=True, output_offsets=True)
+        for ids in generated_ids
+    ]
+
+
+def drop_overlap(previous, text, max_words=50):
+    """Remove the longest run of words at the start of text that repeats the end of previous."""
+    before, after = previous.split(), text.split()
+    for k in range(min(len(before), len(after), max_words), 1, -1):
+        if before[-k:] == after[:k]:
+            return " ".join(after[k:])
+    return text.strip()
+
+
+def audio_time(spans, seconds):
+    """Where seconds into a packed window fall in the audio; a time in a gap sticks to the segment before it."""
+    for offset, start, duration in reversed(spans):
+        if seconds >= offset:
+            return start + min(seconds - offset, duration)
+    return spans[0][1]
+
+
+def stitch_window(start, samples, overlaps_previous, overlaps_next, spans, output, previous):
+    """
+    Cut a window's transcript down to the part it owns. With timestamps, a
+    window keeps the segments whose midpoint lies between the middles of its
+    overlaps with the previous and next windows; otherwise the words it
+    repeats from the previous window are dropped. Times in a window packed
+    from several speech segments are mapped back through its spans.
+    Returns (text, start seconds, end seconds).
+    """
+    duration = len(samples) / TARGET_SAMPLE_RATE
+    if spans:
+        text, times = output["text"].strip(), []
+        for segment in output["offsets"]:
+            seg_start, seg_end = segment["timestamp"]
+            times += [seg_start, seg_end if seg_end is not None else duration]
+        if not times:
+            return text, spans[0][1], spans[-1][1] + spans[-1][2]
+        return text, audio_time(spans, min(times)), audio_time(spans, max(times))
+    if not output["offsets"]:
+        text = drop_overlap(previous, output["text"]) if overlaps_previous else output["text"].strip()
+        return text, start + (OVERLAP_SECONDS / 2 if overlaps_previous else 0), start + duration
+
+    low = start + OVERLAP_SECONDS / 2 if overlaps_previous else float("-inf")
+    high = start + STRIDE_SECONDS + OVERLAP_SECONDS / 2 if overlaps_next else float("inf")
+    parts, times = [], []
+    for segment in output["offsets"]:
+        seg_start, seg_end = segment["timestamp"]
+        seg_end = seg_end if seg_end is not None else duration
+        middle = start + (seg_start + seg_end) / 2
+        if low <= middle < high:
+            parts.append(segment["text"].strip())
+            times += [start + seg_start, start + seg_end]
+    text = " ".join(p for p in parts if p)
+    return text, (min(times) if times else max(low, start)), (max(times) if times else min(high, start + duration))
+
+
+def iter_transcription(audio, timer=None, vad=VAD):
+    """
+    Transcribe audio (see open_audio) window by window, yielding {"start", "end", "text"}
+    for each window as soon as its batch has been generated.
+    """
+    transcript, batch = "", []
+    timer = timer or StageTimer()
+
+    def flush():
+        nonlocal transcript
+        for window, output in zip(batch, generate_windows(batch, timer)):
+            text, start, end = stitch_window(*window, output, transcript)
+            transcript = f"{transcript} {text}".strip() if text else transcript
+            yield {"start": round(start, 2), "end": round(end, 2), "text": text}
+        batch.clear()
+
+    for window in iter_windows(audio, timer, vad):
+        batch.append(window)
+        if len(batch) >= BATCH_SIZE:
+            yield from flush()
+    if batch:
+        yield from flush()
+
+
+def join_windows(windows, outputs):
+    """Stitch the generated outputs of a file's windows into one transcript."""
+    transcript = ""
+    for window, output in zip(windows, outputs):
+        text, _, _ = stitch_window(*window, output, transcript)
+        transcript = f"{transcript} {text}".strip() if text else transcript
+    return transcript
+
+
+def transcribe_audio(audio, timer=None, vad=VAD) -> str:
+    if isinstance(audio, str) and not os.path.isfile(audio):
+        return "[ERROR] File not found: {}".format(audio)
+
+    texts = [part["text"] for part in iter_transcription(audio, timer, vad)]
+    return " ".join(t for t in texts if t)
+
+
+readiness = Readiness(["processor", "model", "warm-up"])
+admission = Admission(MAX_IN_FLIGHT, MAX_QUEUED)
+
+
+def load():
+    """Load the processor and model in parallel, then warm up on a second of silence."""
+    global processor, model, frontend, TIMESTAMPS
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        processor_future = pool.submit(readiness.track, "processor", load_processor)
+        model_future = pool.submit(readiness.track, "model", load_model)
+        processor, model = processor_future.result(), model_future.result()
+    TIMESTAMPS = getattr(model.generation_config, "no_timestamps_token_id", None) is not None
+    frontend = LogMelFrontend(processor.feature_extractor, DEVICE)
+    # Runs the feature frontend and generate once, so kernel selection and
+    # allocator warm-up happen before the first request
+    with readiness.step("warm-up"):
+        generate_windows([(0.0, np.zeros(TARGET_SAMPLE_RATE, dtype=np.float32), False, False)])
 
-    return transcription
 
 # === Flask Routes ===
-@app.route("/transcribe", methods=["POST"])
-def transcribe_endpoint():
-    if "audio" not in request.files:
-        return jsonify({"error": "No audio file provided."}), 400
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS)
 
-    audio_file = request.files["audio"]
 
-    # Save file as temp with original extension
-    ext = os.path.splitext(audio_file.filename)[-1].lower()
-    if ext not in [".wav", ".mp3", ".flac"]:
-        return jsonify({"error": f"Unsupported file format: {ext}"}), 400
+@app.before_request
+def assign_request_id():
+    g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
 
-    temp_path = f"temp_audio{ext}"
-    audio_file.save(temp_path)
 
+@app.after_request
+def echo_request_id(response):
+    response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
+
+
+def check_extension(filename):
+    ext = os.path.splitext(filename or "")[-1].lower()
+    if ext not in AUDIO_EXTENSIONS:
+        raise ValueError(f"Unsupported file format: {ext}")
+
+
+def use_vad():
+    """Whether a request asked for VAD ("vad" form field or query parameter), else the TRANSCRIBE_VAD default."""
+    value = request.values.get("vad")
+    return VAD if value is None else value.lower() in ("1", "true", "yes")
+
+
+def pcm_parameter(name, default, low, high):
+    """An integer query parameter of a PCM upload, checked to lie in [low, high]."""
+    value = request.args.get(name, str(default))
     try:
-        transcription = transcribe_audio(temp_path)
-        return jsonify({"transcription": transcription})
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"PCM {name} must be an integer, got {value!r}.") from None
+    if not low <= number <= high:
+        raise ValueError(f"PCM {name} must be between {low} and {high}, got {number}.")
+    return number
+
+
+def read_upload():
+    """
+    Take the audio of a request without a round trip through the disk: a
+    multipart "audio" file, a WAV request body, or a raw 16-bit little-endian
+    PCM body (audio/pcm, with "rate" and "channels" query parameters).
+    PCM WAV data is parsed here, so its header is checked like the query
+    parameters. Raises ValueError when there is no usable audio or the PCM
+    parameters are out of range.
+    """
+    if "audio" in request.files:
+        audio_file = request.files["audio"]
+        check_extension(audio_file.filename)
+        data = audio_file.read()
+        return parse_wav(data) or data
+    if request.mimetype in WAV_MIMETYPES:
+        data = request.get_data()
+        return parse_wav(data) or data
+    if request.mimetype == "audio/pcm":
+        rate = pcm_parameter("rate", TARGET_SAMPLE_RATE, *PCM_RATES)
+        channels = pcm_parameter("channels", 1, 1, PCM_MAX_CHANNELS)
+        data = request.get_data()
+        frames = len(data) // (2 * channels)
+        return np.frombuffer(data, "<i2", count=frames * channels).reshape(-1, channels), rate
+    raise ValueError("No audio file provided.")
+
+
+@app.route("/transcribe", methods=["POST"])
+@IN_PROGRESS.track_inprogress()
+def transcribe_endpoint():
+    try:
+        audio = read_upload()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    timer = StageTimer(g.request_id)
+    try:
+        transcription = transcribe_audio(audio, timer, use_vad())
+        return jsonify({"transcription": transcription, "timing": timer.finish("transcribe")})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+
+@app.route("/transcribe/stream", methods=["POST"])
+def transcribe_stream_endpoint():
+    """
+    Same upload as /transcribe, but the transcript is streamed as NDJSON:
+    one {"start", "end", "text"} line per 30 s window as it is transcribed,
+    then a final {"done": true, "transcription": ...} line.
+    """
+    try:
+        audio = read_upload()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    vad = use_vad()
+
+    def events():
+        texts, timer = [], StageTimer(g.request_id)
+        try:
+            with IN_PROGRESS.track_inprogress():
+                for part in iter_transcription(audio, timer, vad):
+                    texts.append(part["text"])
+                    yield json.dumps(part) + "\n"
+            transcription = " ".join(t for t in texts if t)
+            timing = timer.finish("transcribe_stream")
+            yield json.dumps({"done": True, "transcription": transcription, "timing": timing}) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return Response(stream_with_context(events()), mimetype="application/x-ndjson")
+
+@app.route("/transcribe/batch", methods=["POST"])
+@IN_PROGRESS.track_inprogress()
+def transcribe_batch_endpoint():
+    """
+    Transcribe every file uploaded under "audio". Files are decoded and
+    resampled on the decode pool, then the 30 s windows of all files are run
+    through Whisper together, batch_size (form field) windows per generate.
+    Results come back in upload order, each with either a transcription or
+    the error that file ran into.
+    """
+    files = request.files.getlist("audio")
+    if not files:
+        return jsonify({"error": "No audio file provided."}), 400
+    value = request.form.get("batch_size", str(BATCH_SIZE))
+    try:
+        batch_size = int(value)
+    except ValueError:
+        return jsonify({"error": f"'batch_size' must be an integer, got {value!r}."}), 400
+    if not 1 <= batch_size <= MAX_BATCH_SIZE:
+        return jsonify({"error": f"'batch_size' must be between 1 and {MAX_BATCH_SIZE}, got {batch_size}."}), 400
+
+    timer, vad = StageTimer(g.request_id), use_vad()
+
+    def decode(filename, data):
+        check_extension(filename)
+        return list(iter_windows(data, timer, vad))
+
+    results = [{"file": f.filename} for f in files]
+    futures = [decode_pool.submit(decode, f.filename, f.read()) for f in files]
+    windows = {}
+    for i, future in enumerate(futures):
+        try:
+            windows[i] = future.result()
+        except Exception as e:
+            results[i]["error"] = str(e)
+
+    # Windows of different files share batches; the feature extractor pads each to 30 s
+    queued = [(i, window) for i in windows for window in windows[i]]
+    outputs = {i: [] for i in windows}
+    for start in range(0, len(queued), batch_size):
+        chunk = [(i, window) for i, window in queued[start:start + batch_size] if "error" not in results[i]]
+        if not chunk:
+            continue
+        try:
+            generated = generate_windows([window for _, window in chunk], timer)
+        except Exception as e:
+            for i, _ in chunk:
+                results[i]["error"] = f"Generation failed: {e}"
+            continue
+        for (i, _), output in zip(chunk, generated):
+            outputs[i].append(output)
+
+    for i in windows:
+        if "error" not in results[i]:
+            results[i]["transcription"] = join_windows(windows[i], outputs[i])
+    return jsonify({"results": results, "timing": timer.finish("transcribe_batch")})
+
+@app.route("/transcribe/stats", methods=["GET"])
+def transcribe_stats():
+    """Service-wide time per pipeline stage and the source rates with a cached resampler."""
+    with stage_lock:
+        totals = {f"{name}_ms": round(seconds * 1000, 1) for name, seconds in stage_totals.items()}
+    with resamplers_lock:
+        rates = sorted(resamplers)
+    return jsonify({"stages": totals, "resampler_rates": rates})
+
+@app.route("/metrics")
+def metrics():
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:  # gunicorn workers: add up the samples of every worker
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+@app.before_request
+def require_ready():
+    """Answer 503 while the model is loading; liveness, readiness and metrics stay available."""
+    if not readiness.ready and request.endpoint not in ("health_check", "ready", "metrics"):
+        body = {"error": "Model is still loading.", **readiness.report()}
+        return jsonify(body), 503, {"Retry-After": str(RETRY_AFTER_SECONDS)}
+
+
+install_admission(
+    app, admission, ("transcribe_endpoint", "transcribe_stream_endpoint", "transcribe_batch_endpoint"),
+    REFUSED, RETRY_AFTER_SECONDS,
+)
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    return jsonify(readiness.report()), 200 if readiness.ready else 503
 
 @app.route("/health", methods=["GET"])
 def health_check():
     return jsonify({"status": "ok", "model": MODEL_ID})
 
+readiness.run(load, LOAD_IN_BACKGROUND)
+
 # === Run Server ===
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "5000")))
@@ -0,0 +1,388 @@
+# Benchmark harness for the model services and the orchestrator pipeline
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from datetime import datetime, timezone
+
+import httpx
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Default endpoints are the host ports of docker-compose.yml and the
+# host-orchestrator.py gateway
+DEFAULT_URLS = {
+    "chat": "http://localhost:5001",
+    "translate": "http://localhost:5002",
+    "transcribe": "http://localhost:5003",
+    "pipeline": "http://localhost:5004",
+}
+TARGETS = tuple(DEFAULT_URLS)
+
+# === Stub mode ===
+# --stub starts every service locally with STUB_MODELS=1 (tiny randomly
+# initialized models of the real architectures, real tokenizers) on the ports
+# above, plus the host-orchestrator gateway, and stops them afterwards.
+# Only tokenizer and config files are needed, so after the first run it works
+# offline with HF_HUB_OFFLINE=1 on a CPU-only box.
+STUB_SERVICES = {
+    "chat": ("Coversational Agent --Docker", "coverse.py"),
+    "translate": ("IndicTranslation -- Docker", "IndicTranslation.py"),
+    "transcribe": ("Transcription Agent --Docker", "transcribe.py"),
+}
+STUB_CHAT_MODEL = "Qwen/Qwen3-0.6B"  # config + tokenizer when ./model/Qwen3-0.6B is absent
+
+CHAT_PROMPTS = [
+    "What is the capital of Karnataka?",
+    "Give me three tips for staying healthy during the monsoon.",
+    "Explain in two sentences how a rainbow forms.",
+    "Suggest a simple vegetarian dinner recipe.",
+    "What should I pack for a weekend trip to Mysuru?",
+]
+TRANSLATE_SENTENCES = [
+    "The weather is pleasant and the market is busy this morning.",
+    "Please remember to drink enough water and take some rest.",
+    "ನಮಸ್ಕಾರ, ನೀವು ಹೇಗಿದ್ದೀರಿ?",
+    "ಇಂದು ಬೆಂಗಳೂರಿನಲ್ಲಿ ಮಳೆ ಬರುವ ಸಾಧ್ಯತೆ ಇದೆ.",
+]
+PIPELINE_INPUTS = [
+    "ನಮಸ್ಕಾರ, ಇಂದು ಹವಾಮಾನ ಹೇಗಿದೆ?",
+    "ನನಗೆ ಒಂದು ಸರಳ ಅಡುಗೆ ಹೇಳಿ.",
+    "What is a good book to read this weekend?",
+]
+
+
+def percentile(values, q):
+    """Linearly interpolated q-th percentile of values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def synth_wav(seconds, seed, rate=16000):
+    """
+    A reproducible 16-bit mono WAV: bursts of harmonic tones with noise
+    separated by short pauses, roughly the shape of speech.
+    """
+    rng = random.Random(seed)
+    samples = []
+    t = 0
+    while len(samples) < seconds * rate:
+        burst = int(rate * rng.uniform(0.4, 1.5))
+        pitch = rng.uniform(110, 260)
+        for i in range(burst):
+            x = (t + i) / rate
+            value = 0.3 * math.sin(2 * math.pi * pitch * x) + 0.15 * math.sin(4 * math.pi * pitch * x)
+            samples.append(value + rng.gauss(0, 0.02))
+        samples.extend(rng.gauss(0, 0.005) for _ in range(int(rate * rng.uniform(0.1, 0.6))))
+        t += burst
+    samples = samples[:int(seconds * rate)]
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"".join(
+            int(max(-1.0, min(1.0, s)) * 32767).to_bytes(2, "little", signed=True) for s in samples
+        ))
+    return buffer.getvalue()
+
+
+class Workload:
+    """Builds the i-th request of a target and reads generated tokens from its response."""
+
+    def __init__(self, args):
+        self.args = args
+        if args.audio:
+            with open(args.audio, "rb") as f:
+                self.audio = (os.path.basename(args.audio), f.read())
+        else:
+            self.audio = ("bench.wav", synth_wav(args.audio_seconds, args.seed))
+
+    def request(self, target, i):
+        """(path, httpx request kwargs) of request i."""
+        if target == "chat":
+            prompt = CHAT_PROMPTS[i % len(CHAT_PROMPTS)]
+            # Greedy decoding keeps reply lengths, and so timings, comparable between runs
+            payload = {"input": prompt, "max_new_tokens": self.args.max_new_tokens, "do_sample": False}
+            if self.args.draft_tokens is not None:
+                payload["draft_tokens"] = self.args.draft_tokens
+            return "/chat", {"json": payload}
+        if target == "translate":
+            # A request number keeps sentences distinct, so every run measures the models, not the cache
+            count = self.args.sentences
+            sentences = [f"{TRANSLATE_SENTENCES[(i + k) % len(TRANSLATE_SENTENCES)]} ({i}.{k})" for k in range(count)]
+            return "/translate", {"json": {"sentences": sentences, "profile": self.args.profile}}
+        if target == "transcribe":
+            return "/transcribe", {"files": {"audio": self.audio}}
+        return "/turn", {"json": {"input": f"{PIPELINE_INPUTS[i % len(PIPELINE_INPUTS)]} ({i})"}}
+
+    @staticmethod
+    def tokens(target, body):
+        """Generated tokens reported in a response, or None when the target reports none."""
+        if target in ("chat", "translate"):
+            return body.get("timing", {}).get("generated_tokens")
+        if target == "pipeline":
+            spans = body.get("spans", {})
+            return sum(t.get("generated_tokens", 0) for stage in ("llm", "translate") for t in spans.get(stage, []))
+        return None
+
+
+async def scrape_rss(http, base_url):
+    """Resident memory of a service in MB, from its /metrics endpoint."""
+    try:
+        response = await http.get(base_url + "/metrics", timeout=5)
+        for line in response.text.splitlines():
+            if line.startswith("process_resident_memory_bytes"):
+                return round(float(line.split()[-1]) / 2 ** 20, 1)
+    except (httpx.HTTPError, ValueError):
+        pass
+    return None
+
+
+async def run_target(http, target, base_url, workload, args):
+    """Send args.requests requests to one target, args.concurrency at a time, after args.warmup warm-up requests."""
+    async def send(i):
+        path, kwargs = workload.request(target, i)
+        start = time.perf_counter()
+        response = await http.post(base_url + path, timeout=args.timeout, **kwargs)
+        elapsed = time.perf_counter() - start
+        response.raise_for_status()
+        return elapsed, workload.tokens(target, response.json())
+
+    for i in range(args.warmup):
+        try:
+            await send(-1 - i)
+        except httpx.HTTPError as e:
+            print(f"[WARN] {target} warm-up request failed: {e}", file=sys.stderr)
+
+    rss_before = await scrape_rss(http, base_url)
+    latencies, tokens, errors = [], [], []
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            try:
+                elapsed, count = await send(i)
+            except (httpx.HTTPError, ValueError) as e:
+                errors.append(str(e))
+                continue
+            latencies.append(elapsed)
+            if count is not None:
+                tokens.append(count)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    wall = time.perf_counter() - start
+    rss_after = await scrape_rss(http, base_url)
+
+    return {
+        "url": base_url,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else None,
+        "latency_ms": {
+            name: round(value * 1000, 1) if value is not None else None
+            for name, value in (
+                ("p50", percentile(latencies, 50)),
+                ("p95", percentile(latencies, 95)),
+                ("p99", percentile(latencies, 99)),
+                ("mean", sum(latencies) / len(latencies) if latencies else None),
+                ("max", max(latencies, default=None)),
+            )
+        },
+        "generated_tokens": sum(tokens) if tokens else None,
+        "tokens_per_second": round(sum(tokens) / wall, 1) if tokens and wall else None,
+        "rss_mb": {"before": rss_before, "after": rss_after},
+    }
+
+
+def start_stub_services(targets, log_dir):
+    """
+    Start the model services the targets need in stub mode; returns the
+    processes. The gateway is started separately, once these are ready.
+    """
+    needed = set(STUB_SERVICES) if "pipeline" in targets else set(targets)
+    processes = []
+    for name in STUB_SERVICES:
+        if name not in needed:
+            continue
+        folder, script = STUB_SERVICES[name]
+        port = DEFAULT_URLS[name].rsplit(":", 1)[1]
+        env = dict(os.environ, STUB_MODELS="1", PORT=port)
+        if name == "chat" and not os.path.isdir(os.path.join(ROOT, folder, "model", "Qwen3-0.6B")):
+            env.setdefault("CHAT_MODEL_DIR", STUB_CHAT_MODEL)
+        processes.append(spawn(name, [sys.executable, script], os.path.join(ROOT, folder), env, log_dir))
+    return processes
+
+
+def start_stub_gateway(log_dir):
+    """
+    Start the host orchestrator's gateway. Its startup check exits when a
+    service is unreachable, so call this only after the services are ready.
+    """
+    port = DEFAULT_URLS["pipeline"].rsplit(":", 1)[1]
+    command = [sys.executable, "host-orchestrator.py", "serve", "--port", port]
+    return spawn("pipeline", command, ROOT, dict(os.environ), log_dir)
+
+
+def spawn(name, command, cwd, env, log_dir):
+    log = open(os.path.join(log_dir, f"{name}.log"), "wb")
+    print(f"[INFO] Starting {name} (log: {log.name})", file=sys.stderr)
+    return subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_for_ready(http, urls, processes, timeout):
+    """
+    Wait until every service answers /ready (the gateway: /health) with 200;
+    raises RuntimeError on timeout or when a service exits.
+    """
+    deadline = time.monotonic() + timeout
+    pending = dict(urls)
+    while pending:
+        for name, url in list(pending.items()):
+            path = "/health" if name == "pipeline" else "/ready"
+            try:
+                if (await http.get(url + path, timeout=2)).status_code == 200:
+                    print(f"[INFO] {name} is up", file=sys.stderr)
+                    del pending[name]
+            except httpx.HTTPError:
+                pass
+        if any(p.poll() is not None for p in processes):
+            raise RuntimeError("A stub service exited during startup; see its log.")
+        if pending and time.monotonic() > deadline:
+            raise RuntimeError(f"Timed out waiting for: {', '.join(pending)}")
+        if pending:
+            await asyncio.sleep(1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    unknown = [t for t in targets if t not in TARGETS]
+    if unknown:
+        sys.exit(f"Unknown target(s): {', '.join(unknown)} (choose from {', '.join(TARGETS)})")
+    urls = {t: getattr(args, f"{t}_url") for t in TARGETS}
+    workload = Workload(args)
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    processes = []
+    async with httpx.AsyncClient(limits=limits) as http:
+        try:
+            if args.stub:
+                log_dir = args.log_dir or tempfile.mkdtemp(prefix="bench-")
+                os.makedirs(log_dir, exist_ok=True)
+                processes = start_stub_services(targets, log_dir)
+                needed = set(STUB_SERVICES) if "pipeline" in targets else set(targets)
+                await wait_for_ready(http, {t: urls[t] for t in needed}, processes, args.startup_timeout)
+                if "pipeline" in targets:
+                    processes.append(start_stub_gateway(log_dir))
+                    await wait_for_ready(http, {"pipeline": urls["pipeline"]}, processes, args.startup_timeout)
+            results = {}
+            for target in targets:
+                print(f"[INFO] Benchmarking {target}...", file=sys.stderr)
+                results[target] = await run_target(http, target, urls[target], workload, args)
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "stub": args.stub,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "settings": {
+                key: getattr(args, key)
+                for key in ("requests", "concurrency", "warmup", "seed", "max_new_tokens",
+                            "draft_tokens", "sentences", "profile", "audio", "audio_seconds")
+            },
+        },
+        "results": results,
+    }
+
+
+def print_summary(report):
+    print(f"{'target':<12}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'tok/s':>9}{'RSS MB':>9}{'errors':>8}",
+          file=sys.stderr)
+    for target, r in report["results"].items():
+        latency = r["latency_ms"]
+        print(
+            f"{target:<12}{r['throughput_rps'] or '-':>8}{latency['p50'] or '-':>10}{latency['p95'] or '-':>10}"
+            f"{latency['p99'] or '-':>10}{r['tokens_per_second'] or '-':>9}{r['rss_mb']['after'] or '-':>9}"
+            f"{r['errors']:>8}",
+            file=sys.stderr,
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark /chat, /translate, /transcribe and the /turn pipeline; writes JSON results."
+    )
+    parser.add_argument("--targets", default=",".join(TARGETS), help="comma-separated subset of " + ", ".join(TARGETS))
+    parser.add_argument("--requests", type=int, default=50, help="measured requests per target")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured requests sent first")
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthesized audio")
+    parser.add_argument("--max-new-tokens", type=int, default=64, help="reply length cap of /chat requests")
+    parser.add_argument("--draft-tokens", type=int, help="prompt-lookup draft tokens of /chat requests (default: the service's)")
+    parser.add_argument("--sentences", type=int, default=4, help="sentences per /translate request")
+    parser.add_argument("--profile", default="balanced", help="decoding profile of /translate requests")
+    parser.add_argument("--audio", help="audio file for /transcribe (default: synthesized speech-like WAV)")
+    parser.add_argument("--audio-seconds", type=float, default=10.0, help="length of the synthesized audio")
+    parser.add_argument("--output", default="benchmark.json", help="JSON results file, - for stdout")
+    parser.add_argument("--stub", action="store_true", help="start the services locally with stub models")
+    parser.add_argument("--startup-timeout", type=float, default=600.0, help="seconds to wait for stub services")
+    parser.add_argument("--log-dir", help="where stub service logs go (default: a temp dir)")
+    for target, url in DEFAULT_URLS.items():
+        parser.add_argument(f"--{target}-url", default=url, help=f"base URL of the {target} target")
+    args = parser.parse_args()
+    if args.requests < 1 or args.concurrency < 1:
+        parser.error("--requests and --concurrency must be positive")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(run(args))
+    print_summary(report)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"[INFO] Results written to {args.output}", file=sys.stderr)
@@ -0,0 +1,168 @@
+"""
+Readiness reporting and admission control shared by the chat, translation and
+transcription services. Each image copies this file next to its app (see the
+additional_contexts in docker-compose.yml); run from a checkout, the services
+import it from this folder.
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, jsonify, request
+
+# === Admission config ===
+# "X-Priority: batch" requests wait behind interactive ones, and one whose
+# "X-Request-Timeout: <seconds>" runs out in the queue is dropped unrun (504).
+PRIORITY_HEADER = "X-Priority"
+TIMEOUT_HEADER = "X-Request-Timeout"
+PRIORITY_CLASSES = {"interactive": 0, "batch": 1}
+MAX_REQUEST_TIMEOUT = 3600.0  # longer X-Request-Timeouts are cut to this
+
+
+class Readiness:
+    """Progress of the model load, reported by /ready."""
+
+    def __init__(self, steps):
+        self.steps = dict.fromkeys(steps, "pending")
+        self.ready = False
+        self.error = None
+        self.seconds = None
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def step(self, name):
+        self.steps[name] = "loading"
+        try:
+            yield
+        except BaseException:
+            self.steps[name] = "failed"
+            raise
+        self.steps[name] = "done"
+
+    def track(self, name, fn):
+        with self.step(name):
+            return fn()
+
+    def run(self, load, background=True):
+        """Run load(), on a daemon thread when background, and mark the service ready once it returns."""
+        def target():
+            try:
+                load()
+            except Exception as e:
+                self.error = str(e)
+                print(f"[ERROR] Model loading failed: {e}")
+                if not background:
+                    raise
+                return
+            self.seconds = round(time.perf_counter() - self._start, 1)
+            self.ready = True
+            print(f"[INFO] Ready after {self.seconds}s")
+
+        if background:
+            threading.Thread(target=target, daemon=True).start()
+        else:
+            target()
+
+    def report(self):
+        done = sum(state == "done" for state in self.steps.values())
+        return {
+            "ready": self.ready,
+            "progress": round(done / len(self.steps), 2),
+            "steps": dict(self.steps),
+            "elapsed_s": self.seconds if self.ready else round(time.perf_counter() - self._start, 1),
+            "error": self.error,
+        }
+
+
+class Admission:
+    """
+    Admission control for the model endpoints. At most max_in_flight requests
+    run at once and up to max_queued more wait for a slot, interactive ones
+    ahead of batch ones. Anything beyond that is refused at once (429), and a
+    request whose deadline passes while it waits is dropped unrun (504).
+    """
+
+    def __init__(self, max_in_flight, max_queued):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.in_flight = 0
+        self._waiting = []  # heap of (priority, arrival, Event)
+        self._arrivals = itertools.count()
+        self._lock = threading.Lock()
+
+    def acquire(self, priority, deadline=None):
+        """Take a slot, waiting for one if needed. Returns None once admitted, else the status to refuse with."""
+        if deadline is not None and deadline <= time.monotonic():
+            return 504
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self._waiting:
+                self.in_flight += 1
+                return None
+            if len(self._waiting) >= self.max_queued:
+                return 429
+            entry = (priority, next(self._arrivals), threading.Event())
+            heapq.heappush(self._waiting, entry)
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if entry[2].wait(timeout):
+            return None
+        with self._lock:
+            if entry[2].is_set():  # handed a slot just as the deadline passed
+                return None
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+        return 504
+
+    def release(self):
+        """Free a slot, handing it straight to the first waiting request."""
+        with self._lock:
+            if self._waiting:
+                heapq.heappop(self._waiting)[2].set()
+            else:
+                self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": self.in_flight, "queued": len(self._waiting)}
+
+
+def request_deadline():
+    """Monotonic deadline from the caller's X-Request-Timeout (at most MAX_REQUEST_TIMEOUT away), or None."""
+    try:
+        seconds = float(request.headers[TIMEOUT_HEADER])
+    except (KeyError, ValueError):
+        return None
+    if not math.isfinite(seconds):
+        return None
+    return time.monotonic() + min(seconds, MAX_REQUEST_TIMEOUT)
+
+
+def install_admission(app, admission, endpoints, refused_counter, retry_after):
+    """
+    Hold the given endpoints of app to the admission limits. Admitted requests
+    get g.priority and g.deadline; refusals are counted on refused_counter
+    (labelled by status) and 429s carry Retry-After: retry_after seconds.
+    """
+    @app.before_request
+    def admit():
+        """Take a slot for the model endpoints; it is freed in release_slot."""
+        if request.endpoint not in endpoints:
+            return None
+        g.priority = PRIORITY_CLASSES.get(request.headers.get(PRIORITY_HEADER, "").lower(), 0)
+        g.deadline = request_deadline()
+        refused = admission.acquire(g.priority, g.deadline)
+        if refused is None:
+            g.admitted = True
+            return None
+        refused_counter.labels(str(refused)).inc()
+        if refused == 504:
+            return jsonify({"error": "The request's deadline passed before it could run."}), 504
+        body = {"error": "Too many requests, try again later.", **admission.stats()}
+        return jsonify(body), 429, {"Retry-After": str(retry_after)}
+
+    @app.teardown_request
+    def release_slot(error=None):
+        if g.pop("admitted", False):
+            admission.release()
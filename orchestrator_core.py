@@ -0,0 +1,888 @@
+"""
+The Kannada/English assistant pipeline shared by orchestrator.py (Docker, the
+services reached by their compose names) and host-orchestrator.py (services on
+localhost ports). Those scripts only say where the services are, which port the
+gateway takes and how startup treats a missing service, then call main().
+"""
+import sys
+import os
+import argparse
+import contextlib
+import importlib.util
+import httpx
+import pyttsx3
+import time
+import random
+import asyncio
+import threading
+import re
+import json
+import queue
+import uuid
+from flask import Flask, request, jsonify, Response
+from prometheus_client import Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# Services by the name startup reports them under, and the key of their base URL
+SERVICE_NAMES = {
+    "LLM Service": "chat",
+    "Translation Service": "translation",
+    "Transcription Service": "transcription",
+}
+
+# Decoding profile for interactive turns: 2-beam search trades a little quality for latency
+TRANSLATE_PROFILE = "balanced"
+
+# === Stage config ===
+# Every service call has its own timeout in seconds and retry count, which can
+# be overridden as ORCH_<STAGE>_TIMEOUT / ORCH_<STAGE>_RETRIES. Retries wait at
+# least the Retry-After a busy (429) or loading (503) service asks for, or back
+# off exponentially from RETRY_BACKOFF seconds, plus up to half again as jitter
+# so turns refused together do not come back together; a streamed LLM reply is
+# only retried until its first token has arrived. Every call carries the
+# client's priority class and its timeout, so services queue batch work behind
+# interactive turns and never run a call that has already been given up on.
+STAGE_DEFAULTS = {
+    "transcribe": (120.0, 1),
+    "translate": (30.0, 2),
+    "llm": (120.0, 1),
+    "session": (10.0, 2),
+    "health": (5.0, 0),
+}
+STAGE_TIMEOUTS = {
+    stage: float(os.environ.get(f"ORCH_{stage.upper()}_TIMEOUT", timeout))
+    for stage, (timeout, _) in STAGE_DEFAULTS.items()
+}
+STAGE_RETRIES = {
+    stage: int(os.environ.get(f"ORCH_{stage.upper()}_RETRIES", retries))
+    for stage, (_, retries) in STAGE_DEFAULTS.items()
+}
+RETRY_BACKOFF = 0.5
+PRIORITY_HEADER = "X-Priority"
+TIMEOUT_HEADER = "X-Request-Timeout"
+# Services load their models in the background; /ready is polled this often until they are up
+READY_POLL_SECONDS = 2
+MAX_CONNECTIONS = int(os.environ.get("ORCH_MAX_CONNECTIONS", "20"))
+
+# === Tracing ===
+# Each turn gets a request id that every service call carries as X-Request-ID,
+# so the services' own stage timings (and TRACE_LOG lines) can be tied back to
+# the turn. The timings the services report are returned with the turn.
+REQUEST_ID_HEADER = "X-Request-ID"
+TURN_STAGE_SECONDS = Histogram(
+    "orchestrator_turn_stage_seconds", "Time a turn spends in each stage", ["stage"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+TURNS_IN_PROGRESS = Gauge("orchestrator_turns_in_progress", "Turns being run by the gateway")
+
+# === In-process mode ===
+# With --in-process the chat and translation models run inside this process:
+# coverse.py and IndicTranslation.py are imported from their service folders
+# (or ORCH_CHAT_MODULE / ORCH_TRANSLATION_MODULE) and called directly, so a text
+# turn makes no HTTP round trips and strings go straight from one model to the
+# next. Needs both services' requirements installed. Transcription still goes
+# to its service.
+HERE = os.path.dirname(os.path.abspath(__file__))
+CHAT_MODULE = os.environ.get("ORCH_CHAT_MODULE", os.path.join(HERE, "Coversational Agent --Docker", "coverse.py"))
+TRANSLATION_MODULE = os.environ.get(
+    "ORCH_TRANSLATION_MODULE", os.path.join(HERE, "IndicTranslation -- Docker", "IndicTranslation.py")
+)
+
+def is_kannada(text):
+    # Kannada Unicode range: 0C80–0CFF
+    return any(0x0C80 <= ord(char) <= 0x0CFF for char in text if not char.isspace())
+
+
+# Emojis are removed before speaking
+EMOJI_PATTERN = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "\U00002700-\U000027BF"  # Dingbats
+    "\U000024C2-\U0001F251"  # Enclosed characters
+    "]+",
+    flags=re.UNICODE
+)
+# Sentences waiting for the speech thread; a full queue holds the producer back
+TTS_QUEUE_SIZE = int(os.environ.get("ORCH_TTS_QUEUE_SIZE", "32"))
+
+
+def clean_for_speech(text):
+    """Text as it should be spoken: emojis removed and whitespace collapsed."""
+    return " ".join(EMOJI_PATTERN.sub("", text).split())
+
+
+class SpeechWorker:
+    """
+    One long-lived TTS thread that keeps a single initialized engine and
+    speaks sentences from a bounded queue as they arrive. Every turn starts
+    with start_turn(), which skips whatever an earlier turn still has queued
+    and cuts off the sentence being spoken at its next word, so replies never
+    talk over each other.
+    """
+
+    def __init__(self, maxsize=TTS_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize)
+        self.turn = 0
+        self._speaking = None  # turn of the sentence being spoken
+        self._engine = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def start_turn(self):
+        """Cancel the previous turn's speech; returns the new turn's number."""
+        self.turn += 1
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        return self.turn
+
+    def say(self, turn, text):
+        """Queue text of a turn sentence by sentence; blocks while the queue is full."""
+        for sentence in SENTENCE_END.split(clean_for_speech(text)):
+            if turn != self.turn:
+                return
+            if sentence:
+                self.queue.put((turn, sentence))
+
+    def _run(self):
+        try:
+            self._engine = pyttsx3.init()
+            self._engine.setProperty('rate', 150)
+            self._engine.setProperty('volume', 0.9)
+            self._engine.connect('started-word', self._on_word)
+        except Exception as e:
+            print(f"[ERROR] TTS failed: {e}")
+            print("[INFO] Check if a TTS engine like 'espeak' (Linux) or 'SAPI5' (Windows) is installed.")
+            self._engine = None
+        while True:
+            turn, sentence = self.queue.get()
+            if self._engine is None or turn != self.turn:
+                continue
+            self._speaking = turn
+            try:
+                self._engine.say(sentence)
+                self._engine.runAndWait()
+            except Exception as e:
+                print(f"[ERROR] TTS failed: {e}")
+            self._speaking = None
+
+    def _on_word(self, name, location, length):
+        # Runs on the speech thread inside runAndWait, where stopping the engine is safe
+        if self._speaking is not None and self._speaking != self.turn:
+            self._engine.stop()
+
+
+_speech = None
+
+
+def speech_worker():
+    """The process-wide SpeechWorker, started on first use."""
+    global _speech
+    if _speech is None:
+        _speech = SpeechWorker()
+    return _speech
+
+
+# A sentence is finished once its terminator is followed by whitespace
+SENTENCE_END = re.compile(r'(?<=[.!?\u0964])\s+')
+
+
+def split_sentences(buffer):
+    """Split finished sentences off the front of buffer, returning (sentences, remainder)."""
+    parts = SENTENCE_END.split(buffer)
+    return [p for p in parts[:-1] if p.strip()], parts[-1]
+
+
+def retryable(error):
+    """Connection problems, timeouts, 429 and 5xx responses are worth another try; other 4xx are not."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return isinstance(error, httpx.TransportError)
+
+
+def retry_delay(error, attempt):
+    """Seconds to wait before retry number attempt + 1: backoff or the service's Retry-After, with jitter."""
+    delay = RETRY_BACKOFF * 2 ** attempt
+    if isinstance(error, httpx.HTTPStatusError):
+        try:
+            delay = max(delay, float(error.response.headers.get("Retry-After", 0)))
+        except ValueError:
+            pass
+    return delay * random.uniform(1.0, 1.5)
+
+
+class StageError(Exception):
+    """A pipeline stage that failed after its retries, naming the stage for the user."""
+
+    def __init__(self, stage, error):
+        super().__init__(f"{stage} failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class Trace:
+    """One turn's request id and the stage timings the services reported for it."""
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.spans = {}  # stage -> [timing report of each call]
+
+    def headers(self):
+        return {REQUEST_ID_HEADER: self.request_id}
+
+    def add(self, stage, timing):
+        if timing:
+            self.spans.setdefault(stage, []).append(timing)
+
+
+class ServiceClient:
+    """
+    Async calls to the model services over one pooled, keep-alive HTTP client,
+    with the per-stage timeouts and retries from the stage config. urls maps
+    "chat", "translation" and "transcription" to each service's base URL.
+    Calls given a Trace send its request id and record the timing the service
+    reports.
+    """
+
+    def __init__(self, urls, priority="interactive"):
+        self.urls = urls
+        self.priority = priority
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)
+        )
+
+    def headers(self, stage, trace=None):
+        headers = {PRIORITY_HEADER: self.priority, TIMEOUT_HEADER: str(STAGE_TIMEOUTS[stage])}
+        if trace:
+            headers.update(trace.headers())
+        return headers
+
+    async def close(self):
+        await self.http.aclose()
+
+    async def post_json(self, stage, url, trace=None, **kwargs):
+        retries = STAGE_RETRIES[stage]
+        headers = self.headers(stage, trace)
+        for attempt in range(retries + 1):
+            try:
+                response = await self.http.post(url, timeout=STAGE_TIMEOUTS[stage], headers=headers, **kwargs)
+                response.raise_for_status()
+                body = response.json()
+                if trace:
+                    trace.add(stage, body.get("timing"))
+                return body
+            except httpx.HTTPError as e:
+                if attempt == retries or not retryable(e):
+                    raise
+                await asyncio.sleep(retry_delay(e, attempt))
+
+    async def create_session(self, trace=None):
+        """Open a server-side conversation so the LLM service keeps the history (and its KV cache)."""
+        return (await self.post_json("session", self.urls["chat"] + "/session", trace, json={}))["session_id"]
+
+    async def translate(self, text, trace=None):
+        payload = {"sentences": [text], "profile": TRANSLATE_PROFILE}
+        return (await self.post_json("translate", self.urls["translation"] + "/translate", trace, json=payload))["translations"][0]
+
+    async def transcribe(self, audio_path, trace=None):
+        data = await asyncio.to_thread(read_file, audio_path)
+        return await self.transcribe_bytes(os.path.basename(audio_path), data, trace)
+
+    async def transcribe_bytes(self, filename, data, trace=None):
+        files = {"audio": (filename, data)}
+        return (await self.post_json("transcribe", self.urls["transcription"] + "/transcribe", trace, files=files)).get("transcription", "")
+
+    async def stream_llm(self, payload, trace=None):
+        """Yield reply fragments from the streaming chat endpoint as they are decoded."""
+        retries = STAGE_RETRIES["llm"]
+        headers = self.headers("llm", trace)
+        for attempt in range(retries + 1):
+            started = False
+            try:
+                async with self.http.stream(
+                    "POST", self.urls["chat"] + "/chat/stream", json=payload, headers=headers, timeout=STAGE_TIMEOUTS["llm"]
+                ) as resp:
+                    resp.raise_for_status()
+                    async for line in resp.aiter_lines():
+                        if not line:
+                            continue
+                        event = json.loads(line)
+                        if "error" in event:
+                            raise RuntimeError(event["error"])
+                        if "token" in event:
+                            started = True
+                            yield event["token"]
+                        elif event.get("done") and trace:
+                            trace.add("llm", event.get("timing"))
+                return
+            except httpx.HTTPError as e:
+                if started or attempt == retries or not retryable(e):
+                    raise
+                await asyncio.sleep(retry_delay(e, attempt))
+
+    async def check(self, url):
+        """Status code of a health or readiness endpoint, and its JSON report when it sends one."""
+        response = await self.http.get(url, timeout=STAGE_TIMEOUTS["health"])
+        try:
+            report = response.json()
+        except ValueError:
+            report = None
+        return response.status_code, report
+
+
+def import_service(name, path):
+    """Import a service module from its file, once; the import starts loading its models."""
+    if name not in sys.modules:
+        sys.path.insert(0, os.path.dirname(path))
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+class InProcessServices(ServiceClient):
+    """
+    A ServiceClient whose chat and translation calls run the imported service
+    modules directly on worker threads. Their readiness stands in for /ready;
+    transcription still goes over HTTP.
+    """
+
+    def __init__(self, urls, priority="interactive"):
+        super().__init__(urls, priority)
+        self.chat = import_service("coverse", CHAT_MODULE)
+        self.translation = import_service("IndicTranslation", TRANSLATION_MODULE)
+        self.local = {
+            urls["chat"]: self.chat.readiness,
+            urls["translation"]: self.translation.readiness,
+        }
+
+    async def create_session(self, trace=None):
+        return self.chat.sessions.create()
+
+    async def translate(self, text, trace=None):
+        start, report = time.perf_counter(), {}
+        translations = await asyncio.to_thread(
+            self.translation.translator.translate, [text], profile=TRANSLATE_PROFILE, report=report
+        )
+        if trace:
+            trace.add("translate", dict(report, total_ms=round((time.perf_counter() - start) * 1000, 1)))
+        return translations[0]
+
+    async def stream_llm(self, payload, trace=None):
+        """Yield reply fragments straight from the chat scheduler."""
+        request_id = trace.request_id if trace else uuid.uuid4().hex
+        priority = self.chat.PRIORITY_CLASSES.get(self.priority, 0)
+        req = await asyncio.to_thread(self.chat.submit_chat, payload, request_id, priority)
+        loop, fragments = asyncio.get_running_loop(), asyncio.Queue()
+
+        def decode():
+            parts = []
+            try:
+                for text in self.chat.iter_text(req):
+                    parts.append(text)
+                    loop.call_soon_threadsafe(fragments.put_nowait, text)
+                if req.cancelled:
+                    return  # abandoned turn: don't cache or log the partial reply
+                self.chat.finish_turn(req, payload.get("input", ""), "".join(parts).strip())
+                loop.call_soon_threadsafe(fragments.put_nowait, None)
+            except Exception as e:
+                loop.call_soon_threadsafe(fragments.put_nowait, e)
+
+        threading.Thread(target=decode, daemon=True).start()
+        try:
+            while (item := await fragments.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            req.cancelled = True  # stops decoding if the turn was abandoned
+        if trace:
+            trace.add("llm", req.timing())
+
+    async def check(self, url):
+        readiness = self.local.get(url.rsplit("/", 1)[0])
+        if readiness is None:
+            return await super().check(url)
+        return (200 if readiness.ready else 503), readiness.report()
+
+
+def create_services(urls, in_process=False, priority="interactive"):
+    return InProcessServices(urls, priority) if in_process else ServiceClient(urls, priority)
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def run_turn(services, session_id, user_input, speak=True, echo=True, trace=None, on_event=None):
+    """
+    Run one conversation turn. Kannada input is translated first, since the
+    LLM needs it. The reply is then streamed, and each finished sentence goes
+    straight to TTS and to EN->KN translation, so speaking and back-translation
+    overlap with decoding and with each other. Raises StageError.
+    Returns {"input_en", "response_en", "response_kn", "timings", "request_id",
+    "spans"}: timings in ms, and the timing reports of the services per stage.
+    on_event, when given, is called with {"input_en": ...}, every reply
+    fragment as {"token": ...} and every Kannada sentence, in reply order, as
+    {"index": ..., "translation": ...} as soon as they are available.
+    """
+    trace = trace or Trace()
+    emit = on_event or (lambda event: None)
+    timings, turn_start = {}, time.perf_counter()
+
+    def lap(name, start):
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    if is_kannada(user_input):
+        start = time.perf_counter()
+        try:
+            user_input_en = await services.translate(user_input, trace)
+        except Exception as e:
+            raise StageError("Translation (KN->EN)", e)
+        lap("translate_in", start)
+        if echo:
+            print(f"[DEBUG] User input in English: {user_input_en}")
+    else:
+        user_input_en = user_input
+    emit({"input_en": user_input_en})
+
+    # === Call LLM (streamed) ===
+    speech = speech_worker() if speak else None
+    turn = speech.start_turn() if speech else None
+    buffer, parts, translations = "", [], []
+    flushed = 0
+
+    def flush_translations(_=None):
+        # A Kannada sentence goes out once it and every sentence before it are done
+        nonlocal flushed
+        while flushed < len(translations) and translations[flushed].done():
+            task = translations[flushed]
+            failed = task.cancelled() or task.exception() is not None
+            emit({"index": flushed, "translation": "[Translation failed]" if failed else task.result()})
+            flushed += 1
+
+    async def dispatch(sentence):
+        translations.append(asyncio.create_task(services.translate(sentence, trace)))
+        if on_event is not None:
+            translations[-1].add_done_callback(flush_translations)
+        if speech is not None:
+            # Off the event loop, since a full speech queue blocks
+            await asyncio.to_thread(speech.say, turn, sentence)
+
+    start = time.perf_counter()
+    try:
+        if echo:
+            print("🤖 LLM Output (English): ", end="", flush=True)
+        async for fragment in services.stream_llm({"input": user_input_en, "session_id": session_id}, trace):
+            if not parts:
+                lap("llm_first_token", start)
+            if echo:
+                print(fragment, end="", flush=True)
+            emit({"token": fragment})
+            parts.append(fragment)
+            sentences, buffer = split_sentences(buffer + fragment)
+            for sentence in sentences:
+                await dispatch(sentence)
+        if echo:
+            print()
+        if buffer.strip():
+            await dispatch(buffer.strip())
+    except Exception as e:
+        for task in translations:
+            task.cancel()
+        raise StageError("LLM API call", e)
+    lap("llm", start)
+
+    # Only the translations still running after the last token add to the turn
+    start = time.perf_counter()
+    output_parts_kn = []
+    for result in await asyncio.gather(*translations, return_exceptions=True):
+        if isinstance(result, Exception):
+            if echo:
+                print(f"[ERROR] Translation (EN->KN) failed: {result}")
+            output_parts_kn.append("[Translation failed]")
+        else:
+            output_parts_kn.append(result)
+    lap("translate_out_tail", start)
+    lap("total", turn_start)
+    for stage, ms in timings.items():
+        TURN_STAGE_SECONDS.labels(stage).observe(ms / 1000)
+    return {
+        "input_en": user_input_en,
+        "response_en": "".join(parts).strip(),
+        "response_kn": " ".join(output_parts_kn),
+        "timings": timings,
+        "request_id": trace.request_id,
+        "spans": trace.spans,
+    }
+
+
+async def startup(services, keep_waiting=True):
+    """
+    Check that the services are up, waiting while they load their models. With
+    keep_waiting, an unreachable or failed service is retried until it comes
+    up; without it, the process exits naming the service.
+    """
+    print("Checking required services...")
+    names = list(SERVICE_NAMES)
+    while names:
+        results = await asyncio.gather(
+            *(services.check(services.urls[SERVICE_NAMES[name]] + "/ready") for name in names),
+            return_exceptions=True,
+        )
+        waiting = []
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                problem, hint = f"is not reachable: {result}", f"that {name} is running and accessible"
+            else:
+                status, report = result
+                if status == 200:
+                    print(f"✅ {name} is up.")
+                    continue
+                if report and report.get("error"):
+                    problem, hint = f"failed to load its model: {report['error']}", f"the logs of {name}"
+                elif report and "progress" in report:
+                    print(f"⏳ {name} is loading ({report['progress']:.0%}).")
+                    waiting.append(name)
+                    continue
+                else:
+                    problem, hint = f"is not responding (status {status})", f"that {name} is running and accessible"
+            if not keep_waiting:
+                print(f"❌ {name} {problem}")
+                sys.exit(f"Please check {hint}.")
+            print(f"❌ {name} {problem}. Retrying...")
+            waiting.append(name)
+        names = waiting
+        if names:
+            await asyncio.sleep(READY_POLL_SECONDS)
+
+
+async def chat(services, audio_dir=None):
+    """
+    Interactive loop with mode selection every turn. Voice input asks for a
+    file name in audio_dir when one is given, else for a path.
+    """
+    print("\n🤖 Translator & LLM Agent is ready! Type 'exit' to quit.\n")
+    try:
+        session_id = await services.create_session()
+    except Exception as e:
+        print(f"[ERROR] Could not open an LLM session: {e}")
+        return
+    while True:
+        trace = Trace()
+        # Choose input mode
+        mode = ""
+        while mode not in ["1", "2", "exit", "quit"]:
+            print("\nChoose input mode:")
+            print("1. Text input")
+            print("2. Voice input (WAV/MP3 file)")
+            mode = (await asyncio.to_thread(input, "Enter 1 or 2 (or type 'exit' to quit): ")).strip().lower()
+        if mode in ["exit", "quit"]:
+            print("👋 Goodbye.")
+            break
+        if mode == "1":
+            user_input = (await asyncio.to_thread(input, "🧑 You (Kannada/English): ")).strip()
+            if user_input.lower() in ["exit", "quit"]:
+                print("👋 Goodbye.")
+                break
+        else:
+            if audio_dir:
+                print(f"Paste the audio file in the \"{os.path.basename(audio_dir)}\" folder.")
+                prompt = "🎤 Enter the file name (or 'exit' to quit): "
+            else:
+                prompt = "🎤 Enter path to WAV/MP3 file (or 'exit' to quit): "
+            audio_path = (await asyncio.to_thread(input, prompt)).strip()
+            if audio_path.lower() in ["exit", "quit"]:
+                print("👋 Goodbye.")
+                break
+            if audio_dir:
+                audio_path = os.path.join(audio_dir, audio_path)
+
+            print("[DEBUG] Transcribing audio...")
+            try:
+                user_input = await services.transcribe(audio_path, trace)
+                print(f"[DEBUG] Transcribed text: {user_input}")
+            except Exception as e:
+                print(f"[ERROR] Transcription failed: {e}")
+                continue
+
+        try:
+            result = await run_turn(services, session_id, user_input, trace=trace)
+        except StageError as e:
+            print(f"\n[ERROR] {e}")
+            continue
+        print(f"🤖 LLM Output (Kannada): {result['response_kn']}")
+        print(f"[DEBUG] Turn {result['request_id']} timings (ms): {result['timings']}")
+
+
+# === Headless modes ===
+async def open_session(services):
+    try:
+        return await services.create_session()
+    except Exception as e:
+        raise StageError("Opening an LLM session", e)
+
+
+async def pipeline_turn(services, session_id, user_input=None, audio=None, trace=None, on_event=None):
+    """
+    One turn without console or speaker: transcribe audio (a file path, or
+    (filename, bytes)) when given, then run_turn on the text, passing on_event.
+    Returns the run_turn result plus the turn's "input". Raises StageError.
+    """
+    trace = trace or Trace()
+    transcribe_ms = None
+    if audio is not None:
+        start = time.perf_counter()
+        try:
+            if isinstance(audio, str):
+                user_input = await services.transcribe(audio, trace)
+            else:
+                user_input = await services.transcribe_bytes(*audio, trace)
+        except Exception as e:
+            raise StageError("Transcription", e)
+        transcribe_ms = round((time.perf_counter() - start) * 1000, 1)
+        TURN_STAGE_SECONDS.labels("transcribe").observe(transcribe_ms / 1000)
+    result = await run_turn(services, session_id, user_input, speak=False, echo=False, trace=trace, on_event=on_event)
+    if transcribe_ms is not None:
+        result["timings"] = dict(transcribe=transcribe_ms, **result["timings"])
+    return dict(input=user_input, **result)
+
+
+async def run_batch(services, lines, out, concurrency):
+    """
+    Batch mode. Every JSONL line is one turn: {"conversation": id, "input":
+    text} or {"conversation": id, "audio": path}; a line without a
+    conversation id is a conversation of its own. Conversations run
+    concurrently, at most concurrency turns at a time, while the turns of one
+    conversation run in order in one LLM session. A JSON result line is
+    written to out as each turn finishes. Returns (turns, failed turns).
+    """
+    conversations = {}
+    counts = {"turns": 0, "failed": 0}
+
+    def write(record):
+        counts["turns"] += 1
+        counts["failed"] += "error" in record
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            turn = json.loads(line)
+        except json.JSONDecodeError as e:
+            write({"line": line_no, "error": f"Invalid JSON: {e}"})
+            continue
+        if not isinstance(turn, dict):
+            write({"line": line_no, "error": f"A turn must be a JSON object, got {type(turn).__name__}."})
+            continue
+        conversation = str(turn.get("conversation", f"line-{line_no}"))
+        conversations.setdefault(conversation, []).append((line_no, turn))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_conversation(conversation, turns):
+        session_id = None
+        for line_no, turn in turns:
+            record = {"line": line_no, "conversation": conversation}
+            if not turn.get("input") and not turn.get("audio"):
+                write(dict(record, error="Missing 'input' or 'audio'."))
+                continue
+            async with semaphore:
+                try:
+                    session_id = session_id or await open_session(services)
+                    record.update(await pipeline_turn(services, session_id, turn.get("input"), turn.get("audio")))
+                    record["session_id"] = session_id
+                except StageError as e:
+                    record.update(error=str(e), stage=e.stage)
+            write(record)
+
+    await asyncio.gather(*(run_conversation(c, turns) for c, turns in conversations.items()))
+    return counts["turns"], counts["failed"]
+
+
+async def batch_main(args, urls, keep_waiting=True):
+    """Run batch mode; results go to --output (stdout by default), everything else to stderr."""
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.input == "-":
+            lines = await asyncio.to_thread(sys.stdin.readlines)
+        else:
+            with open(args.input, encoding="utf-8") as f:
+                lines = f.readlines()
+        services = create_services(urls, args.in_process, priority="batch")
+        try:
+            await startup(services, keep_waiting)
+            start = time.perf_counter()
+            turns, failed = await run_batch(services, lines, out, args.concurrency)
+            print(f"[INFO] {turns} turns ({failed} failed) in {time.perf_counter() - start:.1f}s")
+        finally:
+            await services.close()
+            if out is not sys.stdout:
+                out.close()
+
+
+def serve(urls, host, port, in_process=False, keep_waiting=True):
+    """
+    HTTP gateway. POST /turn runs the whole pipeline for one turn: a JSON body
+    {"input": text, "session_id": optional}, or a multipart "audio" file with
+    an optional session_id form field. Without a session_id a new LLM session
+    is opened; its id is returned so the caller can continue the conversation.
+    POST /turn/stream takes the same body and streams the turn as NDJSON: the
+    run_turn events (English input, reply fragments, Kannada sentences), then
+    {"done": true, ...} with the /turn result, or {"error": ...}.
+    The pooled client lives on a background event loop shared by all requests.
+    An X-Request-ID header on the request becomes the turn's request id.
+    GET /metrics exposes the turn stage histograms.
+    """
+    async def check_services():
+        services = create_services(urls, in_process)
+        try:
+            await startup(services, keep_waiting)
+        finally:
+            await services.close()
+
+    asyncio.run(check_services())
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    async def create_client():
+        return create_services(urls, in_process)
+
+    services = asyncio.run_coroutine_threadsafe(create_client(), loop).result()
+    create_gateway(services, loop).run(host=host, port=port, threaded=True)
+
+
+def create_gateway(services, loop):
+    """The Flask app of serve mode, running its turns with services on the event loop of another thread."""
+    def call(coro):
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    app = Flask(__name__)
+
+    def read_turn():
+        """(input, audio, session_id) of a /turn request body; raises ValueError for a body that is not an object."""
+        audio = None
+        if "audio" in request.files:
+            audio_file = request.files["audio"]
+            audio = (audio_file.filename, audio_file.read())
+            data = request.form
+        else:
+            data = request.get_json(silent=True)
+            data = {} if data is None else data
+            if not isinstance(data, dict):
+                raise ValueError(f"The request body must be a JSON object, got {type(data).__name__}.")
+        return data.get("input"), audio, data.get("session_id")
+
+    @app.route("/turn", methods=["POST"])
+    @TURNS_IN_PROGRESS.track_inprogress()
+    def turn():
+        try:
+            user_input, audio, session_id = read_turn()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not user_input and audio is None:
+            return jsonify({"error": "Missing 'input' or 'audio'."}), 400
+        trace = Trace(request.headers.get(REQUEST_ID_HEADER))
+        try:
+            session_id = session_id or call(open_session(services))
+            result = call(pipeline_turn(services, session_id, user_input, audio, trace))
+        except StageError as e:
+            response = jsonify({"error": str(e), "stage": e.stage, "request_id": trace.request_id})
+            response.status_code = 502
+        else:
+            response = jsonify({"session_id": session_id, **result})
+        response.headers[REQUEST_ID_HEADER] = trace.request_id
+        return response
+
+    @app.route("/turn/stream", methods=["POST"])
+    def turn_stream():
+        try:
+            user_input, audio, session_id = read_turn()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not user_input and audio is None:
+            return jsonify({"error": "Missing 'input' or 'audio'."}), 400
+        trace = Trace(request.headers.get(REQUEST_ID_HEADER))
+        events = queue.Queue()
+
+        async def run():
+            with TURNS_IN_PROGRESS.track_inprogress():
+                try:
+                    sid = session_id or await open_session(services)
+                    result = await pipeline_turn(services, sid, user_input, audio, trace, on_event=events.put)
+                    events.put({"done": True, "session_id": sid, **result})
+                except StageError as e:
+                    events.put({"error": str(e), "stage": e.stage, "request_id": trace.request_id})
+                finally:
+                    events.put(None)
+
+        asyncio.run_coroutine_threadsafe(run(), loop)
+
+        def lines():
+            while (event := events.get()) is not None:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+
+        response = Response(lines(), mimetype="application/x-ndjson")
+        response.headers[REQUEST_ID_HEADER] = trace.request_id
+        return response
+
+    @app.route("/health", methods=["GET"])
+    def health():
+        return jsonify({"status": "ok"})
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+    return app
+
+
+def parse_args(port):
+    parser = argparse.ArgumentParser(description="Kannada/English voice and text assistant.")
+    parser.add_argument(
+        "--in-process", action="store_true", help="run the chat and translation models in this process"
+    )
+    modes = parser.add_subparsers(dest="mode")
+    batch = modes.add_parser("batch", help="process JSONL turns from a file or stdin")
+    batch.add_argument("input", nargs="?", default="-", help="JSONL file of turns, - for stdin")
+    batch.add_argument("--output", default="-", help="where to write JSONL results, - for stdout")
+    batch.add_argument("--concurrency", type=int, default=8, help="turns in flight at once")
+    gateway = modes.add_parser("serve", help="run the HTTP gateway with a /turn endpoint")
+    gateway.add_argument("--host", default="0.0.0.0")
+    gateway.add_argument("--port", type=int, default=port)
+    return parser.parse_args()
+
+
+async def chat_main(args, urls, keep_waiting=True, audio_dir=None):
+    services = create_services(urls, args.in_process)
+    try:
+        await startup(services, keep_waiting)
+        await chat(services, audio_dir)
+    finally:
+        await services.close()
+
+
+def main(urls, port, keep_waiting=True, audio_dir=None):
+    """
+    Command line of an orchestrator script: the interactive console, batch or
+    serve mode against the services at urls (see ServiceClient), with port as
+    the gateway's default port. keep_waiting and audio_dir are passed on to
+    startup and chat.
+    """
+    args = parse_args(port)
+    if args.mode == "batch":
+        asyncio.run(batch_main(args, urls, keep_waiting))
+    elif args.mode == "serve":
+        serve(urls, args.host, args.port, args.in_process, keep_waiting)
+    else:
+        asyncio.run(chat_main(args, urls, keep_waiting, audio_dir))
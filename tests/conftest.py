@@ -0,0 +1,61 @@
+"""
+Shared fixtures. The services live in their own folders and import torch and
+transformers at module level, so each one is imported from its file here and
+its tests are skipped where those packages are not installed. Models are never
+loaded: the background load fails fast offline and the tests swap in fakes.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("LOAD_IN_BACKGROUND", "1")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+
+def load_service(folder, name, requires=("torch", "transformers", "flask_cors", "prometheus_client")):
+    """Import a service module from its folder, or skip when its dependencies are missing."""
+    for package in requires:
+        pytest.importorskip(package)
+    if name not in sys.modules:
+        directory = os.path.join(ROOT, folder)
+        sys.path.insert(0, directory)
+        spec = importlib.util.spec_from_file_location(name, os.path.join(directory, name + ".py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+@pytest.fixture(scope="session")
+def chat():
+    return load_service("Coversational Agent --Docker", "coverse")
+
+
+@pytest.fixture(scope="session")
+def translation():
+    return load_service(
+        "IndicTranslation -- Docker", "IndicTranslation",
+        ("torch", "transformers", "flask_cors", "prometheus_client", "IndicTransToolkit"),
+    )
+
+
+@pytest.fixture(scope="session")
+def transcription():
+    return load_service(
+        "Transcription Agent --Docker", "transcribe",
+        ("torch", "torchaudio", "soundfile", "transformers", "flask_cors", "prometheus_client"),
+    )
+
+
+@pytest.fixture(scope="session")
+def orchestrator():
+    return load_service(".", "orchestrator_core", ("httpx", "pyttsx3", "flask", "prometheus_client"))
+
+
+@pytest.fixture(scope="session")
+def common():
+    return load_service("common", "service_common", ("flask",))
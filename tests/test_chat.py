@@ -0,0 +1,461 @@
+import types
+
+import pytest
+
+
+class FakeTokenizer:
+    """Whitespace tokenizer with the bits of the Qwen3 tokenizer the prompt code uses."""
+
+    eos_token_id = 0
+    pad_token_id = 0
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True, enable_thinking=False):
+        return " ".join(m["content"] for m in messages)
+
+    def __call__(self, text, add_special_tokens=True):
+        return {"input_ids": [len(word) for word in text.split()]}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join("w" * i for i in ids)
+
+
+class FakeScheduler:
+    def submit(self, req):
+        return req
+
+
+@pytest.fixture
+def fake_model(chat, monkeypatch):
+    monkeypatch.setattr(chat, "tokenizer", FakeTokenizer())
+    monkeypatch.setattr(chat, "scheduler", FakeScheduler())
+    monkeypatch.setattr(chat.readiness, "ready", True)
+    return chat
+
+
+def test_tokenize_ms_is_small_and_non_negative(fake_model):
+    history = [{"role": "user", "content": "hi there"}, {"role": "assistant", "content": "hello"}]
+    req = fake_model.submit_chat({"input": "how are you", "history": history}, "test")
+    tokenize_ms = req.timing()["tokenize_ms"]
+    assert 0 <= tokenize_ms < 1000
+
+
+
+def unit(*values):
+    import torch
+
+    return torch.nn.functional.normalize(torch.tensor(values, dtype=torch.float32), dim=0)
+
+
+@pytest.fixture
+def cache(chat, monkeypatch):
+    """A fresh response cache with the default settings; embeddings come from a lookup table."""
+    monkeypatch.setattr(chat, "response_cache", chat.ResponseCache(max_size=8, ttl=60))
+    vectors, embedded = {}, []
+
+    def embed_text(text):
+        embedded.append(text)
+        return vectors[text]
+
+    monkeypatch.setattr(chat, "embed_text", embed_text)
+    return chat.response_cache, vectors, embedded
+
+
+def remember(chat, user_input, reply_ids):
+    _, fields = chat.cached_reply({}, user_input, [], chat.GENERATION_DEFAULTS)
+    req = types.SimpleNamespace(cache_match=None, error=None, generated=reply_ids, **fields)
+    chat.remember_reply(req)
+
+
+def test_semantic_cache_is_off_by_default(chat, cache):
+    response_cache, vectors, embedded = cache
+    assert not response_cache.semantic
+    remember(chat, "what is the capital of france", [1, 2, 3])
+    # Mean-pooled vectors of unrelated prompts can be this close
+    vectors.update({"what is the capital of france": unit(1.0, 0.2), "write me a poem about rain": unit(1.0, 0.25)})
+    hit, _ = chat.cached_reply({}, "write me a poem about rain", [], chat.GENERATION_DEFAULTS)
+    assert hit is None
+    assert embedded == []
+
+
+def test_semantic_cache_default_threshold_rejects_unrelated_prompts(chat, cache, monkeypatch):
+    response_cache, vectors, embedded = cache
+    monkeypatch.setattr(response_cache, "match_similar", True)
+    vectors.update({
+        "what is the capital of france": unit(1.0, 0.0),
+        "write me a poem about rain": unit(1.0, 0.25),  # cosine 0.97
+        "what's the capital of france": unit(1.0, 0.05),  # cosine 0.999
+    })
+    hit, _ = chat.cached_reply({}, "what is the capital of france", [], chat.GENERATION_DEFAULTS)
+    assert hit is None and embedded == []  # nothing cached yet: no embedding needed
+    remember(chat, "what is the capital of france", [1, 2, 3])
+    assert embedded == ["what is the capital of france"]
+    assert chat.cached_reply({}, "write me a poem about rain", [], chat.GENERATION_DEFAULTS)[0] is None
+    hit, _ = chat.cached_reply({}, "what's the capital of france", [], chat.GENERATION_DEFAULTS)
+    assert hit is not None and hit.cache_match == "semantic"
+
+
+@pytest.mark.parametrize("field, value", [
+    ("do_sample", "false"),
+    ("do_sample", None),
+    ("temperature", None),
+    ("temperature", "hot"),
+    ("temperature", float("nan")),
+    ("temperature", 0),
+    ("top_p", 1.5),
+    ("max_new_tokens", 0),
+    ("max_new_tokens", 10 ** 9),
+    ("max_new_tokens", 12.5),
+    ("max_new_tokens", True),
+    ("max_prompt_tokens", -1),
+    ("summarize_history", "yes"),
+])
+def test_chat_rejects_invalid_options(fake_model, field, value):
+    response = fake_model.app.test_client().post("/chat", json={"input": "hi", field: value})
+    assert response.status_code == 400
+    assert field in response.json["error"]
+
+
+def test_generation_options_accept_valid_values(fake_model):
+    req = fake_model.submit_chat({"input": "hi", "do_sample": False, "temperature": 1, "max_new_tokens": 8}, "test")
+    assert (req.do_sample, req.temperature, req.max_new_tokens) == (False, 1.0, 8)
+
+
+# === Continuous batching ===
+# A tiny randomly initialized model at the stub size, driven through the real
+# BatchScheduler. Each scheduler's thread waits on its empty queue for good, so
+# the tests call _admit and _step themselves and decide when rows join.
+
+@pytest.fixture(scope="module")
+def tiny_model(chat):
+    """
+    The Qwen3 architecture (Qwen2, its cache-compatible parent, on older
+    transformers) with random weights, initialized wide enough that the
+    greedy reply depends on every position and not just the last token.
+    """
+    import torch
+    import transformers
+
+    config_class = getattr(transformers, "Qwen3Config", None) or transformers.Qwen2Config
+    config = config_class(vocab_size=96, max_position_embeddings=256, initializer_range=0.5, **chat.STUB_DIMS)
+    torch.manual_seed(0)
+    return transformers.AutoModelForCausalLM.from_config(config, attn_implementation="eager").eval()
+
+
+@pytest.fixture
+def batching(chat, monkeypatch):
+    monkeypatch.setattr(chat, "PAD_TOKEN_ID", 0)
+    monkeypatch.setattr(chat, "EOS_TOKEN_IDS", set())  # every reply runs to max_new_tokens
+    return chat
+
+
+def greedy(chat, input_ids, max_new_tokens, **options):
+    return chat.ChatRequest(list(input_ids), **{
+        **chat.GENERATION_DEFAULTS, "max_new_tokens": max_new_tokens, "do_sample": False, "draft_tokens": 0,
+        **options,
+    })
+
+
+def run_to_completion(scheduler, reqs):
+    import torch
+
+    with torch.no_grad():
+        scheduler._admit(reqs)
+        while scheduler.rows:
+            scheduler._step()
+    return [req.generated for req in reqs]
+
+
+def generate_alone(chat, model, input_ids, max_new_tokens, **options):
+    scheduler = chat.BatchScheduler(model, chat.SessionStore())
+    return run_to_completion(scheduler, [greedy(chat, input_ids, max_new_tokens, **options)])[0]
+
+
+PROMPTS = [
+    ([5, 9, 14, 3, 22, 7], 12),
+    ([31, 8], 2),
+    ([12, 40, 41, 17, 9, 60, 2, 33, 19, 4], 10),
+    ([50, 51, 52], 6),
+]
+
+
+class Recorder:
+    """Passes calls on to the model, keeping their arguments."""
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = []
+
+    def __call__(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.model(**kwargs)
+
+
+def test_greedy_reply_is_the_same_alone_and_in_a_changing_batch(batching, tiny_model):
+    import torch
+
+    chat = batching
+    alone = [generate_alone(chat, tiny_model, ids, n) for ids, n in PROMPTS]
+    scheduler = chat.BatchScheduler(tiny_model, chat.SessionStore())
+    a, b, c, d = [greedy(chat, ids, n) for ids, n in PROMPTS]
+    with torch.no_grad():
+        scheduler._admit([a])
+        for _ in range(3):
+            scheduler._step()
+        # b's prompt is shorter than the running cache and c's longer, so both sides get left-padded
+        scheduler._admit([b, c])
+        while not b.done:
+            scheduler._step()
+        assert scheduler.rows == [a, c]
+        scheduler._admit([d])
+        while scheduler.rows:
+            scheduler._step()
+    assert [req.generated for req in (a, b, c, d)] == alone
+
+
+def test_prefill_left_pads_and_positions_every_row_from_zero(batching, tiny_model):
+    import torch
+
+    model = Recorder(tiny_model)
+    scheduler = batching.BatchScheduler(model, batching.SessionStore())
+    with torch.no_grad():
+        scheduler._admit([greedy(batching, [5, 6, 7], 4), greedy(batching, [8, 9, 10, 11, 12], 4)])
+        scheduler._step()
+    prefill, step = model.calls
+    assert prefill["input_ids"].tolist() == [[0, 0, 5, 6, 7], [8, 9, 10, 11, 12]]
+    assert prefill["attention_mask"].tolist() == [[0, 0, 1, 1, 1], [1, 1, 1, 1, 1]]
+    assert prefill["position_ids"].tolist() == [[0, 0, 0, 1, 2], [0, 1, 2, 3, 4]]
+    assert step["attention_mask"].tolist() == [[0, 0, 1, 1, 1, 1], [1, 1, 1, 1, 1, 1]]
+    assert step["position_ids"].tolist() == [[3], [5]]
+
+
+def legacy_cache(chat, *rows):
+    """A one-layer DynamicCache whose keys and values hold the given numbers, one batch row each."""
+    import torch
+
+    key = torch.tensor(rows, dtype=torch.float32)[:, None, :, None]
+    return chat.DynamicCache.from_legacy_cache(((key, -key),))
+
+
+def cached_keys(cache):
+    key, value = cache.to_legacy_cache()[0]
+    assert value.tolist() == (-key).tolist()
+    return key[:, 0, :, 0].tolist()
+
+
+def test_merge_batches_left_pads_the_shorter_batch(chat):
+    import torch
+
+    cache, mask = chat.merge_batches(
+        legacy_cache(chat, [1, 2, 3]), torch.ones((1, 3), dtype=torch.long),
+        legacy_cache(chat, [0, 11, 12, 13, 14]), torch.tensor([[0, 1, 1, 1, 1]]),
+    )
+    assert mask.tolist() == [[0, 0, 1, 1, 1], [0, 1, 1, 1, 1]]
+    assert cached_keys(cache) == [[0, 0, 1, 2, 3], [0, 11, 12, 13, 14]]
+
+
+def test_select_rows_drops_columns_that_are_padding_in_every_kept_row(chat):
+    import torch
+
+    cache = legacy_cache(chat, [0, 0, 1, 2, 3], [0, 11, 12, 13, 14], [21, 22, 23, 24, 25])
+    mask = torch.tensor([[0, 0, 1, 1, 1], [0, 1, 1, 1, 1], [1, 1, 1, 1, 1]])
+    kept, kept_mask = chat.select_rows(cache, mask, torch.tensor([0, 1]))
+    assert kept_mask.tolist() == [[0, 1, 1, 1], [1, 1, 1, 1]]
+    assert cached_keys(kept) == [[0, 1, 2, 3], [11, 12, 13, 14]]
+    kept, kept_mask = chat.select_rows(cache, mask, torch.tensor([0]))
+    assert kept_mask.tolist() == [[1, 1, 1]]
+    assert cached_keys(kept) == [[1, 2, 3]]
+
+
+def test_requests_past_their_deadline_are_dropped_before_prefill(batching, tiny_model):
+    import time
+
+    scheduler = batching.BatchScheduler(tiny_model, batching.SessionStore())
+    late = scheduler.submit(greedy(batching, [5, 6, 7], 4, deadline=time.monotonic() - 1))
+    live = scheduler.submit(greedy(batching, [5, 6, 7], 4, deadline=time.monotonic() + 60))
+    with pytest.raises(RuntimeError, match="deadline"):
+        list(late)
+    assert late.expired and late.admitted_at is None
+    assert len(list(live)) == 4 and not live.expired
+
+
+# === Speculative decoding ===
+
+REPETITIVE = [5, 9, 14, 3, 5, 9, 14, 3, 5, 9, 14]  # prompt lookup always finds a draft
+
+
+def scripted_drafts(replies, wrong=()):
+    """
+    propose_drafts stand-in that drafts the next tokens of each prompt's known
+    reply, or, for the prompts in wrong, a single token that is never the
+    right one.
+    """
+    def propose(req):
+        limit = min(req.draft_tokens, req.max_new_tokens - len(req.generated) - 1)
+        if limit <= 0:
+            return []
+        reply = replies[tuple(req.input_ids)]
+        if tuple(req.input_ids) in wrong:
+            return [(reply[len(req.generated)] + 1) % 96]
+        return reply[len(req.generated):len(req.generated) + limit]
+
+    return propose
+
+
+def test_greedy_reply_is_the_same_with_prompt_lookup_drafting(batching, tiny_model):
+    chat = batching
+    prompts = [(REPETITIVE, 12), ([12, 40, 41, 17, 9, 60], 8), (REPETITIVE[2:], 10)]
+    plain = [generate_alone(chat, tiny_model, ids, n) for ids, n in prompts]
+    assert generate_alone(chat, tiny_model, REPETITIVE, 12, draft_tokens=4) == plain[0]
+    # Rows drafting different amounts (one not at all) share each verification pass
+    reqs = [greedy(chat, ids, n, draft_tokens=draft) for (ids, n), draft in zip(prompts, (4, 0, 2))]
+    scheduler = chat.BatchScheduler(tiny_model, chat.SessionStore())
+    assert run_to_completion(scheduler, reqs) == plain
+    assert reqs[0].drafted_tokens > 0 and reqs[2].drafted_tokens > 0 and reqs[1].drafted_tokens == 0
+
+
+def test_accepted_drafts_emit_several_tokens_per_step(batching, tiny_model, monkeypatch):
+    import torch
+
+    chat = batching
+    reply = generate_alone(chat, tiny_model, REPETITIVE, 12)
+    monkeypatch.setattr(chat, "propose_drafts", scripted_drafts({tuple(REPETITIVE): reply}))
+    req = greedy(chat, REPETITIVE, 12, draft_tokens=3)
+    scheduler = chat.BatchScheduler(tiny_model, chat.SessionStore())
+    steps = 0
+    with torch.no_grad():
+        scheduler._admit([req])
+        while scheduler.rows:
+            scheduler._step()
+            steps += 1
+    assert req.generated == reply
+    assert req.accepted_tokens == req.drafted_tokens > 0
+    assert steps < len(reply) - 1
+
+
+def test_a_fully_rejected_draft_still_advances_one_token(batching, tiny_model, monkeypatch):
+    import torch
+
+    chat = batching
+    replies = {tuple(REPETITIVE): generate_alone(chat, tiny_model, REPETITIVE, 8)}
+    monkeypatch.setattr(chat, "propose_drafts", scripted_drafts(replies, wrong=replies))
+    req = greedy(chat, REPETITIVE, 8, draft_tokens=3)
+    scheduler = chat.BatchScheduler(tiny_model, chat.SessionStore())
+    with torch.no_grad():
+        scheduler._admit([req])
+        while scheduler.rows:
+            before = len(req.generated)
+            scheduler._step()
+            assert len(req.generated) == before + 1
+    assert req.generated == replies[tuple(REPETITIVE)]
+    assert req.drafted_tokens == 6 and req.accepted_tokens == 0
+
+
+def test_verify_drafts_keeps_the_matching_prefix_and_the_next_greedy_token(chat):
+    import torch
+
+    reqs = [greedy(chat, [1], 8, repetition_penalty=1.0) for _ in range(3)]
+    logits = torch.zeros((3, 3, 10))
+    for row, argmax in enumerate([(7, 2, 9), (7, 2, 9), (4, 0, 0)]):
+        logits[row, range(3), list(argmax)] = 1.0
+    seen = torch.zeros((3, 10), dtype=torch.bool)
+    emitted = chat.verify_drafts(logits, reqs, seen, [[7, 2], [3, 4], []])
+    assert emitted == [[7, 2, 9], [7], [4]]
+
+
+# === Sessions ===
+
+def test_session_cache_prefix_gives_the_same_logits_as_a_fresh_prefill(batching, tiny_model, monkeypatch):
+    import torch
+
+    chat = batching
+    prompt, other = [5, 9, 14, 3, 22, 7], [12, 40, 41, 17, 9, 60, 2, 33, 19, 4]
+    replies = {tuple(ids): generate_alone(chat, tiny_model, ids, 8) for ids in (prompt, other)}
+    # A longer neighbour pads the session row on the left, and as the neighbour's
+    # drafts are accepted, the session row's rejected ones leave masked columns behind
+    monkeypatch.setattr(chat, "propose_drafts", scripted_drafts(replies, wrong=[tuple(prompt)]))
+    sessions = chat.SessionStore()
+    session_id = sessions.create()
+    scheduler = chat.BatchScheduler(tiny_model, sessions)
+    turn = greedy(chat, prompt, 8, draft_tokens=2, session_id=session_id)
+    run_to_completion(scheduler, [turn, greedy(chat, other, 8, draft_tokens=2)])
+    assert turn.generated == replies[tuple(prompt)]
+
+    next_prompt = prompt + turn.generated + [30, 31, 32]
+    prefix = sessions.checkout(session_id, next_prompt)
+    assert prefix is not None and prefix[1] == len(prompt) + len(turn.generated) - 1
+    with torch.no_grad():
+        _, _, resumed = scheduler._prefill([greedy(chat, next_prompt, 1, prefix=prefix)])
+        _, _, fresh = scheduler._prefill([greedy(chat, next_prompt, 1)])
+    torch.testing.assert_close(resumed, fresh, rtol=1e-4, atol=1e-4)
+
+
+def cache_layers(length):
+    import torch
+
+    return ((torch.zeros((1, 1, length, 1)), torch.zeros((1, 1, length, 1))),)
+
+
+def test_trimming_the_history_invalidates_the_cached_prefix(fake_model, monkeypatch):
+    chat = fake_model
+    monkeypatch.setattr(chat, "sessions", chat.SessionStore())
+    history = [
+        {"role": "user", "content": "tell me a story"},
+        {"role": "assistant", "content": "once upon a time"},
+        {"role": "user", "content": "whatever happened next"},
+        {"role": "assistant", "content": "everybody lived happily"},
+    ]
+    session_id = chat.sessions.create(history)
+    cached_ids = chat.encode_prompt("and then", history)
+    chat.sessions.store(session_id, cached_ids, cache_layers(len(cached_ids)))
+
+    req = chat.submit_chat({"input": "and then", "session_id": session_id}, "test")
+    assert req.budget["dropped_turns"] == 0 and req.cached_tokens == len(cached_ids) - 1
+
+    chat.sessions.store(session_id, cached_ids, cache_layers(len(cached_ids)))
+    req = chat.submit_chat({"input": "and then", "session_id": session_id, "max_prompt_tokens": 30}, "test")
+    assert req.budget["dropped_turns"] == 2
+    assert req.prefix is None and req.cached_tokens == 0
+    assert chat.sessions.stats()["cached_sessions"] == 0
+
+
+@pytest.mark.parametrize("history", ["hello", {"role": "user"}, ["hello"], 3])
+def test_create_session_rejects_a_history_that_is_not_a_list_of_messages(fake_model, history):
+    response = fake_model.app.test_client().post("/session", json={"history": history})
+    assert response.status_code == 400
+    assert "history" in response.json["error"]
+
+
+def test_scheduler_call_runs_between_decode_steps_on_the_scheduler_thread(batching, tiny_model):
+    import threading
+    import time
+
+    chat = batching
+    reply = generate_alone(chat, tiny_model, PROMPTS[0][0], 40)
+    scheduler = chat.BatchScheduler(tiny_model, chat.SessionStore())
+    assert scheduler.call(threading.current_thread) is scheduler._thread  # wakes an idle scheduler
+    req = scheduler.submit(greedy(chat, PROMPTS[0][0], 40))
+    while not req.generated:
+        time.sleep(0.001)
+    assert scheduler.call(threading.current_thread) is scheduler._thread
+    assert list(req) == reply
+    with pytest.raises(ZeroDivisionError):
+        scheduler.call(lambda: 1 / 0)
+    assert len(list(scheduler.submit(greedy(chat, [5, 6], 3)))) == 3
+
+
+def test_embed_text_runs_the_model_on_the_scheduler_thread(batching, tiny_model, monkeypatch):
+    import threading
+
+    chat = batching
+    scheduler = chat.BatchScheduler(tiny_model, chat.SessionStore())
+    threads = []
+    hook = tiny_model.model.register_forward_hook(lambda *_: threads.append(threading.current_thread()))
+    monkeypatch.setattr(chat, "scheduler", scheduler)
+    monkeypatch.setattr(chat, "model", tiny_model)
+    monkeypatch.setattr(chat, "tokenizer", FakeTokenizer())
+    try:
+        vector = chat.embed_text("what is the capital of france")
+    finally:
+        hook.remove()
+    assert threads == [scheduler._thread]
+    assert float(vector.norm()) == pytest.approx(1.0)
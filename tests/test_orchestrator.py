@@ -0,0 +1,119 @@
+import asyncio
+import time
+import types
+
+import pytest
+
+URLS = {"chat": "http://chat", "translation": "http://translation", "transcription": "http://transcription"}
+
+
+class FakeRequest:
+    def __init__(self):
+        self.cancelled = False
+
+    def timing(self):
+        return {}
+
+
+def fake_chat_module(fragments):
+    chat = types.SimpleNamespace(PRIORITY_CLASSES={"interactive": 0}, readiness=None, finished=[])
+
+    def iter_text(req):
+        for text in fragments:
+            if req.cancelled:
+                return
+            time.sleep(0.01)
+            yield text
+
+    chat.submit_chat = lambda payload, request_id, priority: FakeRequest()
+    chat.iter_text = iter_text
+    chat.finish_turn = lambda req, user_input, output_text: chat.finished.append(output_text)
+    return chat
+
+
+@pytest.fixture
+def in_process(orchestrator, monkeypatch):
+    chat = fake_chat_module(["one ", "two ", "three"] * 10)
+    modules = {"coverse": chat, "IndicTranslation": types.SimpleNamespace(readiness=None)}
+    monkeypatch.setattr(orchestrator, "import_service", lambda name, path: modules[name])
+    return orchestrator.InProcessServices(URLS), chat
+
+
+def test_stream_llm_books_a_finished_turn(in_process):
+    services, chat = in_process
+
+    async def consume():
+        return "".join([text async for text in services.stream_llm({"input": "hi"})])
+
+    reply = asyncio.run(consume())
+    assert chat.finished == [reply.strip()]
+
+
+def test_stream_llm_does_not_book_an_abandoned_turn(in_process):
+    services, chat = in_process
+
+    async def abandon():
+        stream = services.stream_llm({"input": "hi"})
+        async for _ in stream:
+            break
+        await stream.aclose()
+        await asyncio.sleep(0.2)  # let the decode thread notice
+
+    asyncio.run(abandon())
+    assert chat.finished == []
+
+
+class FakeServices:
+    """Services whose sessions and turns are made up, so turns run without any model."""
+
+    def __init__(self):
+        self.sessions = 0
+
+    async def create_session(self, trace=None):
+        self.sessions += 1
+        return f"s{self.sessions}"
+
+    async def translate(self, text, trace=None):
+        return text.upper()
+
+    async def stream_llm(self, payload, trace=None):
+        for fragment in ("Hello. ", "Bye."):
+            yield fragment
+
+
+def test_run_batch_records_an_error_for_a_turn_that_is_not_an_object(orchestrator):
+    import io
+    import json
+
+    lines = ['[1, 2]\n', '"hello"\n', '\n', '{"input": "hi"}\n', '{not json\n']
+    out = io.StringIO()
+    turns, failed = asyncio.run(orchestrator.run_batch(FakeServices(), lines, out, concurrency=2))
+    records = {record["line"]: record for record in map(json.loads, out.getvalue().splitlines())}
+    assert (turns, failed) == (4, 3)
+    assert "list" in records[1]["error"] and "str" in records[2]["error"]
+    assert "Invalid JSON" in records[5]["error"]
+    assert records[4]["response_en"] == "Hello. Bye." and records[4]["response_kn"] == "HELLO. BYE."
+
+
+@pytest.fixture
+def gateway(orchestrator):
+    import threading
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    yield orchestrator.create_gateway(FakeServices(), loop).test_client()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+@pytest.mark.parametrize("path", ["/turn", "/turn/stream"])
+@pytest.mark.parametrize("body", [[1, 2], "hello", 3])
+def test_gateway_rejects_a_body_that_is_not_an_object(gateway, path, body):
+    response = gateway.post(path, json=body)
+    assert response.status_code == 400
+    assert "JSON object" in response.json["error"]
+
+
+def test_gateway_runs_a_text_turn(gateway):
+    response = gateway.post("/turn", json={"input": "hi"})
+    assert response.status_code == 200
+    assert response.json["session_id"] == "s1" and response.json["response_kn"] == "HELLO. BYE."
@@ -0,0 +1,147 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, g
+
+
+class FakeCounter:
+    def __init__(self):
+        self.counts = {}
+
+    def labels(self, status):
+        counter = self
+
+        class Child:
+            def inc(self):
+                counter.counts[status] = counter.counts.get(status, 0) + 1
+
+        return Child()
+
+
+def wait_in_thread(admission, priority, order, deadline=None):
+    def target():
+        order.append((priority, admission.acquire(priority, deadline)))
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    while admission.stats()["queued"] < 1 and thread.is_alive():
+        time.sleep(0.001)
+    return thread
+
+
+def test_admission_limits_in_flight_and_queue(common):
+    admission = common.Admission(max_in_flight=1, max_queued=1)
+    assert admission.acquire(0) is None
+    order = []
+    waiter = wait_in_thread(admission, 0, order)
+    assert admission.acquire(0) == 429
+    admission.release()
+    waiter.join(1)
+    assert order == [(0, None)]
+    assert admission.stats() == {"in_flight": 1, "queued": 0}
+    admission.release()
+    assert admission.stats() == {"in_flight": 0, "queued": 0}
+
+
+def test_admission_serves_interactive_before_batch(common):
+    admission = common.Admission(max_in_flight=1, max_queued=2)
+    admission.acquire(0)
+    order = []
+    batch = wait_in_thread(admission, 1, order)
+    interactive = threading.Thread(target=lambda: order.append((0, admission.acquire(0))))
+    interactive.start()
+    while admission.stats()["queued"] < 2:
+        time.sleep(0.001)
+    admission.release()
+    interactive.join(1)
+    admission.release()
+    batch.join(1)
+    assert order == [(0, None), (1, None)]
+
+
+def test_admission_drops_requests_past_their_deadline(common):
+    admission = common.Admission(max_in_flight=1, max_queued=1)
+    assert admission.acquire(0, deadline=time.monotonic() - 1) == 504
+    admission.acquire(0)
+    assert admission.acquire(0, deadline=time.monotonic() + 0.05) == 504
+    assert admission.stats() == {"in_flight": 1, "queued": 0}
+
+
+def test_readiness_reports_progress_and_errors(common):
+    readiness = common.Readiness(["model", "warm-up"])
+    readiness.track("model", lambda: None)
+    assert readiness.report()["progress"] == 0.5
+    readiness.run(lambda: None, background=False)
+    assert readiness.ready
+
+    def fail():
+        raise RuntimeError("no weights")
+
+    failed = common.Readiness(["model"])
+    with pytest.raises(RuntimeError):
+        failed.run(fail, background=False)
+    assert not failed.ready and failed.report()["error"] == "no weights"
+
+
+@pytest.fixture
+def admitted_app(common):
+    app = Flask(__name__)
+    admission = common.Admission(max_in_flight=1, max_queued=0)
+    refused = FakeCounter()
+
+    @app.route("/work")
+    def work():
+        return {"priority": g.priority, "in_flight": admission.stats()["in_flight"]}
+
+    @app.route("/health")
+    def health():
+        return "ok"
+
+    common.install_admission(app, admission, ("work",), refused, 3)
+    return app, admission, refused
+
+
+def test_install_admission_admits_and_releases(admitted_app):
+    app, admission, refused = admitted_app
+    response = app.test_client().get("/work", headers={"X-Priority": "batch"})
+    assert response.json == {"priority": 1, "in_flight": 1}
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_install_admission_refuses_with_retry_after(admitted_app):
+    app, admission, refused = admitted_app
+    admission.acquire(0)
+    client = app.test_client()
+    response = client.get("/work")
+    assert response.status_code == 429 and response.headers["Retry-After"] == "3"
+    assert client.get("/health").status_code == 200  # other endpoints are not held
+    assert client.get("/work", headers={"X-Request-Timeout": "-1"}).status_code == 504
+    assert refused.counts == {"429": 1, "504": 1}
+
+
+def test_readiness_marks_a_failed_step(common):
+    readiness = common.Readiness(["model", "warm-up"])
+    with pytest.raises(RuntimeError):
+        readiness.track("model", lambda: (_ for _ in ()).throw(RuntimeError("no weights")))
+    assert readiness.report()["steps"] == {"model": "failed", "warm-up": "pending"}
+
+
+@pytest.mark.parametrize("value", ["inf", "-inf", "nan", "1e400"])
+def test_request_deadline_ignores_non_finite_timeouts(common, value):
+    with Flask(__name__).test_request_context(headers={"X-Request-Timeout": value}):
+        assert common.request_deadline() is None
+
+
+def test_request_deadline_caps_long_timeouts(common):
+    with Flask(__name__).test_request_context(headers={"X-Request-Timeout": "1e12"}):
+        deadline = common.request_deadline()
+    assert deadline <= time.monotonic() + common.MAX_REQUEST_TIMEOUT
+    with Flask(__name__).test_request_context(headers={"X-Request-Timeout": "2.5"}):
+        assert common.request_deadline() == pytest.approx(time.monotonic() + 2.5, abs=0.5)
+
+
+def test_install_admission_survives_an_infinite_timeout(admitted_app):
+    app, admission, refused = admitted_app
+    response = app.test_client().get("/work", headers={"X-Request-Timeout": "inf"})
+    assert response.status_code == 200 and refused.counts == {}
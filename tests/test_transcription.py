@@ -0,0 +1,244 @@
+import io
+import struct
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def client(transcription, monkeypatch):
+    monkeypatch.setattr(transcription.readiness, "ready", True)
+    received = []
+
+    def transcribe_audio(audio, timer=None, vad=None):
+        received.append(audio)
+        return "ok"
+
+    monkeypatch.setattr(transcription, "transcribe_audio", transcribe_audio)
+    return transcription.app.test_client(), received
+
+
+def post_pcm(client, query, samples=np.zeros(1600, dtype="<i2")):
+    return client.post("/transcribe" + query, data=samples.tobytes(), content_type="audio/pcm")
+
+
+@pytest.mark.parametrize("query", [
+    "?rate=0", "?rate=-16000", "?rate=100000000", "?rate=fast", "?channels=0", "?channels=-1", "?channels=100000",
+])
+def test_pcm_upload_rejects_bad_parameters(client, query):
+    client, received = client
+    response = post_pcm(client, query)
+    assert response.status_code == 400
+    assert "PCM" in response.json["error"]
+    assert received == []
+
+
+def test_pcm_upload_reads_frames(client):
+    client, received = client
+    response = post_pcm(client, "?rate=8000&channels=2")
+    assert response.status_code == 200
+    samples, rate = received[0]
+    assert rate == 8000 and samples.shape == (800, 2)
+
+
+def wav_bytes(rate, channels, frames=1600):
+    """A 16-bit PCM WAV file; the header is written by hand so it can carry any rate and channel count."""
+    data = np.zeros(frames * channels, dtype="<i2").tobytes()
+    fmt = struct.pack("<HHIIHH", 1, channels, rate, rate * channels * 2, channels * 2, 16)
+    chunks = b"fmt " + struct.pack("<I", len(fmt)) + fmt + b"data" + struct.pack("<I", len(data)) + data
+    return b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WAVE" + chunks
+
+
+@pytest.mark.parametrize("rate, channels", [(0, 1), (100, 1), (10 ** 9, 1), (16000, 0), (16000, 1000)])
+def test_wav_upload_rejects_a_bad_header(client, rate, channels):
+    client, received = client
+    for response in (
+        client.post("/transcribe", data=wav_bytes(rate, channels), content_type="audio/wav"),
+        client.post("/transcribe", data={"audio": (io.BytesIO(wav_bytes(rate, channels)), "a.wav")}),
+    ):
+        assert response.status_code == 400
+        assert "WAV" in response.json["error"]
+    assert received == []
+
+
+def test_wav_upload_is_read_in_place(client):
+    client, received = client
+    response = client.post("/transcribe", data=wav_bytes(8000, 2), content_type="audio/wav")
+    assert response.status_code == 200
+    samples, rate = received[0]
+    assert rate == 8000 and samples.shape == (1600, 2)
+
+
+def silence(seconds, rate=16000):
+    return np.zeros((int(seconds * rate), 1), dtype="<i2"), rate
+
+
+@pytest.fixture
+def fake_generate(transcription, monkeypatch):
+    calls = []
+
+    def generate_windows(windows, timer=None):
+        calls.append(len(windows))
+        return [{"text": f"w{len(calls)}-{i}", "offsets": []} for i in range(len(windows))]
+
+    monkeypatch.setattr(transcription, "generate_windows", generate_windows)
+    return calls
+
+
+def test_iter_transcription_batches_windows(transcription, fake_generate, monkeypatch):
+    monkeypatch.setattr(transcription, "BATCH_SIZE", 2)
+    parts = list(transcription.iter_transcription(silence(70), vad=False))
+    assert fake_generate == [2, 1]
+    assert [part["text"] for part in parts] == ["w1-0", "w1-1", "w2-0"]
+    assert [part["start"] for part in parts] == [0.0, 27.5, 52.5]
+
+
+def test_iter_transcription_uses_the_configured_batch_size(transcription, fake_generate):
+    batch = transcription.BATCH_SIZE
+    assert isinstance(batch, int)
+    parts = list(transcription.iter_transcription(silence(25 * batch + 30), vad=False))
+    assert fake_generate == [batch, 1]
+    assert len(parts) == batch + 1
+
+
+def post_batch(client, batch_size, files=2):
+    data = {"audio": [(io.BytesIO(wav_bytes(16000, 1, 16000)), f"{i}.wav") for i in range(files)]}
+    if batch_size is not None:
+        data["batch_size"] = batch_size
+    return client.post("/transcribe/batch", data=data)
+
+
+@pytest.mark.parametrize("batch_size", ["two", "2.5", "", "0", "-1", "1000000"])
+def test_batch_rejects_a_bad_batch_size(client, fake_generate, batch_size):
+    client, _ = client
+    response = post_batch(client, batch_size)
+    assert response.status_code == 400
+    assert "batch_size" in response.json["error"]
+    assert fake_generate == []
+
+
+def test_batch_runs_windows_batch_size_at_a_time(client, fake_generate):
+    client, _ = client
+    response = post_batch(client, "2", files=3)
+    assert response.status_code == 200
+    assert [r["file"] for r in response.json["results"]] == ["0.wav", "1.wav", "2.wav"]
+    assert fake_generate == [2, 1]
+
+
+# === Windows and VAD ===
+# Synthetic mono float audio at 16 kHz, so nothing is resampled: a 220 Hz tone
+# is speech to the VAD and zeros are silence.
+RATE = 16000
+
+
+def tone(seconds):
+    return (0.3 * np.sin(2 * np.pi * 220 * np.arange(int(seconds * RATE)) / RATE)).astype(np.float32)
+
+
+def quiet(seconds):
+    return np.zeros(int(seconds * RATE), dtype=np.float32)
+
+
+def blocks_of(audio, size):
+    return iter([audio[i:i + size] for i in range(0, len(audio), size)])
+
+
+def test_slide_windows_overlap_and_drop_a_tail_inside_the_overlap(transcription):
+    windows = list(transcription.slide_windows(blocks_of(tone(70), RATE), RATE, 0.0, transcription.StageTimer()))
+    assert [(w[0], len(w[1]) / RATE, w[2], w[3], w[4]) for w in windows] == [
+        (0.0, 30.0, False, True, None), (25.0, 30.0, True, True, None), (50.0, 20.0, True, False, None),
+    ]
+    # The last 5 s were already heard at the end of the second window
+    windows = list(transcription.slide_windows(blocks_of(tone(55), RATE), RATE, 0.0, transcription.StageTimer()))
+    assert [(w[0], w[2], w[3]) for w in windows] == [(0.0, False, True), (25.0, True, False)]
+    windows = list(transcription.slide_windows(blocks_of(tone(4), 1000), RATE, 3.0, transcription.StageTimer()))
+    assert [(w[0], len(w[1]), w[2], w[3]) for w in windows] == [(3.0, 4 * RATE, False, False)]
+
+
+SPEECH = np.concatenate([quiet(1.5), tone(2), quiet(0.5), tone(1), quiet(2), tone(3), quiet(1)])
+
+
+@pytest.mark.parametrize("block_size", [1000, 4801, RATE, len(SPEECH)])
+def test_iter_speech_finds_the_speech_whatever_the_block_size(transcription, block_size):
+    segments = list(transcription.iter_speech(blocks_of(SPEECH, block_size), RATE, transcription.StageTimer()))
+    # A 0.5 s pause stays inside the first segment; each is padded by VAD_PAD_SECONDS (whole 30 ms frames)
+    assert [(round(start, 2), round(len(samples) / RATE, 2), continues) for start, samples, continues in segments] == [
+        (1.29, 3.93, False), (6.78, 3.45, False),
+    ]
+
+
+def test_iter_speech_cuts_long_speech_into_overlapping_pieces(transcription):
+    audio = np.concatenate([quiet(2), tone(70), quiet(2)])
+    segments = list(transcription.iter_speech(blocks_of(audio, 4 * RATE), RATE, transcription.StageTimer()))
+    assert [continues for _, _, continues in segments] == [False, True, True]
+    assert all(len(samples) <= 30 * RATE for _, samples, _ in segments)
+    for (start, samples, _), (next_start, _, _) in zip(segments, segments[1:]):
+        assert start + len(samples) / RATE - next_start >= transcription.OVERLAP_SECONDS
+    last_start, last_samples, _ = segments[-1]
+    assert last_start + len(last_samples) / RATE == pytest.approx(72.21, abs=0.01)
+
+
+def test_pack_segments_packs_short_segments_and_keeps_their_times(transcription):
+    gap = transcription.VAD_GAP_SECONDS
+    segments = [
+        (1.0, tone(2), False), (10.0, tone(3), False),  # packed together
+        (20.0, tone(30), False), (45.0, tone(10), True),  # one long segment, cut in two
+        (60.0, tone(1), False),
+    ]
+    windows = list(transcription.pack_segments(iter(segments), RATE, transcription.StageTimer()))
+    assert [(w[0], len(w[1]) / RATE, w[2], w[3]) for w in windows] == [
+        (1.0, 5 + gap, False, False), (20.0, 30.0, False, True), (45.0, 10.0, True, False), (60.0, 1.0, False, False),
+    ]
+    assert windows[0][4] == [(0.0, 1.0, 2.0), (2.0 + gap, 10.0, 3.0)]
+    assert windows[1][4] is None and windows[3][4] == [(0.0, 60.0, 1.0)]
+
+
+def test_drop_overlap_removes_the_repeated_words(transcription):
+    assert transcription.drop_overlap("the cat sat on the mat", "on the mat and slept") == "and slept"
+    assert transcription.drop_overlap("the cat sat", "sat down") == "sat down"  # one word is not a match
+    assert transcription.drop_overlap("a b c", "  d e ") == "d e"
+
+
+def test_stitch_window_without_timestamps_drops_the_overlap(transcription):
+    output = {"text": " sat on the mat and slept", "offsets": []}
+    text, start, end = transcription.stitch_window(25.0, tone(30), True, False, None, output, "the cat sat on the mat")
+    assert text == "and slept"
+    assert (start, end) == (25.0 + transcription.OVERLAP_SECONDS / 2, 55.0)
+
+
+def test_stitch_window_with_timestamps_keeps_the_segments_it_owns(transcription):
+    output = {"text": "", "offsets": [
+        {"text": " one", "timestamp": (0.0, 2.0)},  # middle in the first half of the overlap
+        {"text": " two", "timestamp": (3.0, 10.0)},
+        {"text": " three", "timestamp": (26.0, 29.0)},  # middle past the next window's share
+    ]}
+    text, start, end = transcription.stitch_window(25.0, tone(30), True, True, None, output, "")
+    assert (text, start, end) == ("two", 28.0, 35.0)
+
+
+def test_stitch_window_maps_packed_times_back_to_the_audio(transcription):
+    spans = [(0.0, 1.0, 2.0), (2.3, 10.0, 3.0)]
+    output = {"text": " hello there", "offsets": [
+        {"text": " hello", "timestamp": (0.5, 1.5)},
+        {"text": " there", "timestamp": (2.5, 4.0)},
+    ]}
+    text, start, end = transcription.stitch_window(1.0, tone(5.3), False, False, spans, output, "")
+    assert (text, start, end) == ("hello there", 1.5, pytest.approx(11.7))
+    text, start, end = transcription.stitch_window(1.0, tone(5.3), False, False, spans, dict(output, offsets=[]), "")
+    assert (start, end) == (1.0, 13.0)
+
+
+def test_log_mel_frontend_matches_the_whisper_feature_extractor(transcription):
+    transformers = pytest.importorskip("transformers")
+
+    extractor = transformers.WhisperFeatureExtractor()
+    rng = np.random.default_rng(0)
+    windows = [
+        np.concatenate([tone(3), 0.05 * rng.standard_normal(RATE).astype(np.float32), quiet(2)]),
+        0.2 * rng.standard_normal(30 * RATE).astype(np.float32),
+        tone(0.5),
+    ]
+    expected = extractor(windows, sampling_rate=RATE, return_tensors="np").input_features
+    features = transcription.LogMelFrontend(extractor, "cpu")(windows).numpy()
+    assert features.shape == expected.shape
+    np.testing.assert_allclose(features, expected, atol=1e-3)
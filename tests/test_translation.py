@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Dr. Rao arrived. He sat down.", ["Dr. Rao arrived.", "He sat down."]),
+    ("The U.S. policy changed. Prices rose.", ["The U.S. policy changed.", "Prices rose."]),
+    ("Use a guard, e.g. this one. It works.", ["Use a guard, e.g. this one.", "It works."]),
+    ("J. R. R. Tolkien wrote it.", ["J. R. R. Tolkien wrote it."]),
+    ("It ended at 5 p.m. and we left.", ["It ended at 5 p.m. and we left."]),
+    ("Is it done? Yes! Good.", ["Is it done?", "Yes!", "Good."]),
+    ("He said No. Then he left.", ["He said No.", "Then he left."]),
+    ("Take bus No. 5 home.", ["Take bus No. 5 home."]),
+    ("ನಮಸ್ಕಾರ। ನೀವು ಹೇಗಿದ್ದೀರಿ?", ["ನಮಸ್ಕಾರ।", "ನೀವು ಹೇಗಿದ್ದೀರಿ?"]),
+])
+def test_split_sentences_keeps_abbreviations_and_initials(translation, text, expected):
+    sentences, separators = translation.split_sentences(text)
+    assert sentences == expected
+    assert separators == [" "] * (len(expected) - 1)
+
+
+def test_split_sentences_keeps_paragraph_breaks(translation):
+    sentences, separators = translation.split_sentences("First line, Dr.\n\nSecond  line.")
+    assert sentences == ["First line, Dr.", "Second line."]
+    assert separators == ["\n\n"]
+
+
+def test_translate_reports_generate_time_as_decode_ms(translation):
+    translator = object.__new__(translation.KannadaTranslator)
+    translator.cache = translation.TranslationCache(max_size=0, db_path="")
+    translator.directions = {"en": ("en-kn", None), "kn": ("kn-en", None)}
+    translator.decode_stats, translator._stats_lock = {}, threading.Lock()
+    translator._fit = lambda sentence: [sentence]
+
+    def submit_buckets(lang, sentences, decoding):
+        future = Future()
+        spans = dict(preprocess=0.5, generate=2.0, postprocess=0.25, tokens=7)
+        future.set_result(([s.upper() for s in sentences], spans))
+        return [(sentences, future)]
+
+    translator._submit_buckets = submit_buckets
+    report = {}
+    assert translator.translate(["Hello there."], report=report) == ["HELLO THERE."]
+    assert report["decode_ms"] == 2000.0
+    assert report["stages_ms"] == {"preprocess": 500.0, "generate": 2000.0, "postprocess": 250.0}
+    assert translator.decode_stats[translation.DEFAULT_PROFILE]["decode_ms"] == 2000.0
+
+
+def test_translation_cache_store_uses_wal_and_a_busy_timeout(translation, tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = translation.TranslationCache(max_size=8, db_path=path)
+    cache.put_many("en-kn", [("hello", "ನಮಸ್ಕಾರ")])
+    assert cache._db.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    assert cache._db.execute("PRAGMA busy_timeout").fetchone() == (translation.CACHE_DB_TIMEOUT * 1000,)
+    assert translation.TranslationCache(max_size=8, db_path=path).get_many("en-kn", ["hello"]) == {"hello": "ನಮಸ್ಕಾರ"}
+
+
+def test_translation_cache_store_errors_are_misses(translation, tmp_path):
+    cache = translation.TranslationCache(max_size=8, db_path=str(tmp_path / "cache.db"))
+    cache.put_many("en-kn", [("hello", "ನಮಸ್ಕಾರ")])
+    cache._entries.clear()
+    cache._db.execute("DROP TABLE translations")
+    assert cache.get_many("en-kn", ["hello", "bye"]) == {}
+    assert cache.misses == 2
+    cache.put_many("en-kn", [("bye", "ಹೋಗಿ ಬನ್ನಿ")])  # the store fails, the LRU still gets it
+    assert cache.get_many("en-kn", ["bye"]) == {"bye": "ಹೋಗಿ ಬನ್ನಿ"}
+
+
+def test_model_size_counts_packed_int8_weights(translation):
+    import torch
+
+    model = torch.nn.Sequential(torch.nn.Linear(512, 1024), torch.nn.ReLU(), torch.nn.Linear(1024, 512))
+    assert translation.model_size_mb(model) == 4.0
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    assert translation.model_size_mb(quantized) == 1.0